@@ -0,0 +1,1005 @@
+import os
+import queue
+import threading
+import time
+from collections import deque, OrderedDict
+from itertools import count, islice
+
+import numpy as np
+
+from spectral_io import AsyncFileWriter, CONTAINER_EXTENSION, read_container, write_container
+
+########################################################################
+# DEMO SPECTRUM
+########################################################################
+
+def demo_spectrum(n_pixels=3648):
+    """Generate a synthetic spectrum for demo mode."""
+    wavelengths = np.linspace(400, 800, n_pixels)  # Simulate a typical spectrometer wavelength range
+    return np.sin(0.01 * wavelengths) + np.random.normal(0, 0.1, wavelengths.shape)
+
+########################################################################
+# SIMULATED SPECTROMETER
+########################################################################
+
+class _SimulatedDataBuffer:
+    """Mimics seabreeze's data_buffer feature on top of SimulatedSpectrometer."""
+    def __init__(self, device, capacity):
+        self._device = device
+        self._capacity = capacity
+        self._maximum = capacity
+
+    def clear(self):
+        self._device._buffer.clear()
+        self._device._armed_at = None
+        self._device._produced = 0
+
+    def get_number_of_elements(self):
+        self._device._fill_buffer()
+        return len(self._device._buffer)
+
+    def get_buffer_capacity(self):
+        return self._capacity
+
+    def get_buffer_capacity_maximum(self):
+        return self._maximum
+
+    def set_buffer_capacity(self, capacity):
+        if capacity > self._maximum:
+            raise ValueError(f"Buffer capacity {capacity} exceeds the maximum of {self._maximum}")
+        self._capacity = capacity
+
+
+class _SimulatedFastBuffer:
+    """Mimics seabreeze's fast_buffer feature on top of SimulatedSpectrometer."""
+    def __init__(self, device):
+        self._device = device
+
+    def get_buffering_enable(self):
+        return self._device._buffering
+
+    def set_buffering_enable(self, enable):
+        self._device._buffering = bool(enable)
+        self._device._armed_at = time.monotonic() if enable else None
+        if enable:
+            self._device._produced = 0
+
+    def get_consecutive_sample_count(self):
+        return self._device._consecutive
+
+    def set_consecutive_sample_count(self, n):
+        self._device._consecutive = int(n)
+
+
+class _SimulatedShutter:
+    """Mimics seabreeze's shutter feature: a closed shutter leaves only the dark signal."""
+    def __init__(self, device):
+        self._device = device
+
+    def set_shutter_open(self, state):
+        self._device.light_on = bool(state)
+
+
+class _SimulatedSpectrometerFeature:
+    """The part of seabreeze's spectrometer feature that reports the optically masked pixels."""
+    def __init__(self, device):
+        self._device = device
+
+    def get_electric_dark_pixel_indices(self):
+        return list(range(self._device.electric_dark_pixels))
+
+
+class SimulatedSpectrometer:
+    """Local stand-in for seabreeze's Spectrometer, with optional onboard buffer, drifting dark and shutter."""
+    model = "QE-PRO (simulated)"
+
+    def __init__(self, serial_number="DEMO", pixels=3648, buffer_capacity=None, read_latency_s=0.0,
+                 dark_counts=0.0, dark_drift_counts_per_s=0.0, electric_dark_pixels=0, fade_s=None):
+        self.serial_number = serial_number
+        self.pixels = pixels
+        self.read_latency_s = read_latency_s
+        self.dark_counts = dark_counts
+        self.dark_drift_counts_per_s = dark_drift_counts_per_s
+        self.electric_dark_pixels = electric_dark_pixels
+        self.fade_s = fade_s
+        self.light_on = True
+        self._created = time.monotonic()
+        self._wavelengths = np.linspace(400, 800, pixels)
+        self._integration_time_us = 10_000
+        self._buffer = []
+        self._buffering = False
+        self._consecutive = 1
+        self._armed_at = None
+        self._produced = 0
+        self.features = {'data_buffer': [], 'fast_buffer': [], 'shutter': [_SimulatedShutter(self)],
+                         'spectrometer': [_SimulatedSpectrometerFeature(self)]}
+        if buffer_capacity:
+            self.features['data_buffer'].append(_SimulatedDataBuffer(self, buffer_capacity))
+            self.features['fast_buffer'].append(_SimulatedFastBuffer(self))
+
+    def wavelengths(self):
+        return self._wavelengths.copy()
+
+    def integration_time_micros(self, integration_time_us):
+        self._integration_time_us = int(integration_time_us)
+
+    def dark_level(self, t=None):
+        """Dark counts at time `t` (time.monotonic(), default now)."""
+        t = time.monotonic() if t is None else t
+        return self.dark_counts + self.dark_drift_counts_per_s * (t - self._created)
+
+    def _signal(self):
+        return 1000 * np.exp(-0.5 * ((self._wavelengths - 600) / 30) ** 2)
+
+    def _spectrum(self):
+        spectrum = np.random.normal(self.dark_level(), 5, self.pixels)
+        if self.light_on:
+            signal = self._signal()
+            if self.fade_s:
+                signal *= 0.5 + 0.5 * np.exp(-(time.monotonic() - self._created) / self.fade_s)
+            signal[:self.electric_dark_pixels] = 0.0
+            spectrum += signal
+        return spectrum
+
+    def _fill_buffer(self):
+        """Add the spectra the device has integrated since buffering was armed."""
+        if not self._buffering or self._armed_at is None:
+            return
+        integration_s = self._integration_time_us / 1_000_000
+        done = int((time.monotonic() - self._armed_at) / integration_s)
+        capacity = self.features['data_buffer'][0].get_buffer_capacity()
+        target = min(done, self._consecutive)
+        while self._produced < target and len(self._buffer) < capacity:
+            self._buffer.append(self._spectrum())
+            self._produced += 1
+
+    def intensities(self):
+        if self._buffering:
+            integration_s = self._integration_time_us / 1_000_000
+            self._fill_buffer()
+            while not self._buffer:
+                time.sleep(integration_s / 4)
+                self._fill_buffer()
+            time.sleep(self.read_latency_s)
+            return self._buffer.pop(0)
+        time.sleep(self._integration_time_us / 1_000_000 + self.read_latency_s)
+        return self._spectrum()
+
+########################################################################
+# WAVELENGTH CALIBRATION
+########################################################################
+
+class DeviceCalibration:
+    """Wavelength calibration of one device, read once and kept read-only."""
+    def __init__(self, serial_number, wavelengths):
+        self.serial_number = serial_number
+        self.wavelengths = np.array(wavelengths, dtype=np.float64)
+        self.wavelengths.setflags(write=False)
+        self.pixels = self.wavelengths.size
+        # Fitted to the axis read above, not the calibration coefficients stored on the device
+        self.coefficients = np.polynomial.polynomial.polyfit(np.arange(self.pixels), self.wavelengths, 3)
+        self.coefficients.setflags(write=False)
+
+
+class CalibrationCache:
+    """Per-device wavelength calibrations keyed by serial number; invalidate() them on reconnect."""
+    def __init__(self):
+        self._calibrations = {}
+        self._lock = threading.Lock()
+
+    def get(self, spectrometer):
+        """Calibration of `spectrometer`, reading it from the device on a cache miss."""
+        serial_number = spectrometer.serial_number
+        with self._lock:
+            calibration = self._calibrations.get(serial_number)
+            if calibration is None:
+                calibration = DeviceCalibration(serial_number, spectrometer.wavelengths())
+                self._calibrations[serial_number] = calibration
+            return calibration
+
+    def demo(self, n_pixels=3648):
+        """Simulated 400-800 nm calibration used in demo mode."""
+        key = ("DEMO", n_pixels)
+        with self._lock:
+            calibration = self._calibrations.get(key)
+            if calibration is None:
+                calibration = DeviceCalibration("DEMO", np.linspace(400, 800, n_pixels))
+                self._calibrations[key] = calibration
+            return calibration
+
+    def invalidate(self, serial_number=None):
+        """Forget one device's calibration, or all of them if no serial number is given."""
+        with self._lock:
+            if serial_number is None:
+                self._calibrations.clear()
+            else:
+                self._calibrations.pop(serial_number, None)
+
+########################################################################
+# ACQUISITION RECORDS
+########################################################################
+
+def _frozen(array):
+    """Read-only float64 copy of `array` (None stays None)."""
+    if array is None:
+        return None
+    array = np.array(array, dtype=np.float64)
+    array.setflags(write=False)
+    return array
+
+
+class AcquisitionRecord:
+    """Read-only snapshot of one finished acquisition and the spectra derived from it."""
+    def __init__(self, version, kind, wavelengths, raw, stderr=None, dark=None, reference=None,
+                 derived=None, metadata=None, timestamps=None):
+        self.version = version
+        self.kind = kind
+        self.wavelengths = _frozen(wavelengths)
+        self.raw = _frozen(raw)
+        self.stderr = _frozen(stderr)
+        self.dark = _frozen(dark)
+        self.reference = _frozen(reference)
+        self.derived = {name: _frozen(array) for name, array in (derived or {}).items()}
+        self.metadata = dict(metadata or {})
+        self.timestamps = _frozen(timestamps)
+
+    def arrays(self):
+        """(name, array) of every per-pixel array held: raw, stderr, dark, reference, then the derived spectra."""
+        arrays = [("Raw", self.raw), ("Stderr", self.stderr), ("Dark", self.dark), ("Reference", self.reference)]
+        arrays += [(name[:1].upper() + name[1:], array) for name, array in self.derived.items()]
+        return [(name, array) for name, array in arrays
+                if array is not None and array.shape == self.wavelengths.shape]
+
+########################################################################
+# DARK FRAME LIBRARY
+########################################################################
+
+def detector_temperature(spectrometer):
+    """Detector temperature (degrees C) from the device's thermo_electric feature, None if it has none."""
+    features = getattr(spectrometer, 'features', None) or {}
+    thermo_electric = (features.get('thermo_electric') or [None])[0]
+    if thermo_electric is None:
+        return None
+    try:
+        return float(thermo_electric.read_temperature_degrees_celsius())
+    except Exception:
+        return None  # Some firmware refuses the read while the cooler settles
+
+
+class DarkFrame:
+    """Read-only dark spectrum of one set of acquisition settings, with where and when it came from."""
+    def __init__(self, key, mean, stderr=None, source="acquired", acquired=None):
+        self.key = key
+        self.mean = _frozen(mean)
+        self.stderr = _frozen(stderr)
+        self.source = source
+        self.acquired = acquired
+
+    @property
+    def integration_time_us(self):
+        return self.key[1]
+
+    def description(self):
+        """`source` and when the dark was taken, e.g. for the metadata of spectra corrected with it."""
+        if self.acquired is None:
+            return f"{self.source}, time unknown"
+        return f"{self.source}, taken {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.acquired))}"
+
+
+class DarkLibrary:
+    """LRU cache of dark spectra keyed by device, integration time, averaging and temperature."""
+    def __init__(self, capacity=16, directory=None, temperature_step_c=1.0, max_age_s=None):
+        self.capacity = max(int(capacity), 1)
+        self.directory = directory
+        self.temperature_step_c = temperature_step_c
+        self.max_age_s = max_age_s
+        self._frames = OrderedDict()  # Least recently used first
+        self._files = {}  # Key -> path of every dark saved in `directory`
+        self._file_times = {}  # Key -> when the dark saved in `directory` was taken, None if unknown
+        self._lock = threading.Lock()
+        if directory is not None and os.path.isdir(directory):
+            for name in sorted(os.listdir(directory)):
+                if name.endswith(CONTAINER_EXTENSION):
+                    path = os.path.join(directory, name)
+                    try:
+                        metadata = read_container(path).metadata
+                        key = tuple(metadata['Key'])
+                    except (OSError, ValueError, KeyError, TypeError):
+                        continue  # Not a dark saved by this class
+                    self._files[key] = path
+                    self._file_times[key] = metadata.get('Acquired')
+
+    def key(self, serial_number, integration_time_us, n_average, temperature_c=None):
+        """Library key of a set of acquisition settings; `temperature_c` is None without a cooler."""
+        if temperature_c is not None:
+            temperature_c = round(temperature_c / self.temperature_step_c) * self.temperature_step_c + 0.0
+        return (str(serial_number), int(integration_time_us), int(n_average), temperature_c)
+
+    def put(self, key, mean, stderr=None, acquired=None):
+        """Store the dark of `key` in memory, replacing any previous one; `acquired` defaults to now."""
+        frame = DarkFrame(key, mean, stderr, acquired=time.time() if acquired is None else acquired)
+        with self._lock:
+            self._frames[key] = frame
+            self._frames.move_to_end(key)
+            while len(self._frames) > self.capacity:
+                self._frames.popitem(last=False)
+        return frame
+
+    def save(self, frame, wavelengths=None):
+        """Write `frame` to the library's directory, replacing the file of any earlier dark of its key."""
+        if self.directory is None:
+            raise ValueError("The dark library has no directory to save to")
+        os.makedirs(self.directory, exist_ok=True)
+        serial_number, integration_time_us, n_average, temperature_c = frame.key
+        temperature = "ambient" if temperature_c is None else f"{temperature_c:g}C"
+        name = f"dark_{serial_number}_{integration_time_us}us_{n_average}x_{temperature}{CONTAINER_EXTENSION}"
+        path = os.path.join(self.directory, name)
+        if wavelengths is None:
+            wavelengths = np.arange(frame.mean.size, dtype=np.float64)
+        spectra = [frame.mean] if frame.stderr is None else [frame.mean, frame.stderr]
+        write_container(path, wavelengths, spectra, metadata={'Key': list(frame.key), 'Acquired': frame.acquired})
+        with self._lock:
+            self._files[frame.key] = path
+            self._file_times[frame.key] = frame.acquired
+
+    def _expired(self, key):
+        """True if the dark of `key` is older than max_age_s, or of unknown age while a limit is set."""
+        if self.max_age_s is None:
+            return False
+        frame = self._frames.get(key)
+        acquired = frame.acquired if frame is not None else self._file_times.get(key)
+        return acquired is None or time.time() - acquired > self.max_age_s
+
+    def get(self, key):
+        """Dark stored under exactly `key`, or None (also when it is too old)."""
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key):
+        if self._expired(key):
+            return None
+        frame = self._frames.get(key)
+        if frame is not None:
+            self._frames.move_to_end(key)
+            return frame
+        path = self._files.get(key)
+        if path is None:
+            return None
+        try:
+            frames = read_container(path).frames
+        except (OSError, ValueError):
+            return None
+        frame = DarkFrame(key, frames[0], frames[1] if len(frames) > 1 else None, acquired=self._file_times.get(key))
+        self._frames[key] = frame
+        while len(self._frames) > self.capacity:
+            self._frames.popitem(last=False)
+        return frame
+
+    def find(self, serial_number, integration_time_us, n_average=None, temperature_c=None):
+        """Dark for these settings, interpolated between integration times if needed, or None."""
+        key = self.key(serial_number, integration_time_us, n_average or 0, temperature_c)
+        serial_number, integration_time_us, _, temperature_c = key
+        with self._lock:
+            candidates = {}  # Integration time -> best key
+            for other in set(self._frames) | set(self._files):
+                if other[0] != serial_number or other[3] != temperature_c:
+                    continue
+                if n_average is not None and other[2] != key[2]:
+                    continue
+                if self._expired(other):
+                    continue
+                best = candidates.get(other[1])
+                if best is None or other[2] > best[2]:
+                    candidates[other[1]] = other
+            if integration_time_us in candidates:
+                return self._get(candidates[integration_time_us])
+            shorter = [t for t in candidates if t < integration_time_us]
+            longer = [t for t in candidates if t > integration_time_us]
+            if not shorter or not longer:
+                return None  # No extrapolation
+            low = self._get(candidates[max(shorter)])
+            high = self._get(candidates[min(longer)])
+        if low is None or high is None or low.mean.size != high.mean.size:
+            return None
+        fraction = (integration_time_us - low.integration_time_us) / (high.integration_time_us - low.integration_time_us)
+        mean = (1 - fraction) * low.mean + fraction * high.mean
+        stderr = None
+        if low.stderr is not None and high.stderr is not None:
+            stderr = np.hypot((1 - fraction) * low.stderr, fraction * high.stderr)
+        source = (f"interpolated between {low.integration_time_us / 1e3:g} ms and "
+                  f"{high.integration_time_us / 1e3:g} ms")
+        acquired = None if low.acquired is None or high.acquired is None else min(low.acquired, high.acquired)
+        return DarkFrame(key, mean, stderr, source, acquired)
+
+    def keys(self):
+        """Keys of every stored dark, in memory or on disk."""
+        with self._lock:
+            return sorted(set(self._frames) | set(self._files), key=str)
+
+    def __len__(self):
+        return len(self.keys())
+
+########################################################################
+# INTERLEAVED DARKS
+########################################################################
+
+def set_light_source(spectrometer, on):
+    """Switch the shutter and lamp output of a device; False if it has neither."""
+    features = getattr(spectrometer, 'features', None) or {}
+    switched = False
+    for shutter in features.get('shutter') or []:
+        shutter.set_shutter_open(bool(on))
+        switched = True
+    for lamp in features.get('strobe_lamp') or []:
+        lamp.enable_lamp(bool(on))
+        switched = True
+    return switched
+
+
+def electric_dark_pixels(spectrometer):
+    """Indices of the optically masked pixels of the detector; empty if the device reports none."""
+    features = getattr(spectrometer, 'features', None) or {}
+    feature = (features.get('spectrometer') or [None])[0]
+    try:
+        return np.asarray(feature.get_electric_dark_pixel_indices(), dtype=int)
+    except Exception:
+        return np.empty(0, dtype=int)
+
+
+class DarkScheduler:
+    """Decides when a long run stops to take a dark: by frame count, elapsed time or dark drift."""
+    smoothing = 0.2  # Weight of the newest frame in the smoothed dark level
+
+    def __init__(self, every_frames=None, every_s=None, drift_counts=None, dark_pixels=None, settle_s=0.0,
+                 interpolate=True):
+        self.every_frames = every_frames
+        self.every_s = every_s
+        self.drift_counts = drift_counts
+        self.settle_s = settle_s
+        self.interpolate = interpolate
+        self.dark_pixels = np.asarray(dark_pixels if dark_pixels is not None else [], dtype=int)
+        if drift_counts is not None and self.dark_pixels.size == 0:
+            raise ValueError("Drift detection needs the masked (electric dark) pixels of the detector")
+        self._frames = 0
+        self._last_dark_t = None
+        self._dark_level = None
+        self._level = None
+
+    def dark_taken(self, t, dark):
+        """Restart the counters after a dark taken at time `t`."""
+        self._frames = 0
+        self._last_dark_t = t
+        if self.dark_pixels.size:
+            self._dark_level = self._level = float(np.mean(dark[self.dark_pixels]))
+
+    def due(self, t, spectrum):
+        """Register a data frame taken at `t`; returns 'start', 'frames', 'time' or 'drift' if a dark is due."""
+        self._frames += 1
+        if self._last_dark_t is None:
+            return 'start'
+        if self.dark_pixels.size:
+            level = float(np.mean(spectrum[self.dark_pixels]))
+            self._level += self.smoothing * (level - self._level)
+        if self.every_frames is not None and self._frames >= self.every_frames:
+            return 'frames'
+        if self.every_s is not None and t - self._last_dark_t >= self.every_s:
+            return 'time'
+        if self.drift_counts is not None and abs(self._level - self._dark_level) > self.drift_counts:
+            return 'drift'
+        return None
+
+
+class DarkTimeline:
+    """Darks taken during one run, and the data frames still waiting for the next one."""
+    def __init__(self, interpolate=True):
+        self.interpolate = interpolate
+        self.times = []
+        self.darks = []
+        self._pending = []  # (t, tag)
+
+    @property
+    def latest(self):
+        return self.darks[-1] if self.darks else None
+
+    def add_frame(self, t, tag):
+        """Queue the data frame `tag` taken (mid-exposure) at time `t`."""
+        if not self.darks:
+            raise RuntimeError("Take a dark before the first data frame")
+        self._pending.append((t, tag))
+
+    def add_dark(self, t, dark):
+        """Add a dark taken at time `t`; returns (tag, dark to subtract) for the queued frames."""
+        dark = np.array(dark, dtype=np.float64)
+        pending, self._pending = self._pending, []
+        before = (self.times[-1], self.darks[-1]) if self.darks else None
+        self.times.append(t)
+        self.darks.append(dark)
+        return self._corrections(pending, before, t, dark)
+
+    def _corrections(self, pending, before, t, dark):
+        if before is None:
+            return
+        t_before, dark_before = before
+        span = t - t_before
+        step = dark - dark_before
+        for t_frame, tag in pending:
+            fraction = min(max((t_frame - t_before) / span, 0.0), 1.0) if span > 0 else 1.0
+            if not self.interpolate:
+                fraction = round(fraction)
+            yield tag, dark_before + fraction * step
+
+    def finish(self):
+        """(tag, last dark) for the frames still queued, e.g. when a run is cancelled."""
+        pending, self._pending = self._pending, []
+        return [(tag, self.darks[-1]) for _, tag in pending]
+
+    @property
+    def n_pending(self):
+        return len(self._pending)
+
+########################################################################
+# RUNNING AVERAGE
+########################################################################
+
+class RunningAverage:
+    """Streaming per-pixel mean and variance (Welford) in preallocated float64 arrays."""
+    def __init__(self, n_pixels=None):
+        self.count = 0
+        self.timing = None  # Timing report of the acquisition that filled it, if any
+        self.timestamps = None  # Mid-exposure time of every scan (s since the start), if recorded
+        self._mean = None
+        if n_pixels:
+            self._allocate(n_pixels)
+
+    def _allocate(self, n_pixels):
+        self._mean = np.zeros(n_pixels, dtype=np.float64)
+        self._m2 = np.zeros(n_pixels, dtype=np.float64)
+        self._delta = np.empty(n_pixels, dtype=np.float64)
+        self._scratch = np.empty(n_pixels, dtype=np.float64)
+
+    def add(self, spectrum):
+        """Fold one scan into the running statistics."""
+        x = np.asarray(spectrum, dtype=np.float64)
+        if self._mean is None:
+            self._allocate(x.size)
+        self.count += 1
+        np.subtract(x, self._mean, out=self._delta)
+        np.multiply(self._delta, 1.0 / self.count, out=self._scratch)
+        self._mean += self._scratch
+        np.subtract(x, self._mean, out=self._scratch)
+        self._scratch *= self._delta
+        self._m2 += self._scratch
+
+    def add_block(self, spectra):
+        """Fold a (scans, pixels) block of scans in at once, merging its statistics (Chan et al.)."""
+        x = np.asarray(spectra, dtype=np.float64)
+        n = x.shape[0]
+        if n == 0:
+            return
+        if self._mean is None:
+            self._allocate(x.shape[1])
+        block_mean = x.mean(axis=0)
+        total = self.count + n
+        np.subtract(block_mean, self._mean, out=self._delta)
+        np.multiply(self._delta, n / total, out=self._scratch)
+        self._mean += self._scratch
+        self._m2 += ((x - block_mean) ** 2).sum(axis=0)
+        self._m2 += self._delta ** 2 * (self.count * n / total)
+        self.count = total
+
+    @property
+    def n_pixels(self):
+        return 0 if self._mean is None else self._mean.size
+
+    @property
+    def mean(self):
+        """Per-pixel mean of all scans added so far."""
+        return self._mean.copy()
+
+    @property
+    def sum(self):
+        """Per-pixel sum of all scans added so far."""
+        return self._mean * self.count
+
+    @property
+    def variance(self):
+        """Per-pixel sample variance; zero until at least two scans are added."""
+        if self.count < 2:
+            return np.zeros_like(self._mean)
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        """Per-pixel standard deviation of a single scan."""
+        return np.sqrt(self.variance)
+
+    @property
+    def stderr(self):
+        """Per-pixel standard error of the mean."""
+        return self.std / np.sqrt(max(self.count, 1))
+
+########################################################################
+# SCHEDULING
+########################################################################
+
+class AcquisitionScheduler:
+    """Pace `n_frames` scans on absolute deadlines t0 + k * interval, recording their timing."""
+    spin_s = 0.002  # Final stretch before a deadline is busy-waited for sub-ms accuracy
+
+    def __init__(self, interval_s, n_frames, clock=time.monotonic):
+        self.interval_s = interval_s
+        self.clock = clock
+        self.deadlines = np.zeros(n_frames)
+        self.starts = np.zeros(n_frames)
+        self.ends = np.zeros(n_frames)
+        self.n_done = 0
+        self.missed = 0
+        self._slot = 0
+        self.t0 = None
+
+    def wait_next(self, cancel_event=None):
+        """Block until the next frame is due. Returns False if cancelled meanwhile."""
+        now = self.clock()
+        if self.t0 is None:
+            self.t0 = now
+            self.deadlines[0] = now
+            return True
+        self._slot += 1
+        deadline = self.t0 + self._slot * self.interval_s
+        if now > deadline:
+            self.missed += 1
+            behind = int((now - deadline) // self.interval_s)
+            if behind:
+                # Skip the slots that already went by
+                self._slot += behind
+                self.missed += behind
+                deadline = self.t0 + self._slot * self.interval_s
+        else:
+            remaining = deadline - now - self.spin_s
+            if remaining > 0:
+                if cancel_event is not None:
+                    if cancel_event.wait(remaining):
+                        return False
+                else:
+                    time.sleep(remaining)
+            while self.clock() < deadline:
+                pass
+        self.deadlines[self.n_done] = deadline
+        return cancel_event is None or not cancel_event.is_set()
+
+    def new_block(self, n_frames):
+        """Record the next `n_frames` frames on the same grid; returns the report so far."""
+        report = self.report()
+        self.deadlines = np.zeros(n_frames)
+        self.starts = np.zeros(n_frames)
+        self.ends = np.zeros(n_frames)
+        self.n_done = 0
+        self.missed = 0
+        return report
+
+    def begin_frame(self):
+        self.starts[self.n_done] = self.clock()
+
+    def end_frame(self):
+        self.ends[self.n_done] = self.clock()
+        self.n_done += 1
+
+    def timestamps(self):
+        """Mid-exposure time of every completed frame, in seconds since the first deadline."""
+        n = self.n_done
+        return 0.5 * (self.starts[:n] + self.ends[:n]) - (self.t0 or 0.0)
+
+    def report(self):
+        """Summarise the timing of the completed frames."""
+        n = self.n_done
+        if n == 0:
+            return {'frames': 0}
+        lateness = self.starts[:n] - self.deadlines[:n]
+        elapsed = self.ends[n - 1] - self.starts[0]
+        busy = np.sum(self.ends[:n] - self.starts[:n])
+        return {
+            'frames': n,
+            'interval_s': self.interval_s,
+            'effective_interval_s': float(np.mean(np.diff(self.starts[:n]))) if n > 1 else 0.0,
+            'jitter_s': float(np.std(lateness)),
+            'max_lateness_s': float(np.max(lateness)),
+            'missed_deadlines': self.missed,
+            'duty_cycle': float(busy / elapsed) if elapsed > 0 else 1.0,
+        }
+
+
+def format_timing_report(report):
+    """One-line human readable version of a scheduler or burst timing report."""
+    if not report or report.get('frames', 0) < 2:
+        return ""
+    if 'burst' in report:
+        return (f"{report['frames']} scans in {report['elapsed_s'] * 1e3:.1f} ms "
+                f"({report['burst']} burst, {report['scan_rate_hz']:.1f} scans/s)")
+    return (f"{report['frames']} scans, interval {report['effective_interval_s'] * 1e3:.2f} ms "
+            f"(target {report['interval_s'] * 1e3:.2f} ms), jitter {report['jitter_s'] * 1e3:.3f} ms, "
+            f"missed {report['missed_deadlines']}, duty cycle {report['duty_cycle'] * 100:.1f}%")
+
+########################################################################
+# BURST ACQUISITION
+########################################################################
+
+def _buffer_features(spectrometer):
+    """Return the (data_buffer, fast_buffer) features of a device, None where missing."""
+    features = getattr(spectrometer, 'features', None) or {}
+    data_buffer = (features.get('data_buffer') or [None])[0]
+    fast_buffer = (features.get('fast_buffer') or [None])[0]
+    return data_buffer, fast_buffer
+
+
+def arm_buffer(spectrometer, n_scans):
+    """Arm the onboard buffer for `n_scans` back-to-back scans; False if the device cannot buffer."""
+    data_buffer, fast_buffer = _buffer_features(spectrometer)
+    if data_buffer is None or fast_buffer is None:
+        return False
+    try:
+        data_buffer.clear()
+        capacity = min(n_scans, data_buffer.get_buffer_capacity_maximum())
+        if data_buffer.get_buffer_capacity() < capacity:
+            data_buffer.set_buffer_capacity(capacity)
+        fast_buffer.set_consecutive_sample_count(n_scans)
+        fast_buffer.set_buffering_enable(True)
+    except Exception:
+        disarm_buffer(spectrometer)
+        return False
+    return True
+
+
+def disarm_buffer(spectrometer):
+    """Stop onboard buffering and discard whatever is left in the buffer."""
+    data_buffer, fast_buffer = _buffer_features(spectrometer)
+    try:
+        if fast_buffer is not None:
+            fast_buffer.set_buffering_enable(False)
+        if data_buffer is not None:
+            data_buffer.clear()
+    except Exception:
+        pass
+
+
+def acquire_burst(spectrometer, integration_time_us, n_scans, progress_callback=None, cancel_event=None):
+    """Average `n_scans` back-to-back scans, through the onboard buffer when the device has one."""
+    average = RunningAverage()
+    spectrometer.integration_time_micros(integration_time_us)
+    buffered = arm_buffer(spectrometer, n_scans)
+    data_buffer = _buffer_features(spectrometer)[0] if buffered else None
+    t0 = time.monotonic()
+    read_times = np.empty(n_scans)
+    done = 0
+    try:
+        while done < n_scans:
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            batch = 1
+            if data_buffer is not None:
+                # At least one, so an empty buffer blocks in intensities() until the next scan is in
+                batch = max(1, min(data_buffer.get_number_of_elements(), n_scans - done))
+            average.add_block([spectrometer.intensities() for _ in range(batch)])
+            read_times[done:done + batch] = time.monotonic() - t0
+            done += batch
+            if progress_callback is not None:
+                progress_callback(int(100 * done / n_scans))
+    finally:
+        if buffered:
+            disarm_buffer(spectrometer)
+    elapsed = time.monotonic() - t0
+    average.timing = {
+        'frames': n_scans,
+        'burst': 'hardware' if buffered else 'software',
+        'elapsed_s': elapsed,
+        'scan_rate_hz': n_scans / elapsed if elapsed > 0 else 0.0,
+    }
+    # Buffered scans are only seen when read out: without a device clock, spread them evenly over the burst
+    average.timestamps = ((np.arange(n_scans) + 0.5) * (elapsed / n_scans) if buffered
+                          else read_times - 0.5 * integration_time_us / 1e6)
+    return average
+
+########################################################################
+# AVERAGED ACQUISITION
+########################################################################
+
+def acquire_averaged_spectrum(spectrometer, integration_time_us, interval_s, max_samples, burst=False,
+                              progress_callback=None, cancel_event=None):
+    """Average `max_samples` scans taken every `interval_s` seconds; None if cancelled."""
+    average = RunningAverage()
+    if spectrometer is None:
+        # Demo mode: Generate synthetic spectra
+        for _ in islice(count(), max(max_samples, 1)):
+            average.add(demo_spectrum())
+        if progress_callback is not None:
+            progress_callback(100)
+        return average
+
+    spectrometer.integration_time_micros(integration_time_us)
+    if max_samples < 2:
+        average.add(spectrometer.intensities())
+        if progress_callback is not None:
+            progress_callback(100)
+        return average
+
+    if burst:
+        return acquire_burst(spectrometer, integration_time_us, max_samples, progress_callback, cancel_event)
+
+    scheduler = AcquisitionScheduler(interval_s, max_samples)
+    for i in islice(count(), max_samples):
+        if not scheduler.wait_next(cancel_event):
+            return None
+        scheduler.begin_frame()
+        spectrum = spectrometer.intensities()
+        scheduler.end_frame()
+        average.add(spectrum)
+        if progress_callback is not None:
+            progress_callback(int(100 * (i + 1) / max_samples))
+    average.timing = scheduler.report()
+    average.timestamps = scheduler.timestamps()
+    return average
+
+########################################################################
+# LIVE STREAMING
+########################################################################
+
+class SpectrumRingBuffer:
+    """Preallocated ring of the latest `capacity` spectra, addressed by an increasing sequence number."""
+    def __init__(self, capacity, n_pixels, dtype=np.float64):
+        self.capacity = capacity
+        self.n_pixels = n_pixels
+        self.data = np.zeros((capacity, n_pixels), dtype=dtype)
+        self.times = np.zeros(capacity)
+        self.count = 0  # Total number of frames pushed so far
+        self._lock = threading.Lock()
+
+    def push(self, spectrum, t=0.0):
+        """Copy `spectrum` (taken at time `t`) into the ring and return its sequence number."""
+        with self._lock:
+            seq = self.count
+            self.data[seq % self.capacity] = spectrum
+            self.times[seq % self.capacity] = t
+            self.count += 1
+        return seq
+
+    def frame(self, seq):
+        """Return a copy of frame `seq`, or None if it has been overwritten."""
+        with self._lock:
+            if seq < 0 or seq >= self.count or seq < self.count - self.capacity:
+                return None
+            return self.data[seq % self.capacity].copy()
+
+    def latest(self):
+        """Return a copy of the newest frame, or None if the ring is empty."""
+        return self.frame(self.count - 1)
+
+    def frames(self):
+        """Return the buffered frames, oldest first."""
+        with self._lock:
+            n = min(self.count, self.capacity)
+            start = self.count - n
+            order = np.arange(start, self.count) % self.capacity
+            return self.data[order]
+
+    def since(self, seq):
+        """(first sequence number, timestamps, frames) still buffered from `seq` on, oldest first."""
+        with self._lock:
+            first = max(seq, self.count - self.capacity, 0)
+            order = np.arange(first, self.count) % self.capacity
+            return first, self.times[order], self.data[order]
+
+
+def put_latest(channel, item):
+    """Put `item` on a bounded queue, dropping the oldest entry when it is full."""
+    while True:
+        try:
+            channel.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                channel.get_nowait()
+            except queue.Empty:
+                pass
+
+
+def stream_spectra(spectrometer, integration_time_us, ring, channel, cancel_event=None):
+    """Read spectra into `ring` until cancelled, posting each sequence number on `channel`."""
+    cancel_event = cancel_event or threading.Event()
+    if spectrometer is not None:
+        spectrometer.integration_time_micros(integration_time_us)
+    while not cancel_event.is_set():
+        if spectrometer is None:
+            # Demo mode: pace synthetic frames at the integration time
+            spectrum = demo_spectrum(ring.n_pixels)
+            cancel_event.wait(integration_time_us / 1_000_000)
+        else:
+            spectrum = spectrometer.intensities()
+        put_latest(channel, ring.push(spectrum))
+    return ring.count
+
+########################################################################
+# KINETICS
+########################################################################
+
+def average_scans(spectrometer, spectrum, n_average):
+    """Average `n_average` scans into the preallocated `spectrum`."""
+    spectrum[:] = spectrometer.intensities()
+    for _ in range(n_average - 1):
+        spectrum += spectrometer.intensities()
+    if n_average > 1:
+        spectrum /= n_average
+    return spectrum
+
+
+def background_writes(max_jobs=256):
+    """AsyncFileWriter for the disk writes of a run, and the list its errors are collected in."""
+    errors = []
+    writer = AsyncFileWriter(max_jobs, on_error=lambda description, message: errors.append(f"{description}: {message}"))
+    return writer, errors
+
+
+def finish_writes(writer, errors):
+    """Wait for the queued writes of a run and raise OSError if any of them failed."""
+    writer.close()
+    if errors:
+        raise OSError(errors[0])
+
+
+def _merge_timing(reports):
+    """One timing report for the blocks of an unbounded run (see AcquisitionScheduler.new_block)."""
+    reports = [report for report in reports if report.get('frames')]
+    if not reports:
+        return {'frames': 0}
+    frames = sum(report['frames'] for report in reports)
+    return {
+        'frames': frames,
+        'interval_s': reports[0]['interval_s'],
+        'effective_interval_s': sum(report['effective_interval_s'] * report['frames'] for report in reports) / frames,
+        'jitter_s': max(report['jitter_s'] for report in reports),
+        'max_lateness_s': max(report['max_lateness_s'] for report in reports),
+        'missed_deadlines': sum(report['missed_deadlines'] for report in reports),
+        'duty_cycle': sum(report['duty_cycle'] * report['frames'] for report in reports) / frames,
+    }
+
+
+def acquire_kinetics(spectrometer, integration_time_us, interval_s, n_average, writer, ring=None, wavelengths=None,
+                     max_frames=None, flush_interval_s=0.5, progress_callback=None, cancel_event=None):
+    """Take a frame of `n_average` scans every `interval_s` seconds, streaming them to `writer`."""
+    if interval_s <= 0:
+        raise ValueError("The kinetics interval must be positive")
+    n_average = max(int(n_average), 1)
+    spectrometer.integration_time_micros(integration_time_us)
+    if wavelengths is None:
+        wavelengths = spectrometer.wavelengths()
+    spectrum = np.empty(len(wavelengths), dtype=np.float64)
+    scheduler = AcquisitionScheduler(interval_s, writer.chunk_frames)
+    wall_offset = time.time() - time.monotonic()
+    reports = []
+    last_flush = time.monotonic()
+    n_frames = 0
+    disk, errors = background_writes()
+    try:
+        while (max_frames is None or n_frames < max_frames) and not errors:
+            if scheduler.n_done == len(scheduler.starts):
+                reports.append(scheduler.new_block(writer.chunk_frames))
+            if not scheduler.wait_next(cancel_event):
+                break
+            scheduler.begin_frame()
+            average_scans(spectrometer, spectrum, n_average)
+            scheduler.end_frame()
+            i = scheduler.n_done - 1
+            t = wall_offset + 0.5 * (scheduler.starts[i] + scheduler.ends[i])
+            disk.submit("Kinetics frame", writer.append, t, spectrum.copy())
+            if ring is not None:
+                ring.push(spectrum, t)
+            n_frames += 1
+            if scheduler.ends[i] - last_flush >= flush_interval_s:
+                disk.submit("Kinetics flush", writer.flush)
+                last_flush = scheduler.ends[i]
+            if progress_callback is not None and max_frames:
+                progress_callback(int(100 * n_frames / max_frames))
+    finally:
+        finish_writes(disk, errors)
+    writer.flush()
+    reports.append(scheduler.report())
+    writer.timing = _merge_timing(reports)
+    return writer.timing
@@ -0,0 +1,539 @@
+"""Micro-benchmarks: `python benchmarks.py [name ...]`; the ones in OPT_IN only run when named."""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from acquisition import acquire_kinetics, CalibrationCache, DarkScheduler, electric_dark_pixels, set_light_source, SimulatedSpectrometer, SpectrumRingBuffer
+from map_analysis import nmf, pca, WindowMaps
+from mapping import acquire_map, MapGrid, SimulatedEmitter, SimulatedStage, TRAJECTORIES
+from plotting import autoscale_limits, decimate_minmax, MapImage, SpectrumPlot, WaterfallView
+from spectral_io import CubeStore, KineticsRecording, KineticsWriter, read_container, trapezoid, write_container, write_spectrum_text
+
+
+def best_of(function, repeat=3):
+    """Best wall time of `repeat` calls of `function`, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+########################################################################
+# TEXT EXPORT
+########################################################################
+
+def legacy_write_text(save_file, wavelengths, intensities):
+    """The original exporter: one f.write per pixel."""
+    with open(save_file, mode='w') as f:
+        f.write("# Raw Spectrum (without dark background subtraction)\n")
+        f.write("# Wavelength\tIntensity\n")
+        for wavelength, intensity in zip(wavelengths, intensities):
+            f.write(f"{wavelength:0.2f}\t{intensity}\n")
+
+
+def bench_text_export():
+    print("Text export (best of 3)")
+    print(f"{'rows':>10} {'loop (ms)':>12} {'bulk (ms)':>12} {'speed-up':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "spectrum.txt")
+        for n_rows in (1_000, 10_000, 1_000_000):
+            wavelengths = np.linspace(200, 1000, n_rows)
+            intensities = np.random.normal(1000, 30, n_rows)
+            loop = best_of(lambda: legacy_write_text(path, wavelengths, intensities))
+            with open(path) as f:
+                expected = f.read()
+            bulk = best_of(lambda: write_spectrum_text(
+                path, ["# Raw Spectrum (without dark background subtraction)"], ["Wavelength", "Intensity"],
+                [wavelengths, intensities]))
+            with open(path) as f:
+                assert f.read() == expected, "bulk writer output differs from the loop"
+            print(f"{n_rows:>10} {loop * 1e3:>12.1f} {bulk * 1e3:>12.1f} {loop / bulk:>8.1f}x")
+
+
+########################################################################
+# BINARY CONTAINER
+########################################################################
+
+def bench_container():
+    print("Binary container round trip, 1044-pixel frames (best of 3)")
+    print(f"{'frames':>8} {'dtype':>8} {'MB':>8} {'write MB/s':>11} {'open (ms)':>10} {'scan MB/s':>10} "
+          f"{'txt write (s)':>14} {'txt load (s)':>13}")
+    wavelengths = np.linspace(200, 1000, 1044)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "frames.qspc")
+        text_path = os.path.join(tmp, "frames.txt")
+        for n_frames in (1_000, 10_000, 50_000):
+            for dtype in (np.float32, np.float64):
+                frames = np.random.normal(1000, 30, (n_frames, wavelengths.size)).astype(dtype)
+                megabytes = frames.nbytes / 1e6
+                write = best_of(lambda: write_container(path, wavelengths, frames, dtype))
+                opened = best_of(lambda: read_container(path))
+                container = read_container(path)
+                assert np.array_equal(container.frames, frames), "round trip changed the frames"
+                scan = best_of(lambda: float(read_container(path).frames.sum(dtype=np.float64)))
+                text_write = text_load = float("nan")
+                if n_frames == 1_000:
+                    # Same frames as one ASCII table (a column per frame) for comparison
+                    columns = [wavelengths] + list(frames)
+                    text_write = best_of(lambda: write_spectrum_text(
+                        text_path, [], ["Wavelength"] + [f"Frame {i}" for i in range(n_frames)], columns,
+                        ["%0.2f"] + ["%s"] * n_frames), repeat=1)
+                    text_load = best_of(lambda: np.loadtxt(text_path), repeat=1)
+                print(f"{n_frames:>8} {np.dtype(dtype).name:>8} {megabytes:>8.1f} {megabytes / write:>11.0f} "
+                      f"{opened * 1e3:>10.2f} {megabytes / scan:>10.0f} {text_write:>14.2f} {text_load:>13.2f}")
+
+
+########################################################################
+# PLOT UPDATES
+########################################################################
+
+def agg_canvas():
+    """Off-screen canvas shaped like the GUI's MplCanvas."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(5, 4), dpi=100, facecolor='black')
+    canvas = FigureCanvasAgg(fig)
+    canvas.axes = fig.add_subplot(111)
+    fig.subplots_adjust(left=0.1, right=0.9, top=0.95, bottom=0.125)
+    return canvas
+
+
+def legacy_update_plot(canvas, wavelengths, intensities):
+    """The original update_plot: clear and rebuild the axes, then a full draw."""
+    ax = canvas.axes
+    ax.clear()
+    ax.set_facecolor('black')
+    ax.plot(wavelengths, intensities, label='Emission Spectrum', color='cyan')
+    ax.yaxis.grid(True, linestyle='--', color='gray')
+    ax.xaxis.grid(True, linestyle='--', color='gray')
+    intensity_range = max(intensities) - min(intensities)
+    buffer = intensity_range * 0.05
+    ax.set_ylim(ymin=min(intensities) - buffer, ymax=max(intensities) + buffer)
+    ax.set_xlabel('Wavelength (nm)', fontsize=14, color="white", labelpad=5.0)
+    ax.set_ylabel('Intensity (count)', fontsize=14, color="white", labelpad=1.5)
+    ax.tick_params(axis='both', labelsize=14, colors='white')
+    ax.legend(fontsize=14, loc='upper right', framealpha=0.5)
+    ax.annotate("+", xy=(0, 0), xytext=(0, 0), textcoords="offset points", visible=False)
+    ax.annotate("", xy=(0, 0), xytext=(0, 15), textcoords="offset points", visible=False)
+    canvas.draw()
+
+
+def bench_plot_update(n_frames=30):
+    print(f"Spectrum plot update, Agg 500x400 px (mean of {n_frames} frames)")
+    print(f"{'pixels':>8} {'clear+replot (ms)':>18} {'set_data (ms)':>14} {'speed-up':>9}")
+    for n_pixels in (1_000, 4_000, 16_000):
+        wavelengths = np.linspace(200, 1000, n_pixels)
+        frames = [np.random.normal(1000, 30, n_pixels) for _ in range(n_frames)]
+
+        canvas = agg_canvas()
+        t0 = time.perf_counter()
+        for frame in frames:
+            legacy_update_plot(canvas, wavelengths, frame)
+        legacy = (time.perf_counter() - t0) / n_frames
+
+        canvas = agg_canvas()
+        plot = SpectrumPlot(canvas)
+        plot.show('emission', wavelengths, frames[0], 'Emission Spectrum', 'cyan', 'Intensity (count)')
+        t0 = time.perf_counter()
+        for frame in frames:
+            plot.show('emission', wavelengths, frame, 'Emission Spectrum', 'cyan', 'Intensity (count)')
+        persistent = (time.perf_counter() - t0) / n_frames
+        print(f"{n_pixels:>8} {legacy * 1e3:>18.1f} {persistent * 1e3:>14.1f} {legacy / persistent:>8.1f}x")
+
+
+def bench_decimation():
+    print("Long trace, full vs min/max decimated line, Agg 500x400 px (best of 3)")
+    print(f"{'points':>10} {'drawn':>7} {'decimate (ms)':>14} {'full draw (ms)':>15} {'decimated (ms)':>15} "
+          f"{'speed-up':>9}")
+    for n_points in (10_000, 100_000, 1_000_000):
+        x = np.linspace(200, 1000, n_points)
+        y = np.random.normal(1000, 30, n_points)
+        y[n_points // 3] = 5000  # Single-sample spike that must survive decimation
+
+        canvas = agg_canvas()
+        line, = canvas.axes.plot(x, y)
+        canvas.draw()
+        full = best_of(canvas.draw)
+
+        canvas = agg_canvas()
+        plot = SpectrumPlot(canvas)
+        plot.show('trace', x, y, 'Trace', 'cyan', 'Intensity (count)')
+        canvas.draw()
+        drawn = plot.lines['trace'].get_xdata()
+        assert plot.lines['trace'].get_ydata().max() == y.max(), "decimation lost the spike"
+        decimated = best_of(canvas.draw)
+        decimate = best_of(lambda: decimate_minmax(x, y, plot._columns(), (x[0], x[-1])))
+        print(f"{n_points:>10} {len(drawn):>7} {decimate * 1e3:>14.2f} {full * 1e3:>15.1f} "
+              f"{decimated * 1e3:>15.1f} {full / (decimated + decimate):>8.1f}x")
+
+
+########################################################################
+# AUTOSCALING
+########################################################################
+
+def legacy_y_limits(y):
+    """The original per-plot limits: builtin max/min, called four times."""
+    intensity_range = max(y) - min(y)
+    buffer = intensity_range * 0.05
+    return min(y) - buffer, max(y) + buffer
+
+
+def bench_autoscale(n_calls=20):
+    print(f"Y-limits of one trace (mean of {n_calls} calls)")
+    print(f"{'points':>10} {'builtin (ms)':>13} {'numpy (ms)':>11} {'speed-up':>9} {'p99.9 clip (ms)':>16}")
+    for n_points in (1_044, 4_000, 100_000, 1_000_000):
+        y = np.random.normal(1000, 30, n_points)
+        assert np.allclose(legacy_y_limits(y), autoscale_limits(y)), "limits differ from the original"
+        calls = max(n_calls // (n_points // 100_000 + 1), 1)
+        legacy = best_of(lambda: [legacy_y_limits(y) for _ in range(calls)]) / calls
+        vectorized = best_of(lambda: [autoscale_limits(y) for _ in range(calls)]) / calls
+        clipped = best_of(lambda: [autoscale_limits(y, clip_percentile=99.9) for _ in range(calls)]) / calls
+        print(f"{n_points:>10} {legacy * 1e3:>13.3f} {vectorized * 1e3:>11.3f} {legacy / vectorized:>8.0f}x "
+              f"{clipped * 1e3:>16.3f}")
+
+
+########################################################################
+# LIVE MAP IMAGE
+########################################################################
+
+def bench_map_render(shape=(100, 100), refresh_s=0.2):
+    n_points = shape[0] * shape[1]
+    print(f"Live {shape[1]}x{shape[0]} map image, Agg 500x400 px, refresh every {refresh_s * 1e3:.0f} ms")
+    canvas = agg_canvas()
+    image = MapImage(canvas)
+    image.start(np.arange(shape[1]), np.arange(shape[0]))
+    values = np.random.normal(1000, 30, n_points)
+
+    t0 = time.perf_counter()
+    for i, value in enumerate(values):
+        image.set_point(i // shape[1], i % shape[1], value)
+    set_point = (time.perf_counter() - t0) / n_points
+
+    n_draws = 20
+    t0 = time.perf_counter()
+    for i in range(n_draws):
+        image.set_point(0, 0, values[i])
+        image.refresh()
+    refresh = (time.perf_counter() - t0) / n_draws
+    print(f"set_point {set_point * 1e6:.1f} us, refresh {refresh * 1e3:.1f} ms")
+
+    print(f"{'dwell (ms)':>11} {'acquire (s)':>12} {'redraw every point (s)':>23} {'coalesced (s)':>14} "
+          f"{'redraw/acquire':>15}")
+    for dwell_s in (0.001, 0.01, 0.1):
+        acquire = n_points * dwell_s
+        per_point = n_points * (refresh + set_point)
+        coalesced = np.ceil(acquire / refresh_s) * refresh + n_points * set_point
+        print(f"{dwell_s * 1e3:>11.0f} {acquire:>12.0f} {per_point:>23.0f} {coalesced:>14.1f} "
+              f"{coalesced / acquire * 100:>14.0f}%")
+
+
+########################################################################
+# WATERFALL
+########################################################################
+
+class LegacyWaterfall:
+    """The first kinetics waterfall: roll the history, hand it all to set_data and draw the whole canvas."""
+
+    def __init__(self, canvas, wavelengths, n_rows):
+        self.canvas = canvas
+        self.history = np.full((n_rows, len(wavelengths)), np.nan)
+        self.wavelengths = wavelengths
+        self.image = canvas.axes.imshow(np.ma.masked_invalid(self.history), origin='lower', aspect='auto',
+                                        extent=(wavelengths[0], wavelengths[-1], 0, 1), cmap='inferno')
+        canvas.figure.colorbar(self.image, ax=canvas.axes)
+
+    def update(self, t, spectrum):
+        self.history = np.roll(self.history, -1, axis=0)
+        self.history[-1] = spectrum
+        self.image.set_data(np.ma.masked_invalid(self.history))
+        self.image.set_extent((self.wavelengths[0], self.wavelengths[-1], t - len(self.history), t))
+        self.image.set_clim(*autoscale_limits(self.history, margin=0.0, clip_percentile=99.9))
+        self.canvas.draw()
+
+
+def bench_waterfall(n_frames=300, n_pixels=1044):
+    print(f"Waterfall of {n_pixels}-pixel spectra, Agg 500x400 px, one refresh per spectrum ({n_frames} spectra)")
+    print(f"{'rows':>6} {'roll+full draw (fps)':>21} {'ring+blit (fps)':>16} {'full draws':>11} {'speed-up':>9}")
+    wavelengths = np.linspace(400, 800, n_pixels)
+    rng = np.random.default_rng(0)
+    frames = rng.normal(1000, 30, (n_frames, n_pixels)) + 2000 * np.exp(-((wavelengths - 600) / 40) ** 2)
+    for n_rows in (100, 300, 1000):
+        canvas = agg_canvas()
+        legacy = LegacyWaterfall(canvas, wavelengths, n_rows)
+        t0 = time.perf_counter()
+        for i, frame in enumerate(frames):
+            legacy.update(i, frame)
+        legacy_fps = n_frames / (time.perf_counter() - t0)
+
+        canvas = agg_canvas()
+        view = WaterfallView(canvas, n_rows)
+        view.start(wavelengths)
+        t0 = time.perf_counter()
+        for frame in frames:
+            view.push(frame)
+            view.refresh()
+        blit_fps = n_frames / (time.perf_counter() - t0)
+        print(f"{n_rows:>6} {legacy_fps:>21.0f} {blit_fps:>16.0f} {view.full_draws - 1:>11} "
+              f"{blit_fps / legacy_fps:>8.1f}x")
+
+
+def bench_waterfall_page(n_frames=300, n_pixels=1044):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5 import QtWidgets
+    import qepro_app01
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    information = QtWidgets.QMessageBox.information
+    QtWidgets.QMessageBox.information = staticmethod(lambda *args, **kwargs: None)  # The demo-mode notice is modal
+    try:
+        window = qepro_app01.QePro_LIVE_PLOT_APP()
+    finally:
+        QtWidgets.QMessageBox.information = information
+    window.resize(1400, 900)
+    window.show()
+    qepro_app01.widgets.stackedWidget.setCurrentWidget(window.waterfall_page)
+    print(f"Waterfall page of {n_pixels}-pixel spectra, 1400x900 window, one refresh_waterfall() per spectrum "
+          f"({n_frames} spectra)")
+    print(f"{'band trace redraw':>24} {'page (fps)':>11}")
+    wavelengths = np.linspace(400, 800, n_pixels)
+    rng = np.random.default_rng(0)
+    frames = rng.normal(1000, 30, (n_frames, n_pixels)) + 2000 * np.exp(-((wavelengths - 600) / 40) ** 2)
+    default_s = window.band_refresh_s
+    for label, band_refresh_s in (("every spectrum", 0.0), (f"every {default_s:g} s (default)", default_s)):
+        window.band_refresh_s = band_refresh_s
+        ring = window.start_waterfall(wavelengths, capacity=n_frames)
+        window.waterfall_timer.stop()  # Refreshed by hand below, once per spectrum
+        for _ in range(5):
+            app.processEvents()
+        t0 = time.perf_counter()
+        for frame in frames:
+            ring.push(frame, time.monotonic())
+            window.refresh_waterfall()
+            app.processEvents()  # Runs the pending draws
+        fps = n_frames / (time.perf_counter() - t0)
+        window.stop_waterfall()
+        print(f"{label:>24} {fps:>11.0f}")
+    window.close()
+
+
+########################################################################
+# MAP TRAJECTORIES
+########################################################################
+
+def bench_trajectories(size_um=40, step_um=2, velocity_um_s=500, settle_s=0.02, integration_ms=2):
+    grid = MapGrid(0, size_um, 0, size_um, step_um)
+    print(f"{grid.shape[1]}x{grid.shape[0]} map, simulated stage {velocity_um_s} um/s, settle {settle_s * 1e3:.0f} ms, "
+          f"integration {integration_ms} ms")
+    print(f"{'trajectory':>11} {'time (s)':>9} {'motion (s)':>11} {'raster est. (s)':>16} {'saved (s)':>10} "
+          f"{'centroid x, y (col)':>20} {'odd/even rows dx':>17}")
+    for trajectory in TRAJECTORIES:
+        stage = SimulatedStage(velocity_um_s, settle_s)
+        result = acquire_map(SimulatedEmitter(stage, pixels=1044), stage, grid, integration_ms * 1000,
+                             trajectory=trajectory)
+        timing = result.timing
+        # Misplaced spectra would shift the spot, and serpentine rows would shift against each other
+        weights = result.integrated()
+        weights -= weights.min()
+        rows, columns = np.mgrid[:grid.shape[0], :grid.shape[1]]
+        centroid_x = (weights * columns).sum() / weights.sum()
+        centroid_y = (weights * rows).sum() / weights.sum()
+        shift = ((weights[::2] * columns[::2]).sum() / weights[::2].sum()
+                 - (weights[1::2] * columns[1::2]).sum() / weights[1::2].sum())
+        print(f"{trajectory:>11} {timing['elapsed_s']:>9.2f} {timing['motion_s']:>11.2f} "
+              f"{timing['estimated_raster_s']:>16.2f} {timing['saved_s']:>10.2f} "
+              f"{centroid_x:>11.2f}, {centroid_y:>6.2f} {shift:>17.3f}")
+
+
+########################################################################
+# WINDOW MAPS
+########################################################################
+
+def synthetic_cube_store(path, n_rows=200, n_columns=200, n_pixels=1044):
+    """On-disk map of one Gaussian band whose height, centre and width vary across the map."""
+    wavelengths = np.linspace(400, 800, n_pixels)
+    rows, columns = np.mgrid[:n_rows, :n_columns]
+    centre = 560 + 20 * np.sin(columns / 30)
+    width = 15 + 5 * np.cos(rows / 25)
+    height = 1000 * np.exp(-((columns - n_columns / 2) ** 2 + (rows - n_rows / 2) ** 2) / 8000)
+    store = CubeStore.create(path, np.arange(n_columns), np.arange(n_rows), wavelengths)
+    for row in range(n_rows):
+        spectra = 100 + height[row, :, None] * np.exp(
+            -0.5 * ((wavelengths - centre[row, :, None]) / width[row, :, None]) ** 2)
+        for column in range(n_columns):
+            store.write(row, column, spectra[column])
+    store.close()
+    return CubeStore.open(path)
+
+
+def bench_window_maps():
+    print("Window images of a 200x200 map of 1044-pixel spectra (best of 3)")
+    with tempfile.TemporaryDirectory() as tmp:
+        store = synthetic_cube_store(os.path.join(tmp, "map.qmap"))
+        t0 = time.perf_counter()
+        window_maps = WindowMaps(store, store.path)
+        print(f"one-off preparation (band-major copy + cumulative integral): {time.perf_counter() - t0:.2f} s")
+        print(f"{'window (nm)':>12} {'trapezoid on cube (ms)':>23} {'integral (ms)':>14} {'peak (ms)':>10} "
+              f"{'fwhm (ms)':>10}")
+        for low, high in ((550, 570), (500, 620), (400, 800)):
+            first, last = window_maps.window_indices(low, high)
+            naive = best_of(lambda: trapezoid(store.cube[:, :, first:last + 1],
+                                              window_maps.wavelengths[first:last + 1], axis=2))
+            expected = trapezoid(store.cube[:, :, first:last + 1], window_maps.wavelengths[first:last + 1], axis=2)
+            assert np.allclose(window_maps.integral((low, high)), expected, rtol=1e-4), "window integral differs"
+            integral = best_of(lambda: window_maps.integral((low, high)))
+            peak = best_of(lambda: window_maps.peak(low, high))
+            fwhm = best_of(lambda: window_maps.fwhm(low, high))
+            print(f"{f'{low}-{high}':>12} {naive * 1e3:>23.1f} {integral * 1e3:>14.2f} {peak * 1e3:>10.1f} "
+                  f"{fwhm * 1e3:>10.1f}")
+
+
+def synthetic_mixture_store(path, n_rows, n_columns, n_pixels=1044, noise=5.0, seed=0):
+    """On-disk map mixing three Gaussian bands in smoothly varying amounts, over a baseline of 100 counts."""
+    rng = np.random.default_rng(seed)
+    wavelengths = np.linspace(400, 800, n_pixels)
+    bands = np.array([np.exp(-0.5 * ((wavelengths - centre) / width) ** 2)
+                      for centre, width in ((520, 15), (600, 25), (690, 20))])
+    columns = np.arange(n_columns) / n_columns
+    store = CubeStore.create(path, np.arange(n_columns), np.arange(n_rows), wavelengths)
+    for row in range(n_rows):
+        y = row / n_rows
+        amounts = 1000 * np.stack([np.exp(-((columns - 0.3) ** 2 + (y - 0.4) ** 2) / 0.05),
+                                   np.exp(-((columns - 0.7) ** 2 + (y - 0.6) ** 2) / 0.1),
+                                   0.3 + 0.2 * np.sin(6 * columns)], axis=1)
+        spectra = 100 + amounts @ bands + rng.normal(0, noise, (n_columns, n_pixels))
+        for column in range(n_columns):
+            store.write(row, column, spectra[column])
+    store.close()
+    return CubeStore.open(path), bands
+
+
+def traced(function):
+    """Wall time (s) and peak traced memory (MB) of one call of `function`, and its result."""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def in_memory_pca(store, n_components):
+    """Exact PCA of the whole cube loaded into memory, for comparison."""
+    spectra = np.asarray(store.cube[np.asarray(store.done)], dtype=np.float64)
+    spectra -= spectra.mean(axis=0)
+    eigenvalues, vectors = np.linalg.eigh(spectra.T @ spectra)
+    return vectors[:, ::-1][:, :n_components].T
+
+
+def bench_decomposition(sizes=((250, 200), (500, 500)), n_components=4):
+    print(f"Streaming PCA and NMF of maps of 1044-pixel spectra, {n_components} components "
+          "(peak memory traced by tracemalloc; the cube itself is memory-mapped)")
+    print(f"{'points':>9} {'cube (MB)':>10} {'PCA (s)':>8} {'PCA peak (MB)':>14} {'NMF (s)':>8} "
+          f"{'NMF peak (MB)':>14} {'NMF residual':>13} {'in-memory PCA (s)':>18} {'its peak (MB)':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_rows, n_columns in sizes:
+            path = os.path.join(tmp, f"map{n_rows}.qmap")
+            store, bands = synthetic_mixture_store(path, n_rows, n_columns)
+            pca_s, pca_peak, decomposition = traced(lambda store=store: pca(store, n_components))
+            assert np.all(decomposition.explained[:3] > 1e-3) and decomposition.explained[3] < 1e-3, \
+                "PCA did not find the three bands"
+            nmf_s, nmf_peak, factors = traced(lambda store=store: nmf(store, n_components))
+            exact = ""
+            if store.done.size <= 100_000:  # The full cube in float64 has to fit in memory
+                exact_s, exact_peak, components = traced(lambda store=store: in_memory_pca(store, n_components))
+                overlap = np.abs(np.sum(components[:3] * decomposition.components[:3], axis=1))
+                assert np.all(overlap > 0.999), "streaming PCA differs from the exact one"
+                exact = f"{exact_s:>18.1f} {exact_peak:>14.0f}"
+            print(f"{store.done.size:>9} {store.cube.nbytes / 1e6:>10.0f} {pca_s:>8.1f} {pca_peak:>14.0f} "
+                  f"{nmf_s:>8.1f} {nmf_peak:>14.0f} {factors.residual:>13.4f} {exact}")
+            del store, decomposition, factors
+            shutil.rmtree(path)
+
+
+def bench_dark_drift(drift_counts_per_s=100.0, integration_ms=2):
+    print(f"Dark correction of a 16x16 raster map while the dark drifts by {drift_counts_per_s:g} counts/s "
+          "(error = dark left in the masked pixels of the stored spectra, averaged over 16-point blocks)")
+    print(f"{'darks':>26} {'taken':>6} {'mean error':>11} {'max error':>10} {'run (s)':>8} {'dark time (s)':>14}")
+    grid = MapGrid(0, 60, 0, 60, 4)
+    for label, scheduler in (("one before the map", None),
+                             ("every 32 points, nearest", DarkScheduler(every_frames=32, interpolate=False)),
+                             ("every 32 points, interp.", DarkScheduler(every_frames=32)),
+                             ("on 3-count drift, interp.", 'drift')):
+        stage = SimulatedStage()
+        emitter = SimulatedEmitter(stage, pixels=1044, dark_counts=1000, dark_drift_counts_per_s=drift_counts_per_s,
+                                   electric_dark_pixels=8)
+        masked = electric_dark_pixels(emitter)
+        if scheduler == 'drift':
+            scheduler = DarkScheduler(drift_counts=3, dark_pixels=masked)
+        first_dark = 0.0
+        if scheduler is None:
+            emitter.integration_time_micros(integration_ms * 1000)
+            set_light_source(emitter, False)
+            first_dark = emitter.intensities()
+            set_light_source(emitter, True)
+        result = acquire_map(emitter, stage, grid, integration_ms * 1000, darks=scheduler)
+        order = list(grid.points())  # Acquisition order of a raster scan
+        residual = np.array([(result.cube[row, column] - first_dark)[masked].mean() for row, column, _, _ in order])
+        blocks = np.abs(residual.reshape(-1, 16).mean(axis=1))
+        timing = result.timing
+        print(f"{label:>26} {timing.get('darks', 1):>6} {blocks.mean():>11.2f} {blocks.max():>10.2f} "
+              f"{timing['elapsed_s']:>8.2f} {timing.get('dark_s', 0.0):>14.2f}")
+
+
+def bench_kinetics(counts=(1000, 10000, 50000), interval_ms=1.0, integration_ms=0.5):
+    print(f"Kinetics of 1044-pixel frames every {interval_ms:g} ms ({integration_ms:g} ms simulated exposure), "
+          "streamed to 1000-frame chunks (peak memory traced by tracemalloc)")
+    print(f"{'frames':>8} {'run (s)':>8} {'frames/s':>9} {'missed':>7} {'peak (MB)':>10} {'in memory (MB)':>15} "
+          f"{'on disk (MB)':>13} {'band read (s)':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_frames in counts:
+            path = os.path.join(tmp, f"run_{n_frames}.qkin")
+            spectrometer = SimulatedSpectrometer(pixels=1044)
+            wavelengths = CalibrationCache().get(spectrometer).wavelengths
+            ring = SpectrumRingBuffer(256, 1044)
+
+            def run():
+                with KineticsWriter(path, wavelengths) as writer:
+                    return acquire_kinetics(spectrometer, int(integration_ms * 1000), interval_ms / 1000, 1, writer,
+                                            ring, wavelengths, max_frames=n_frames)
+            elapsed, peak, timing = traced(run)
+            on_disk = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)) / 1e6
+            recording = KineticsRecording(path)
+            band_s = best_of(lambda: recording.band(550, 650), repeat=1)
+            assert recording.n_frames == n_frames
+            # Holding the run as a list of float64 frames, as a naive kinetics loop would
+            in_memory = n_frames * 1044 * 8 / 1e6
+            print(f"{n_frames:>8} {elapsed:>8.2f} {n_frames / elapsed:>9.0f} {timing['missed_deadlines']:>7} "
+                  f"{peak:>10.1f} {in_memory:>15.0f} {on_disk:>13.0f} {band_s:>14.3f}")
+
+
+BENCHMARKS = {
+    'text_export': bench_text_export,
+    'container': bench_container,
+    'plot_update': bench_plot_update,
+    'decimation': bench_decimation,
+    'autoscale': bench_autoscale,
+    'map_render': bench_map_render,
+    'waterfall': bench_waterfall,
+    'waterfall_page': bench_waterfall_page,
+    'trajectories': bench_trajectories,
+    'window_maps': bench_window_maps,
+    'decomposition': bench_decomposition,
+    'decomposition_1m': lambda: bench_decomposition(sizes=((1000, 1000),)),
+    'dark_drift': bench_dark_drift,
+    'kinetics': bench_kinetics,
+}
+
+# Only run when named: the 1M-point map is a 4 GB cube on disk
+OPT_IN = {'decomposition_1m'}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or [name for name in BENCHMARKS if name not in OPT_IN]:
+        BENCHMARKS[name]()
+        print()
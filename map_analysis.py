@@ -0,0 +1,293 @@
+import os
+import time
+
+import numpy as np
+
+########################################################################
+# WAVELENGTH WINDOW MAPS
+########################################################################
+
+WINDOW_QUANTITIES = ('integral', 'peak', 'fwhm')
+
+
+class WindowMaps:
+    """Integral, peak and FWHM images of wavelength windows of a map, from a band-major copy."""
+    def __init__(self, store, directory=None, rows_per_block=16):
+        n_rows, n_columns, n_pixels = store.cube.shape
+        self.wavelengths = np.asarray(store.wavelengths, dtype=np.float64)
+        self.done = np.array(store.done, dtype=bool)
+        shape = (n_pixels, n_rows, n_columns)
+        if directory is None:
+            self.bands = np.empty(shape, dtype=np.float32)
+            self.cumulative = np.empty(shape, dtype=np.float32)
+        else:
+            self.bands = np.lib.format.open_memmap(os.path.join(directory, "bands.npy"), mode="w+",
+                                                   dtype=np.float32, shape=shape)
+            self.cumulative = np.lib.format.open_memmap(os.path.join(directory, "cumulative.npy"), mode="w+",
+                                                        dtype=np.float32, shape=shape)
+        half_steps = 0.5 * np.diff(self.wavelengths)[:, None, None]
+        spectrum_sum = np.zeros(n_pixels)
+        for start in range(0, n_rows, rows_per_block):
+            stop = min(start + rows_per_block, n_rows)
+            block = np.asarray(store.cube[start:stop], dtype=np.float64).transpose(2, 0, 1)
+            self.bands[:, start:stop] = block
+            cumulative = np.zeros_like(block)  # Summed in float64, rounded to float32 once when stored
+            np.cumsum((block[1:] + block[:-1]) * half_steps, axis=0, out=cumulative[1:])
+            self.cumulative[:, start:stop] = cumulative
+            spectrum_sum += block[:, self.done[start:stop]].sum(axis=1)
+        if isinstance(self.bands, np.memmap):
+            self.bands.flush()
+            self.cumulative.flush()
+        n_done = np.count_nonzero(self.done)
+        self.mean_spectrum = spectrum_sum / n_done if n_done else spectrum_sum
+
+    def window_indices(self, low_nm, high_nm):
+        """First and last pixel of the window between `low_nm` and `high_nm` (in either order)."""
+        low_nm, high_nm = sorted((low_nm, high_nm))
+        last = self.wavelengths.size - 1
+        first = min(int(np.searchsorted(self.wavelengths, low_nm, side='left')), last)
+        stop = max(int(np.searchsorted(self.wavelengths, high_nm, side='right')) - 1, first)
+        return first, min(stop, last)
+
+    def _masked(self, image):
+        image = np.asarray(image, dtype=np.float64)
+        image[..., ~self.done] = np.nan
+        return image
+
+    def integral(self, windows):
+        """Integrated intensity (count nm) of one (low, high) window, or an image per window for a list."""
+        single = np.ndim(windows) == 1
+        indices = np.array([self.window_indices(*window) for window in np.atleast_2d(windows)])
+        images = self.cumulative[indices[:, 1]].astype(np.float64) - self.cumulative[indices[:, 0]]
+        images = self._masked(images.reshape((len(indices),) + self.done.shape))
+        return images[0] if single else images
+
+    def peak(self, low_nm, high_nm):
+        """Wavelength of the maximum inside the window, refined with a parabola through its neighbours."""
+        first, last = self.window_indices(low_nm, high_nm)
+        window = self.bands[first:last + 1]
+        maximum = window.max(axis=0)
+        # Plain argmax along the first axis copies the whole window; a boolean argmax does not
+        index = np.argmax(window == maximum, axis=0)
+        position = self.wavelengths[first + index]
+        inner = (index > 0) & (index < window.shape[0] - 1)
+        if np.any(inner):
+            i = index[inner]
+            pixels = np.nonzero(inner)
+            left = window[(i - 1,) + pixels].astype(np.float64)
+            centre = maximum[pixels].astype(np.float64)
+            right = window[(i + 1,) + pixels].astype(np.float64)
+            curvature = left - 2 * centre + right
+            with np.errstate(divide='ignore', invalid='ignore'):
+                shift = np.where(curvature < 0, 0.5 * (left - right) / curvature, 0.0)
+            step = 0.5 * (self.wavelengths[first + i + 1] - self.wavelengths[first + i - 1])
+            position[inner] += shift * step
+        return self._masked(position)
+
+    def fwhm(self, low_nm, high_nm):
+        """Full width at half maximum (nm) of the band inside the window."""
+        first, last = self.window_indices(low_nm, high_nm)
+        window = self.bands[first:last + 1]
+        wavelengths = self.wavelengths[first:last + 1]
+        n = window.shape[0]
+        level = 0.5 * (window.min(axis=0) + window.max(axis=0))
+        above = window >= level
+        # Outermost pixels at or above half maximum on either side of the band
+        left = np.argmax(above, axis=0)
+        right = n - 1 - np.argmax(above[::-1], axis=0)
+
+        def crossing(inside, outside):
+            """Interpolated wavelength where the signal crosses `level` between two pixels."""
+            value_in = np.take_along_axis(window, inside[None], axis=0)[0].astype(np.float64)
+            value_out = np.take_along_axis(window, outside[None], axis=0)[0].astype(np.float64)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fraction = np.where(value_in != value_out, (value_in - level) / (value_in - value_out), 0.0)
+            return wavelengths[inside] + fraction * (wavelengths[outside] - wavelengths[inside])
+
+        left_nm = crossing(left, np.maximum(left - 1, 0))
+        right_nm = crossing(right, np.minimum(right + 1, n - 1))
+        return self._masked(right_nm - left_nm)
+
+    def image(self, quantity, low_nm, high_nm):
+        """Image of one of WINDOW_QUANTITIES over the window."""
+        if quantity == 'integral':
+            return self.integral((low_nm, high_nm))
+        if quantity == 'peak':
+            return self.peak(low_nm, high_nm)
+        if quantity == 'fwhm':
+            return self.fwhm(low_nm, high_nm)
+        raise ValueError(f"Unknown quantity {quantity!r}: use one of {', '.join(WINDOW_QUANTITIES)}")
+
+########################################################################
+# DIMENSIONALITY REDUCTION
+########################################################################
+
+def iter_spectra(store, batch_size=4096):
+    """Yield (start, stop, done, spectra) for mini-batches of at most `batch_size` map points."""
+    cube = store.cube.reshape(-1, store.cube.shape[2])  # A view: the cube is C-contiguous
+    done = np.asarray(store.done, dtype=bool).ravel()
+    for start in range(0, done.size, batch_size):
+        stop = min(start + batch_size, done.size)
+        mask = done[start:stop]
+        if mask.any():
+            yield start, stop, mask, np.asarray(cube[start:stop][mask], dtype=np.float64)
+
+
+class Decomposition:
+    """Component spectra and score images of a map."""
+    def __init__(self, method, wavelengths, components, scores, mean=None, explained=None, residual=None,
+                 elapsed_s=None):
+        self.method = method
+        self.wavelengths = wavelengths
+        self.components = components
+        self.scores = scores
+        self.mean = mean
+        self.explained = explained
+        self.residual = residual
+        self.elapsed_s = elapsed_s
+
+    @property
+    def n_components(self):
+        return self.components.shape[0]
+
+
+def _score_images(store, n_components):
+    images = np.full((n_components,) + tuple(store.done.shape), np.nan, dtype=np.float32)
+    return images, images.reshape(n_components, -1)
+
+
+def _cancelled(cancel_event):
+    return cancel_event is not None and cancel_event.is_set()
+
+
+def pca(store, n_components=5, n_iter=2, oversample=10, batch_size=4096, seed=0,
+        progress_callback=None, cancel_event=None):
+    """Principal components of the spectra of a map by randomized eigendecomposition; None if cancelled."""
+    t0 = time.perf_counter()
+    n_pixels = store.cube.shape[2]
+    n_points = int(np.count_nonzero(store.done))
+    if n_points < 2:
+        raise ValueError("Need at least two acquired points for PCA")
+    n_components = min(int(n_components), n_pixels, n_points)
+    size = min(n_components + int(oversample), n_pixels)
+    n_iter = max(int(n_iter), 1)
+    n_passes = n_iter + 2
+    rng = np.random.default_rng(seed)
+
+    def report(done_passes, stop=0):
+        if progress_callback is not None:
+            fraction = stop / store.done.size if stop else 0.0
+            progress_callback(int(100 * (done_passes + fraction) / n_passes))
+
+    def times_covariance(vectors, shift):
+        """Covariance of the spectra times `vectors`, with the spectra offset by `shift` for accuracy."""
+        product = np.zeros((n_pixels, vectors.shape[1]))
+        total = np.zeros(n_pixels)
+        squares = 0.0
+        for _, stop, _, spectra in iter_spectra(store, batch_size):
+            if _cancelled(cancel_event):
+                return None
+            spectra -= shift
+            product += spectra.T @ (spectra @ vectors)
+            total += spectra.sum(axis=0)
+            squares += float(np.einsum('ij,ij->', spectra, spectra))
+            report(n_done_passes, stop)
+        offset = total / n_points  # Mean minus shift
+        product = product / n_points - np.outer(offset, offset @ vectors)
+        return product, shift + offset, squares / n_points - float(offset @ offset)
+
+    # First pass: range of the covariance on random vectors, from data shifted by a first spectrum
+    n_done_passes = 0
+    shift = next(iter_spectra(store, batch_size))[3].mean(axis=0)
+    result = times_covariance(rng.standard_normal((n_pixels, size)), shift)
+    if result is None:
+        return None
+    product, mean, total_variance = result
+    for n_done_passes in range(1, n_iter + 1):
+        basis, _ = np.linalg.qr(product)
+        result = times_covariance(basis, mean)
+        if result is None:
+            return None
+        product = result[0]
+    # Rayleigh-Ritz on the final subspace
+    eigenvalues, vectors = np.linalg.eigh(basis.T @ product)
+    order = np.argsort(eigenvalues)[::-1][:n_components]
+    components = (basis @ vectors[:, order]).T
+    # Make the largest loading of every component positive, so repeated runs agree in sign
+    signs = np.sign(components[np.arange(n_components), np.argmax(np.abs(components), axis=1)])
+    components *= signs[:, None]
+
+    n_done_passes = n_iter + 1
+    images, scores = _score_images(store, n_components)
+    for start, stop, mask, spectra in iter_spectra(store, batch_size):
+        if _cancelled(cancel_event):
+            return None
+        scores[:, start:stop][:, mask] = (components @ (spectra - mean).T)
+        report(n_done_passes, stop)
+    explained = np.clip(eigenvalues[order], 0, None) / total_variance if total_variance > 0 else None
+    return Decomposition('pca', np.asarray(store.wavelengths), components, images, mean=mean,
+                         explained=explained, elapsed_s=time.perf_counter() - t0)
+
+
+def _nmf_scores(spectra, components, gram, n_iter, scores=None):
+    """Non-negative scores of `spectra` for fixed `components`, by multiplicative updates."""
+    numerator = spectra @ components.T
+    if scores is None:
+        scores = np.maximum(numerator, 0) / (np.diag(gram) + 1e-12)
+    for _ in range(n_iter):
+        scores *= numerator / (scores @ gram + 1e-12)
+    return scores
+
+
+def nmf(store, n_components=4, n_epochs=3, n_iter=20, n_update=5, forget=0.5, batch_size=4096, seed=0,
+        progress_callback=None, cancel_event=None):
+    """Non-negative matrix factorization of the spectra of a map by online updates; None if cancelled."""
+    t0 = time.perf_counter()
+    n_pixels = store.cube.shape[2]
+    if not np.any(store.done):
+        raise ValueError("Need at least one acquired point for NMF")
+    n_components = min(int(n_components), n_pixels)
+    n_passes = int(n_epochs) + 1
+    rng = np.random.default_rng(seed)
+
+    def report(done_passes, stop):
+        if progress_callback is not None:
+            progress_callback(int(100 * (done_passes + stop / store.done.size) / n_passes))
+
+    # Start from randomly scaled copies of the mean spectrum of the first batch
+    start_spectrum = np.maximum(next(iter_spectra(store, batch_size))[3], 0).mean(axis=0)
+    components = start_spectrum * rng.uniform(0.5, 1.5, (n_components, n_pixels)) / n_components + 1e-9
+    gram_scores = np.zeros((n_components, n_components))
+    cross = np.zeros((n_components, n_pixels))
+    for epoch in range(int(n_epochs)):
+        gram_scores *= forget
+        cross *= forget
+        for _, stop, _, spectra in iter_spectra(store, batch_size):
+            if _cancelled(cancel_event):
+                return None
+            np.maximum(spectra, 0, out=spectra)
+            scores = _nmf_scores(spectra, components, components @ components.T, n_iter)
+            gram_scores += scores.T @ scores
+            cross += scores.T @ spectra
+            for _ in range(n_update):
+                components *= cross / (gram_scores @ components + 1e-12)
+            report(epoch, stop)
+
+    scale = components.max(axis=1)
+    scale[scale == 0] = 1.0
+    components /= scale[:, None]
+    gram = components @ components.T
+    images, image_scores = _score_images(store, n_components)
+    error = total = 0.0
+    for start, stop, mask, spectra in iter_spectra(store, batch_size):
+        if _cancelled(cancel_event):
+            return None
+        np.maximum(spectra, 0, out=spectra)
+        scores = _nmf_scores(spectra, components, gram, 2 * n_iter)
+        image_scores[:, start:stop][:, mask] = scores.T
+        error += float(np.sum((spectra - scores @ components) ** 2))
+        total += float(np.einsum('ij,ij->', spectra, spectra))
+        report(n_passes - 1, stop)
+    residual = np.sqrt(error / total) if total > 0 else 0.0
+    return Decomposition('nmf', np.asarray(store.wavelengths), components, images, residual=residual,
+                         elapsed_s=time.perf_counter() - t0)
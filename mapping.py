@@ -0,0 +1,416 @@
+import abc
+import time
+
+import numpy as np
+
+from acquisition import (average_scans, background_writes, DarkTimeline, finish_writes, set_light_source,
+                         SimulatedSpectrometer)
+
+########################################################################
+# MOTION STAGES
+########################################################################
+
+class Stage(abc.ABC):
+    """Interface of the motorised stage that moves the sample under the objective."""
+    @abc.abstractmethod
+    def move_to(self, x, y, z):
+        """Go to (x, y, z) and return once the stage has settled there."""
+
+    @abc.abstractmethod
+    def position(self):
+        """Return the current (x, y, z)."""
+
+    @abc.abstractmethod
+    def start_move(self, x, y, z, velocity_um_s=None):
+        """Start moving to (x, y, z), at most at `velocity_um_s`, and return at once."""
+
+    @abc.abstractmethod
+    def is_moving(self):
+        """True while a move started with start_move() is under way."""
+
+    def read_encoder(self):
+        """Return (timestamp, x, y, z): the position now, on the time.monotonic() clock."""
+        return (time.monotonic(),) + tuple(self.position())
+
+    def move_time(self, start, end):
+        """Seconds a blocking move from `start` to `end` takes, settling included, if known."""
+        return None
+
+    def close(self):
+        pass
+
+
+class SimulatedStage(Stage):
+    """Stage stand-in moving in straight lines at `velocity_um_s`, then settling for `settle_s`."""
+    def __init__(self, velocity_um_s=None, settle_s=0.0):
+        self.velocity_um_s = velocity_um_s
+        self.settle_s = settle_s
+        self._start = self._target = (0.0, 0.0, 0.0)
+        self._t_start = self._t_end = 0.0
+
+    def _travel_time(self, start, end, velocity_um_s):
+        if not velocity_um_s:
+            return 0.0
+        return float(np.linalg.norm(np.subtract(end, start))) / velocity_um_s
+
+    def start_move(self, x, y, z, velocity_um_s=None):
+        if velocity_um_s and self.velocity_um_s:
+            velocity_um_s = min(velocity_um_s, self.velocity_um_s)
+        else:
+            velocity_um_s = velocity_um_s or self.velocity_um_s
+        now = time.monotonic()
+        self._start = self.position(now)
+        self._target = (float(x), float(y), float(z))
+        self._t_start = now
+        self._t_end = now + self._travel_time(self._start, self._target, velocity_um_s)
+
+    def move_to(self, x, y, z):
+        self.start_move(x, y, z)
+        remaining = self._t_end + self.settle_s - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def is_moving(self):
+        return time.monotonic() < self._t_end
+
+    def position(self, t=None):
+        t = time.monotonic() if t is None else t
+        if t >= self._t_end:
+            return self._target
+        if t <= self._t_start:
+            return self._start
+        fraction = (t - self._t_start) / (self._t_end - self._t_start)
+        return tuple(a + (b - a) * fraction for a, b in zip(self._start, self._target))
+
+    def move_time(self, start, end):
+        return self._travel_time(start, end, self.velocity_um_s) + self.settle_s
+
+########################################################################
+# SIMULATED EMITTER
+########################################################################
+
+class SimulatedEmitter(SimulatedSpectrometer):
+    """Simulated spectrometer looking at luminescent spots on a sample mounted on a SimulatedStage."""
+    model = "QE-PRO (simulated emitter)"
+    spots = (
+        (25.0, 30.0, 12.0, 1000.0, 560.0, 20.0),
+        (70.0, 65.0, 18.0, 600.0, 640.0, 30.0),
+        (40.0, 80.0, 8.0, 1500.0, 520.0, 15.0),
+    )
+    baseline = 100.0  # Counts of the bare substrate
+
+    def __init__(self, stage, spots=None, **kwargs):
+        super().__init__(**kwargs)
+        self.stage = stage
+        if spots is not None:
+            self.spots = tuple(spots)
+
+    def _signal(self):
+        x, y, _ = self.stage.position(time.monotonic() - self._integration_time_us / 2e6)
+        signal = np.full(self.pixels, self.baseline)
+        for spot_x, spot_y, radius, counts, centre, width in self.spots:
+            weight = counts * np.exp(-0.5 * ((x - spot_x) ** 2 + (y - spot_y) ** 2) / radius ** 2)
+            signal += weight * np.exp(-0.5 * ((self._wavelengths - centre) / width) ** 2)
+        return signal
+
+########################################################################
+# MAP GRID
+########################################################################
+
+class MapGrid:
+    """Rectangular grid of map points `step` um apart; its data has shape (len(y), len(x))."""
+    def __init__(self, x_start, x_end, y_start, y_end, step, z=0.0):
+        if step <= 0:
+            raise ValueError("Step size must be positive.")
+        self.step = float(step)
+        self.x = self._axis(x_start, x_end, step)
+        self.y = self._axis(y_start, y_end, step)
+        self.z = float(z)
+
+    @staticmethod
+    def _axis(start, end, step):
+        n = int(np.floor(abs(end - start) / step + 1e-9)) + 1
+        direction = 1.0 if end >= start else -1.0
+        return start + direction * step * np.arange(n)
+
+    @property
+    def shape(self):
+        return self.y.size, self.x.size
+
+    @property
+    def n_points(self):
+        return self.y.size * self.x.size
+
+    def points(self, serpentine=False):
+        """Yield (row, column, x, y) of every point, row by row, every other row backwards if `serpentine`."""
+        for row, y in enumerate(self.y):
+            columns = range(self.x.size)
+            if serpentine and row % 2:
+                columns = reversed(columns)
+            for column in columns:
+                yield row, column, self.x[column], y
+
+    def motion_time(self, stage, serpentine=False):
+        """Time `stage` spends moving between the points in total, or None if it cannot tell."""
+        total = 0.0
+        previous = None
+        for _, _, x, y in self.points(serpentine):
+            position = (x, y, self.z)
+            if previous is not None:
+                move = stage.move_time(previous, position)
+                if move is None:
+                    return None
+                total += move
+            previous = position
+        return total
+
+########################################################################
+# MAP ACQUISITION
+########################################################################
+
+class HyperspectralMap:
+    """In-memory spectra of a map, with the same interface as spectral_io.CubeStore."""
+    def __init__(self, grid, wavelengths, dtype=np.float64):
+        self.x = grid.x
+        self.y = grid.y
+        self.wavelengths = np.array(wavelengths, dtype=np.float64)
+        self.cube = np.zeros(grid.shape + (self.wavelengths.size,), dtype=dtype)
+        self.done = np.zeros(grid.shape, dtype=bool)
+        self.timing = None
+
+    @property
+    def shape(self):
+        return self.done.shape
+
+    @property
+    def n_done(self):
+        return int(np.count_nonzero(self.done))
+
+    def write(self, row, column, spectrum, done=True):
+        """Store the spectrum of point (row, column); with `done` also mark the point as done."""
+        self.cube[row, column] = spectrum
+        if done:
+            self.done[row, column] = True
+
+    def subtract(self, row, column, dark):
+        """Subtract `dark` from the stored spectrum of point (row, column) and mark the point as done."""
+        self.cube[row, column] -= dark
+        self.done[row, column] = True
+
+    def read_region(self, rows, columns):
+        """Copy the spectra of a rectangle, e.g. read_region(slice(10, 20), slice(0, 5))."""
+        return self.cube[rows, columns].copy()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def integrated(self):
+        """Integrated intensity of every point, NaN where nothing was acquired."""
+        image = self.cube.sum(axis=2, dtype=np.float64)
+        image[~self.done] = np.nan
+        return image
+
+
+TRAJECTORIES = ('raster', 'serpentine', 'fly')
+
+
+def _fly_row(spectrometer, stage, grid, row, reverse, n_average, frame_s, frames, cancel_event=None):
+    """Sweep one row without stopping and pick the frame taken closest to each column; None if cancelled."""
+    columns = np.arange(grid.x.size)
+    if reverse:
+        columns = columns[::-1]
+    xs = grid.x[columns]
+    y = grid.y[row]
+    half_step = (xs[1] - xs[0]) / 2
+    t0 = time.monotonic()
+    stage.move_to(xs[0] - half_step, y, grid.z)
+    run_up_s = time.monotonic() - t0
+    stage.start_move(xs[-1] + half_step, y, grid.z, grid.step / frame_s)
+    encoder = [stage.read_encoder()]
+    mid_times = []
+    while stage.is_moving() and len(mid_times) < len(frames):
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        start = time.monotonic()
+        average_scans(spectrometer, frames[len(mid_times)], n_average)
+        mid_times.append(0.5 * (start + time.monotonic()))
+        encoder.append(stage.read_encoder())
+    while stage.is_moving():
+        time.sleep(0.001)  # Out of frame slots: let the sweep finish
+    if not mid_times:
+        return None
+    encoder = np.array(encoder)
+    positions = np.interp(mid_times, encoder[:, 0], encoder[:, 1])
+    nearest = np.argmin(np.abs(xs[:, None] - positions[None, :]), axis=1)
+    return columns, nearest, positions[nearest] - xs, run_up_s, np.asarray(mid_times)[nearest]
+
+
+def acquire_map(spectrometer, stage, grid, integration_time_us, n_average=1, store=None, trajectory='raster',
+                darks=None, light_callback=None, ring=None, wavelengths=None, progress_callback=None,
+                data_callback=None, cancel_event=None):
+    """Scan `grid` along `trajectory` into `store`, taking interleaved darks if `darks` is given."""
+    if trajectory not in TRAJECTORIES:
+        raise ValueError(f"Unknown trajectory {trajectory!r}: use one of {', '.join(TRAJECTORIES)}")
+    n_average = max(int(n_average), 1)
+    spectrometer.integration_time_micros(integration_time_us)
+    if wavelengths is None:
+        wavelengths = spectrometer.wavelengths()
+    if store is None:
+        store = HyperspectralMap(grid, wavelengths)
+    elif store.cube.shape != grid.shape + (len(wavelengths),):
+        raise ValueError(f"Map store of shape {store.cube.shape} does not fit a {grid.shape} grid "
+                         f"of {len(wavelengths)}-pixel spectra")
+    if trajectory == 'fly' and grid.x.size < 2:
+        trajectory = 'serpentine'  # A single column leaves nothing to sweep
+
+    timeline = None
+    if darks is not None:
+        if not set_light_source(spectrometer, True):
+            raise ValueError("Interleaved darks need a shutter or lamp output on the spectrometer to switch "
+                             "the light off")
+        if light_callback is not None:
+            light_callback(True)
+        timeline = DarkTimeline(darks.interpolate)
+        dark = np.empty(len(wavelengths), dtype=np.float64)
+        dark_reasons = {}
+    dark_s = 0.0
+
+    n_done = 0
+    motion_s = acquiring_s = 0.0
+    frame_s = None  # Time one averaged spectrum takes
+    max_offset = 0.0
+
+    def point_done(row, column, spectrum, t):
+        nonlocal n_done
+        if errors:
+            raise OSError(errors[0])
+        if timeline is None:
+            disk.submit("Map point", store.write, row, column, spectrum.copy())
+            value = float(spectrum.sum())
+        else:
+            value = float(spectrum.sum() - timeline.latest.sum())
+            # Stored uncorrected: the point is corrected in place, and marked done, once the next dark is in
+            disk.submit("Map point", store.write, row, column, spectrum.copy(), done=False)
+            timeline.add_frame(t, (row, column))
+        n_done += 1
+        if ring is not None:
+            ring.push(spectrum if timeline is None else spectrum - timeline.latest, t)
+        if data_callback is not None:
+            data_callback((row, column, value))
+        if progress_callback is not None:
+            progress_callback(int(100 * n_done / grid.n_points))
+
+    def switch_light(on):
+        set_light_source(spectrometer, on)
+        if light_callback is not None:
+            light_callback(on)
+        if darks.settle_s:
+            time.sleep(darks.settle_s)
+
+    def take_dark(reason):
+        nonlocal dark_s
+        start = time.monotonic()
+        switch_light(False)
+        try:
+            exposure_start = time.monotonic()
+            average_scans(spectrometer, dark, n_average)
+            t = 0.5 * (exposure_start + time.monotonic())
+        finally:
+            switch_light(True)  # Also when the read fails: the sample must not be left in the dark
+        darks.dark_taken(t, dark)
+        for (row, column), dark_at_frame in timeline.add_dark(t, dark):
+            disk.submit("Map dark correction", store.subtract, row, column, dark_at_frame)
+        dark_reasons[reason] = dark_reasons.get(reason, 0) + 1
+        dark_s += time.monotonic() - start
+
+    t0 = time.monotonic()
+    disk, errors = background_writes()
+    try:
+        if timeline is not None:
+            take_dark('start')
+        if trajectory == 'fly':
+            # One row of frames, with room for a stage running slower than asked
+            frames = np.empty((2 * grid.x.size + 16, len(wavelengths)), dtype=np.float64)
+            stage.move_to(grid.x[0], grid.y[0], grid.z)
+            start = time.monotonic()
+            average_scans(spectrometer, frames[0], n_average)  # Measures how long a frame takes
+            frame_s = time.monotonic() - start
+            for row in range(grid.y.size):
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                swept = _fly_row(spectrometer, stage, grid, row, row % 2 == 1, n_average, frame_s, frames, cancel_event)
+                if swept is None:
+                    break
+                columns, nearest, offsets, run_up_s, times = swept
+                motion_s += run_up_s
+                max_offset = max(max_offset, float(np.max(np.abs(offsets))))
+                reason = None
+                for column, frame, t in zip(columns, nearest, times):
+                    point_done(row, column, frames[frame], t)
+                    if timeline is not None:
+                        reason = darks.due(t, frames[frame]) or reason
+                if reason is not None:
+                    take_dark(reason)  # The stage cannot stop mid-row: darks go between rows
+                disk.submit("Map flush", store.flush)
+        else:
+            spectrum = np.empty(len(wavelengths), dtype=np.float64)
+            current_row = None
+            n_frames = 0
+            for row, column, x, y in grid.points(serpentine=trajectory == 'serpentine'):
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                if row != current_row:
+                    disk.submit("Map flush", store.flush)
+                    current_row = row
+                start = time.monotonic()
+                stage.move_to(x, y, grid.z)
+                moved = time.monotonic()
+                average_scans(spectrometer, spectrum, n_average)
+                end = time.monotonic()
+                motion_s += moved - start
+                acquiring_s += end - moved
+                n_frames += 1
+                point_done(row, column, spectrum, 0.5 * (moved + end))
+                if timeline is not None:
+                    reason = darks.due(0.5 * (moved + end), spectrum)
+                    if reason is not None:
+                        take_dark(reason)
+            if n_frames:
+                frame_s = acquiring_s / n_frames
+        if timeline is not None:
+            if timeline.n_pending and not (cancel_event is not None and cancel_event.is_set()):
+                take_dark('end')
+            for (row, column), dark_at_frame in timeline.finish():
+                disk.submit("Map dark correction", store.subtract, row, column, dark_at_frame)
+        finish_writes(disk, errors)
+    except BaseException:
+        disk.close()
+        store.close()  # Keeps what was written, with its `done` index, before the error goes up
+        raise
+    store.flush()
+    elapsed = time.monotonic() - t0
+
+    store.timing = {
+        'trajectory': trajectory,
+        'points': store.n_done,
+        'elapsed_s': elapsed,
+        'point_rate_hz': store.n_done / elapsed if elapsed > 0 else 0.0,
+        'motion_s': motion_s,
+    }
+    if trajectory == 'fly':
+        store.timing['max_offset_um'] = max_offset
+    if timeline is not None:
+        store.timing['darks'] = len(timeline.darks)
+        store.timing['dark_s'] = dark_s
+        store.timing['dark_reasons'] = dark_reasons
+        store.timing['dark_interpolated'] = darks.interpolate
+    raster_motion_s = grid.motion_time(stage)
+    if raster_motion_s is not None and frame_s is not None:
+        # A raster scan takes the same frames and darks, plus stopping at every point
+        raster_s = n_done * frame_s + raster_motion_s * n_done / grid.n_points + dark_s
+        store.timing['estimated_raster_s'] = raster_s
+        store.timing['saved_s'] = raster_s - elapsed
+    return store
@@ -0,0 +1,531 @@
+import matplotlib
+import numpy as np
+
+########################################################################
+# DISPLAY DECIMATION
+########################################################################
+
+def decimate_minmax(x, y, n_columns, x_range=None):
+    """Reduce a sorted trace to the minimum and maximum of each of `n_columns` chunks of `x_range`."""
+    keep = decimation_indices(x, y, n_columns, x_range)
+    return np.asarray(x)[keep], np.asarray(y)[keep]
+
+
+def decimation_indices(x, y, n_columns, x_range=None):
+    """Indices of the samples decimate_minmax keeps, in ascending order."""
+    x = np.asarray(x)
+    y = np.asarray(y)
+    start, stop = 0, len(x)
+    if x_range is not None and len(x) > 1:
+        start = max(int(np.searchsorted(x, x_range[0], side='left')) - 1, 0)
+        stop = min(int(np.searchsorted(x, x_range[1], side='right')) + 1, len(x))
+    y = y[start:stop]
+    n = len(y)
+    n_columns = max(int(n_columns), 1)
+    if n <= 2 * n_columns:
+        return np.arange(start, stop)
+
+    chunk = -(-n // n_columns)  # Ceiling division
+    padded = n_columns * chunk
+    if padded > n:
+        # Repeat the last sample so the data reshapes into whole chunks
+        y_chunks = np.concatenate([y, np.full(padded - n, y[-1])]).reshape(n_columns, chunk)
+    else:
+        y_chunks = y.reshape(n_columns, chunk)
+    nans = np.isnan(y_chunks)
+    if nans.any():
+        i_min = np.argmin(np.where(nans, np.inf, y_chunks), axis=1)
+        i_max = np.argmax(np.where(nans, -np.inf, y_chunks), axis=1)
+    else:
+        i_min = np.argmin(y_chunks, axis=1)
+        i_max = np.argmax(y_chunks, axis=1)
+    offsets = np.arange(n_columns) * chunk
+    keep = np.sort(np.stack([i_min + offsets, i_max + offsets], axis=1), axis=1).ravel()
+    return start + np.minimum(keep, n - 1)
+
+########################################################################
+# AUTOSCALING
+########################################################################
+
+def autoscale_limits(y, margin=0.05, clip_percentile=None):
+    """Axis limits around the finite values of `y` with a relative `margin`, optionally clipped."""
+    y = np.asarray(y, dtype=float).ravel()
+    finite = np.isfinite(y)
+    if not finite.all():
+        y = y[finite]
+    if y.size < 2:
+        return 0.0, 1.0
+    if clip_percentile is None:
+        low, high = y.min(), y.max()
+    else:
+        low, high = np.percentile(y, [100.0 - clip_percentile, clip_percentile])
+    span = high - low
+    if span == 0:
+        span = abs(high) or 1.0
+    return float(low - span * margin), float(high + span * margin)
+
+########################################################################
+# PERSISTENT SPECTRUM PLOTS
+########################################################################
+
+class SpectrumPlot:
+    """Persistent, decimated line artists of one canvas, updated in place."""
+    label_fontsize = 14
+    tick_fontsize = 14
+    y_margin = 0.05  # 5% buffer above and below the trace
+    xlabel = 'Wavelength (nm)'
+
+    def __init__(self, canvas, axes=None):
+        self.canvas = canvas
+        self.axes = axes if axes is not None else canvas.axes
+        self.lines = {}
+        self.bands = {}
+        self.data = {}  # Full-resolution (x, y) of every trace
+        self.errors = {}  # Full-resolution errors of the traces drawn with a band
+        self.current = None  # Key of the trace on display
+        self._styled = False
+        self._updating = False
+
+    def _style_axes(self):
+        """Build the static parts of the plot: background, grid and ticks."""
+        ax = self.axes
+        ax.clear()  # Restores the default locators removed by reset()
+        ax.set_axis_on()
+        ax.set_facecolor('black')
+        ax.yaxis.grid(True, linestyle='--', color='gray')
+        ax.xaxis.grid(True, linestyle='--', color='gray')
+        ax.set_xlabel(self.xlabel, fontsize=self.label_fontsize, color='white', labelpad=5.0)
+        ax.tick_params(axis='both', labelsize=self.tick_fontsize, colors='white')
+        ax.callbacks.connect('xlim_changed', self._on_xlim_changed)  # clear() drops callbacks
+        self.lines = {}
+        self.bands = {}
+        self.data = {}
+        self.errors = {}
+        self.current = None
+        self._styled = True
+
+    def show(self, key, x, y, label, color, ylabel, errors=None, clip_percentile=None):
+        """Display trace `key` with new data (and an error band), hiding the other traces."""
+        if not self._styled:
+            self._style_axes()
+        ax = self.axes
+        x, y = np.asarray(x), np.asarray(y)
+        self.data[key] = (x, y)
+        x_range = (x[0], x[-1]) if len(x) > 1 else None
+        keep = decimation_indices(x, y, self._columns(), x_range)
+        x_shown, y_shown = x[keep], y[keep]
+        line = self.lines.get(key)
+        if line is None:
+            line, = ax.plot(x_shown, y_shown, label=label, color=color)
+            self.lines[key] = line
+        else:
+            line.set_data(x_shown, y_shown)
+
+        self.errors.pop(key, None)
+        if errors is not None and np.any(errors > 0):
+            self.errors[key] = np.asarray(errors)
+        self._draw_band(key, keep)
+
+        if key != self.current:
+            for other_key, other in self.lines.items():
+                other.set_visible(other_key == key)
+            for other_key, other in self.bands.items():
+                other.set_visible(other_key == key)
+            ax.set_ylabel(ylabel, fontsize=self.label_fontsize, color='white', labelpad=1.5)
+            ax.legend(handles=[line], fontsize=self.label_fontsize, loc='upper right', framealpha=0.5)
+            self.current = key
+
+        self._updating = True  # The line already matches the new x-range
+        try:
+            if len(x) > 1:
+                ax.set_xlim(x[0], x[-1])
+            ax.set_ylim(*autoscale_limits(y, self.y_margin, clip_percentile))
+        finally:
+            self._updating = False
+        self.canvas.draw_idle()
+        return line
+
+    def _columns(self):
+        """Width of the axes in device pixels: the useful number of columns to draw."""
+        return max(int(self.axes.bbox.width), 100)
+
+    def _draw_band(self, key, keep):
+        """Redraw the error band of trace `key` through the samples `keep` of its line, if it has errors."""
+        band = self.bands.pop(key, None)
+        if band is not None:
+            band.remove()
+        errors = self.errors.get(key)
+        if errors is None:
+            return
+        x, y = self.data[key]
+        x, y, errors = x[keep], y[keep], errors[keep]
+        band = self.axes.fill_between(x, y - errors, y + errors, color=self.lines[key].get_color(), alpha=0.3,
+                                      linewidth=0)
+        band.set_visible(key == self.current)
+        self.bands[key] = band
+
+    def _on_xlim_changed(self, ax):
+        if self._updating or self.current not in self.data:
+            return
+        x, y = self.data[self.current]
+        keep = decimation_indices(x, y, self._columns(), ax.get_xlim())
+        self.lines[self.current].set_data(x[keep], y[keep])
+        if self.current in self.errors:
+            self._draw_band(self.current, keep)
+
+    def reset(self):
+        """Remove every trace and leave a blank canvas without ticks or labels."""
+        ax = self.axes
+        ax.clear()
+        ax.set_facecolor('black')
+        ax.set_xticks([])  # Remove x-axis ticks
+        ax.set_yticks([])  # Remove y-axis ticks
+        ax.set_xlabel('')  # Remove x-axis label
+        ax.set_ylabel('')  # Remove y-axis label
+        self.lines = {}
+        self.bands = {}
+        self.data = {}
+        self.errors = {}
+        self.current = None
+        self._styled = False
+        self.canvas.draw()
+
+########################################################################
+# LIVE MAP IMAGE
+########################################################################
+
+class MapImage:
+    """Image of a map that fills in point by point while the scan runs."""
+    label_fontsize = 14
+    tick_fontsize = 12
+    cmap = 'inferno'
+
+    def __init__(self, canvas, axes=None):
+        self.canvas = canvas
+        self.axes = axes if axes is not None else canvas.axes
+        self.data = None
+        self.image = None
+        self.colorbar = None
+        self.dirty = False
+        self._flip_rows = self._flip_columns = False
+
+    def start(self, x, y, label='Integrated intensity (count)'):
+        """Set up an empty image for a map with column positions `x` and row positions `y` (um)."""
+        ax = self.axes
+        self.data = np.ma.masked_all((len(y), len(x)))
+        step_x = abs(x[1] - x[0]) if len(x) > 1 else 1.0
+        step_y = abs(y[1] - y[0]) if len(y) > 1 else 1.0
+        # Pixel centres sit on the stage positions
+        extent = (min(x) - step_x / 2, max(x) + step_x / 2, min(y) - step_y / 2, max(y) + step_y / 2)
+        if self.image is None:
+            ax.clear()
+            ax.set_axis_on()
+            ax.set_facecolor('black')
+            ax.set_xlabel('X (um)', fontsize=self.label_fontsize, color='white')
+            ax.set_ylabel('Y (um)', fontsize=self.label_fontsize, color='white')
+            ax.tick_params(axis='both', labelsize=self.tick_fontsize, colors='white')
+            self.image = ax.imshow(self.data, origin='lower', extent=extent, cmap=self.cmap,
+                                   interpolation='nearest', aspect='equal')
+            self.colorbar = self.canvas.figure.colorbar(self.image, ax=ax)
+            self.colorbar.ax.tick_params(labelsize=self.tick_fontsize, colors='white')
+        else:
+            self.image.set_data(self.data)
+            self.image.set_extent(extent)
+        self.colorbar.set_label(label, fontsize=self.label_fontsize, color='white')
+        # Rows are flipped in the data when Y (or X) is scanned towards smaller positions
+        self._flip_rows = len(y) > 1 and y[1] < y[0]
+        self._flip_columns = len(x) > 1 and x[1] < x[0]
+        self.dirty = True
+        self.refresh()
+
+    def set_point(self, row, column, value):
+        """Fill in one point; it shows up on the next refresh()."""
+        if self.data is None:
+            return  # Reset while the map was running
+        if self._flip_rows:
+            row = self.data.shape[0] - 1 - row
+        if self._flip_columns:
+            column = self.data.shape[1] - 1 - column
+        self.data[row, column] = value
+        self.dirty = True
+
+    def show(self, image, label):
+        """Replace the whole image, e.g. by a map computed from the finished cube; NaN stays blank."""
+        if self.image is None:
+            return
+        image = np.asarray(image)
+        if self._flip_rows:
+            image = image[::-1]
+        if self._flip_columns:
+            image = image[:, ::-1]
+        self.data = np.ma.masked_invalid(image)
+        self.colorbar.set_label(label, fontsize=self.label_fontsize, color='white')
+        self.dirty = True
+        self.refresh()
+
+    def refresh(self):
+        """Push the points filled in since the last refresh to the screen, if there are any."""
+        if not self.dirty or self.image is None:
+            return False
+        self.image.set_data(self.data)
+        filled = self.data.compressed()
+        if filled.size:
+            low, high = autoscale_limits(filled, margin=0.0)
+            self.image.set_clim(low, high)
+        self.canvas.draw_idle()
+        self.dirty = False
+        return True
+
+    def reset(self):
+        """Remove the image and colour bar and leave a blank canvas."""
+        if self.colorbar is not None:
+            self.colorbar.remove()
+        ax = self.axes
+        ax.clear()
+        ax.set_facecolor('black')
+        ax.set_axis_off()
+        self.data = None
+        self.image = None
+        self.colorbar = None
+        self.dirty = False
+        self.canvas.draw()
+
+########################################################################
+# STREAMING DISPLAY
+########################################################################
+
+class WaterfallView:
+    """Waterfall of the latest `n_rows` spectra of a stream, newest at the top, redrawn by blitting."""
+    label_fontsize = 14
+    tick_fontsize = 12
+    cmap = 'inferno'
+
+    def __init__(self, canvas, n_rows=300, axes=None):
+        self.canvas = canvas
+        self.axes = axes if axes is not None else canvas.axes
+        self.n_rows = n_rows
+        self.values = None
+        self.colors = None
+        self.bins = None  # First pixel of each screen column
+        self.count = 0  # Spectra pushed since start()
+        self.image = None
+        self.colorbar = None
+        self.background = None
+        self.dirty = False
+        self.full_draws = 0  # Full draws asked for since start(), for benchmarks
+        self._rescale_at = 0
+        self._widen = None  # (low, high) the colour scale must cover from the next refresh
+        self._draw_cid = None
+        # Colours are computed here, the image only shows them: the colour bar has its own mappable
+        self._mappable = matplotlib.cm.ScalarMappable(matplotlib.colors.Normalize(0.0, 1.0),
+                                                      matplotlib.colormaps[self.cmap])
+
+    def start(self, wavelengths, label='Intensity (count)'):
+        """Set up an empty waterfall for spectra sampled at `wavelengths`."""
+        ax = self.axes
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        # Rings are stored twice over, so the last n_rows rows are always one contiguous view
+        self.values = np.full((2 * self.n_rows, len(wavelengths)), np.nan, dtype=np.float32)
+        self.colors = None
+        self.count = 0
+        self._bin_columns()
+        self.full_draws = 0
+        self._rescale_at = 0
+        self._widen = None
+        # Row centres count spectra back from the newest one, at the top
+        extent = (wavelengths[0], wavelengths[-1], self.n_rows - 0.5, -0.5)
+        if self.image is None:
+            ax.clear()
+            ax.set_axis_on()
+            ax.set_facecolor('black')
+            ax.set_xlabel('Wavelength (nm)', fontsize=self.label_fontsize, color='white')
+            ax.set_ylabel('Spectra before newest', fontsize=self.label_fontsize, color='white')
+            ax.tick_params(axis='both', labelsize=self.tick_fontsize, colors='white')
+            self.image = ax.imshow(self._view(self.colors), origin='lower', extent=extent,
+                                   interpolation='nearest', aspect='auto', animated=True)
+            self.colorbar = self.canvas.figure.colorbar(self._mappable, ax=ax)
+            self.colorbar.ax.tick_params(labelsize=self.tick_fontsize, colors='white')
+            self._draw_cid = self.canvas.mpl_connect('draw_event', self._on_draw)
+        else:
+            self.image.set_data(self._view(self.colors))
+            self.image.set_extent(extent)
+        self._mappable.set_clim(0.0, 1.0)
+        self.colorbar.set_label(label, fontsize=self.label_fontsize, color='white')
+        self.dirty = False
+        self._full_draw()
+
+    def _bin_columns(self):
+        """Bin the pixels into the screen columns of the axes and colour the whole ring for them."""
+        n_pixels = self.values.shape[1]
+        n_columns = min(n_pixels, max(int(self.axes.bbox.width), 100))
+        if self.colors is not None and len(self.bins) == n_columns:
+            return False
+        self.bins = np.linspace(0, n_pixels, n_columns, endpoint=False).astype(int)
+        self.colors = np.zeros((2 * self.n_rows, n_columns, 4), dtype=np.uint8)  # Transparent
+        self._recolor()
+        return True
+
+    def _binned(self, values):
+        return np.maximum.reduceat(values, self.bins, axis=-1)
+
+    def _recolor(self):
+        binned = self._binned(self.values)
+        self.colors[:] = self._mappable.to_rgba(binned, bytes=True)
+        self.colors[np.isnan(binned), 3] = 0  # Rows not filled yet stay transparent
+
+    def _view(self, ring):
+        """The last `n_rows` rows of a ring, oldest first, as a view of its doubled buffer."""
+        head = self.count % self.n_rows
+        return ring[head:head + self.n_rows]
+
+    def push(self, spectrum):
+        """Write one spectrum into the rings; it shows up on the next refresh()."""
+        if self.values is None:
+            return  # Reset while the stream was running
+        row = self.count % self.n_rows
+        colors = self._mappable.to_rgba(self._binned(spectrum), bytes=True)
+        self.values[row] = self.values[row + self.n_rows] = spectrum
+        self.colors[row] = self.colors[row + self.n_rows] = colors
+        self.count += 1
+        self.dirty = True
+        low, high = self._widen or self._mappable.get_clim()
+        spectrum_low, spectrum_high = np.nanmin(spectrum), np.nanmax(spectrum)
+        if spectrum_low < low or spectrum_high > high:
+            self._widen = (min(low, spectrum_low), max(high, spectrum_high))
+
+    def add(self, frames):
+        """Write several spectra into the rings, oldest first."""
+        for spectrum in np.asarray(frames)[-self.n_rows:]:
+            self.push(spectrum)
+
+    def refresh(self):
+        """Show the spectra pushed since the last refresh, blitting unless the colour scale changes."""
+        if not self.dirty or self.image is None:
+            return False
+        self.dirty = False
+        if self._widen is not None or self.count >= self._rescale_at:
+            self._rescale()
+            self.image.set_data(self._view(self.colors))
+            self._full_draw()
+            return True
+        self.image.set_data(self._view(self.colors))
+        if self.background is None:
+            self._full_draw()
+            return True
+        self.canvas.restore_region(self.background)
+        self._draw_animated()
+        self.canvas.blit(self.axes.bbox)
+        return True
+
+    def _rescale(self):
+        """Widen or refit the colour scale and colour the whole ring again."""
+        if self.count >= self._rescale_at:
+            shown = self._view(self.values)[-min(self.count, self.n_rows):]
+            self._mappable.set_clim(*autoscale_limits(shown, margin=0.1, clip_percentile=99.9))
+            self._rescale_at = self.count + self.n_rows
+        else:
+            # Leave room for the noise of the next spectra, or the scale would widen with every one
+            low, high = self._widen
+            self._mappable.set_clim(*autoscale_limits([low, high], margin=0.25))
+        self._widen = None
+        self._recolor()
+
+    def _full_draw(self):
+        self.full_draws += 1
+        self.canvas.draw_idle()
+
+    def _on_draw(self, event):
+        """Keep the static background of every full draw, then put the animated artists on top."""
+        if self.image is None:
+            return
+        if self._bin_columns():
+            self.image.set_data(self._view(self.colors))  # The axes were resized
+        self.background = self.canvas.copy_from_bbox(self.axes.bbox)
+        self._draw_animated()
+
+    def _draw_animated(self):
+        self.axes.draw_artist(self.image)
+        # Other animated artists of the axes, e.g. a SpanSelector, stay on top of the image
+        for artist in self.axes.get_children():
+            if artist is not self.image and artist.get_animated() and artist.get_visible():
+                self.axes.draw_artist(artist)
+
+    def reset(self):
+        """Remove the image and colour bar and leave a blank canvas."""
+        if self._draw_cid is not None:
+            self.canvas.mpl_disconnect(self._draw_cid)
+            self._draw_cid = None
+        if self.colorbar is not None:
+            self.colorbar.remove()
+        ax = self.axes
+        ax.clear()
+        ax.set_facecolor('black')
+        ax.set_axis_off()
+        self.values = None
+        self.colors = None
+        self.bins = None
+        self.count = 0
+        self.image = None
+        self.colorbar = None
+        self.background = None
+        self.dirty = False
+        self.canvas.draw()
+
+
+class TraceBuffer:
+    """Bounded (time, value) history of a band intensity, averaged down as the run grows."""
+
+    def __init__(self, capacity=20000):
+        self.capacity = capacity - capacity % 2
+        self._t = np.empty(self.capacity)
+        self._v = np.empty(self.capacity)
+        self.clear()
+
+    def clear(self):
+        self.n = 0
+        self.stride = 1
+        self._pending = []
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def times(self):
+        return self._t[:self.n]
+
+    @property
+    def values(self):
+        return self._v[:self.n]
+
+    def append(self, times, values):
+        for t, v in zip(np.ravel(times), np.ravel(values)):
+            self._pending.append((t, v))
+            if len(self._pending) < self.stride:
+                continue
+            if self.n == self.capacity:
+                self._halve()
+            t_mean, v_mean = np.mean(self._pending, axis=0)
+            self._t[self.n] = t_mean
+            self._v[self.n] = v_mean
+            self.n += 1
+            self._pending = []
+
+    def set(self, times, values):
+        """Replace the history, e.g. by the band of a whole recording read from disk."""
+        self.clear()
+        times = np.asarray(times, dtype=float)
+        values = np.asarray(values, dtype=float)
+        while len(times) > self.stride * self.capacity:
+            self.stride *= 2
+        n = len(times) // self.stride
+        self._t[:n] = times[:n * self.stride].reshape(n, self.stride).mean(axis=1)
+        self._v[:n] = values[:n * self.stride].reshape(n, self.stride).mean(axis=1)
+        self.n = n
+        self._pending = list(zip(times[n * self.stride:], values[n * self.stride:]))
+
+    def _halve(self):
+        half = self.n // 2
+        self._t[:half] = self._t[:2 * half].reshape(half, 2).mean(axis=1)
+        self._v[:half] = self._v[:2 * half].reshape(half, 2).mean(axis=1)
+        self.n = half
+        self.stride *= 2
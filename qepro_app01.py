@@ -1,10 +1,11 @@
+import os
 import sys
 import matplotlib
 matplotlib.use('Qt5Agg')
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 import matplotlib.ticker as ticker
-from matplotlib.widgets import Cursor
+from matplotlib.widgets import Cursor, SpanSelector
 import queue
 import numpy as np
 from PyQt5 import QtCore, QtWidgets, QtGui
@@ -13,8 +14,14 @@ from PyQt5 import uic
 from PyQt5.QtWidgets import QLabel
 from PyQt5.QtCore import pyqtSlot
 import time
-from itertools import count, islice
+import inspect
+import threading
 from seabreeze.spectrometers import Spectrometer, list_devices
+from acquisition import acquire_averaged_spectrum, acquire_kinetics, AcquisitionRecord, CalibrationCache, DarkLibrary, DarkScheduler, detector_temperature, electric_dark_pixels, format_timing_report, set_light_source, SimulatedSpectrometer, SpectrumRingBuffer, stream_spectra
+from map_analysis import nmf, pca, WindowMaps
+from mapping import acquire_map, MapGrid, SimulatedEmitter, SimulatedStage
+from plotting import MapImage, SpectrumPlot, TraceBuffer, WaterfallView
+from spectral_io import AsyncFileWriter, CONTAINER_EXTENSION, CUBE_EXTENSION, CubeStore, KINETICS_EXTENSION, KineticsRecording, KineticsWriter, trapezoid, write_container, write_spectrum_text
 
 ########################################################################
 # IMPORT GUI FILE
@@ -22,6 +29,8 @@ from interface12 import *
 ########################################################################
 
 class MplCanvas(FigureCanvas):
+    hover_interval_ms = 16  # Crosshair updates are limited to ~60 Hz
+
     def __init__(self, parent=None, width=5.0, height=4.95, dpi=100):
         # Create the figure with a dark background
         fig = Figure(figsize=(width, height), dpi=dpi, facecolor='black')  # Dark figure background
@@ -31,6 +40,17 @@ class MplCanvas(FigureCanvas):
         # Custom layout adjustments (e.g., set padding, margins, etc.)
         self.adjust_layout()
 
+        # Crosshair state: cached background for blitting and the latest mouse position
+        self._background = None
+        self._crosshair = None
+        self._coord_text = None
+        self._readout = None
+        self._pending_hover = None
+        self._hover_timer = QtCore.QTimer(self)
+        self._hover_timer.setSingleShot(True)
+        self._hover_timer.setInterval(self.hover_interval_ms)
+        self._hover_timer.timeout.connect(self._flush_hover)
+
     def adjust_layout(self):
         """Manually adjust layout to remove axes and ticks."""
         # Adjusting the subplot parameters for better spacing
@@ -39,7 +59,135 @@ class MplCanvas(FigureCanvas):
         # Adjust the plot background color if needed (optional)
         self.axes.set_facecolor('black')  # Dark background for consistency
 
+    def enable_crosshair(self, readout=None):
+        """Follow the mouse with a blitted crosshair, passing data coordinates to `readout`."""
+        self._readout = readout
+        self.mpl_connect('draw_event', self._on_draw)
+        self.mpl_connect('motion_notify_event', self._on_hover)
+
+    def _ensure_crosshair(self):
+        """(Re)create the crosshair artists, e.g. after the axes were cleared."""
+        if self._crosshair is not None and self._crosshair in self.axes.texts:
+            return
+        self._crosshair = self.axes.annotate("+", xy=(0, 0), xytext=(0, 0),
+                                             textcoords="offset points", color='yellow', fontsize=20,
+                                             ha='center', va='center', visible=False, animated=True)
+        self._coord_text = self.axes.annotate("", xy=(0, 0), xytext=(0, 15), textcoords="offset points",
+                                              color='yellow', fontsize=14, ha='left', va='bottom',
+                                              bbox=dict(boxstyle="round,pad=0.3", edgecolor='yellow',
+                                                        facecolor='black', alpha=0.6), visible=False, animated=True)
+
+    def _on_draw(self, event):
+        # A full redraw happened: cache it as the background and put the crosshair back on top
+        self._background = self.copy_from_bbox(self.figure.bbox)
+        if self._crosshair is not None and self._crosshair.get_visible():
+            self.axes.draw_artist(self._crosshair)
+            self.axes.draw_artist(self._coord_text)
+
+    def _on_hover(self, event):
+        # Keep only the latest position; render at most once per hover interval
+        self._pending_hover = event
+        if not self._hover_timer.isActive():
+            self._flush_hover()
+
+    def _flush_hover(self):
+        event, self._pending_hover = self._pending_hover, None
+        if event is None:
+            return
+        # Every render, immediate or from the timer, opens a new interval
+        self._hover_timer.start()
+        self._ensure_crosshair()
+        has_data = any(line.get_visible() for line in self.axes.lines)
+        inside = event.inaxes == self.axes and has_data and event.xdata is not None
+        if inside:
+            x, y = event.xdata, event.ydata
+            self._crosshair.xy = (x, y)
+            self._coord_text.xy = (x, y)
+            self._coord_text.set_text(f"{x:.2f}, {y:.2f}")
+        elif not self._crosshair.get_visible():
+            return  # Still outside: nothing to redraw
+        self._crosshair.set_visible(inside)
+        self._coord_text.set_visible(inside)
+
+        if self._background is None:
+            self.draw_idle()  # The background gets cached by this draw
+        else:
+            self.restore_region(self._background)
+            if inside:
+                self.axes.draw_artist(self._crosshair)
+                self.axes.draw_artist(self._coord_text)
+            self.blit(self.figure.bbox)
+        if self._readout is not None:
+            self._readout(*((x, y) if inside else (None, None)))
+
+class DecompositionPage(QtWidgets.QWidget):
+    """Page showing one component of a map decomposition: its score image and its spectrum."""
+    def __init__(self, name, template_comboBox, parent=None):
+        super().__init__(parent)
+        self.setObjectName(f"{name}_page")
+        layout = QtWidgets.QVBoxLayout(self)
+        controls = QtWidgets.QHBoxLayout()
+        self.component_comboBox = QtWidgets.QComboBox(self)
+        self.component_comboBox.setObjectName(f"{name}_component_comboBox")
+        self.component_comboBox.setFont(template_comboBox.font())
+        self.component_comboBox.setStyleSheet(template_comboBox.styleSheet())
+        self.info_label = QLabel("", self)
+        self.info_label.setStyleSheet("color: white;")
+        controls.addWidget(self.component_comboBox)
+        controls.addWidget(self.info_label, 1)
+        layout.addLayout(controls)
+        canvases = QtWidgets.QHBoxLayout()
+        self.score_canvas = MplCanvas(self, width=5, height=4, dpi=100)
+        self.component_canvas = MplCanvas(self, width=5, height=4, dpi=100)
+        canvases.addWidget(self.score_canvas)
+        canvases.addWidget(self.component_canvas)
+        layout.addLayout(canvases, 1)
+        self.score_image = MapImage(self.score_canvas)
+        self.component_plot = SpectrumPlot(self.component_canvas)
+        self.decomposition = None
+        self.component_comboBox.currentIndexChanged.connect(self.show_component)
+
+    def show_result(self, decomposition, x, y):
+        """Show `decomposition` of the map with column positions `x` and row positions `y`, from component 1."""
+        self.decomposition = decomposition
+        self.component_plot.reset()  # Drops the lines of a previous result
+        self.score_image.start(x, y, 'Score')
+        self.component_comboBox.blockSignals(True)
+        self.component_comboBox.clear()
+        for i in range(decomposition.n_components):
+            text = f"Component {i + 1}"
+            if decomposition.explained is not None:
+                text += f" ({100 * decomposition.explained[i]:.2f}% of variance)"
+            self.component_comboBox.addItem(text)
+        self.component_comboBox.blockSignals(False)
+        if decomposition.method == 'pca':
+            info = f"PCA: {100 * np.sum(decomposition.explained):.2f}% of the variance explained"
+        else:
+            info = f"NMF: relative reconstruction error {100 * decomposition.residual:.2f}%"
+        self.info_label.setText(f"{info}, computed in {decomposition.elapsed_s:.2f} s")
+        self.show_component()
+
+    def show_component(self):
+        index = self.component_comboBox.currentIndex()
+        if self.decomposition is None or index < 0:
+            return
+        ylabel = 'Loading' if self.decomposition.method == 'pca' else 'Relative intensity'
+        self.component_plot.show(index, self.decomposition.wavelengths, self.decomposition.components[index],
+                                 f"Component {index + 1}", 'cyan', ylabel)
+        self.score_image.show(self.decomposition.scores[index], f"Score of component {index + 1}")
+
+    def reset(self):
+        """Forget the result and leave blank canvases."""
+        self.decomposition = None
+        self.component_comboBox.clear()
+        self.info_label.setText("")
+        self.score_image.reset()
+        self.component_plot.reset()
+
 class QePro_LIVE_PLOT_APP(QtWidgets.QMainWindow):
+    dark_saved_message = "Dark background saved to the dark library"  # Writer job of DarkLibrary.save
+    band_refresh_s = 0.25  # While spectra stream in, the band trace is redrawn at most this often
+
     def __init__(self):
         super().__init__()        
         self.ui = Ui_MainWindow()
@@ -64,10 +212,232 @@ class QePro_LIVE_PLOT_APP(QtWidgets.QMainWindow):
         # Add canvas to the background spectrum page layout
         abs_spectrum_layout = widgets.abs_spectrum_page.layout()
         abs_spectrum_layout.addWidget(self.abs_canvas)
+
+        # Map page: the image of a running map fills in point by point; once the map is done,
+        # windows dragged on its mean spectrum select what the image shows
+        self.map_page = QtWidgets.QWidget()
+        self.map_page.setObjectName("map_page")
+        map_layout = QtWidgets.QVBoxLayout(self.map_page)
+        map_controls = QtWidgets.QHBoxLayout()
+        self.map_quantity_comboBox = QtWidgets.QComboBox(self.map_page)
+        self.map_quantity_comboBox.setObjectName("map_quantity_comboBox")
+        self.map_quantity_comboBox.setFont(widgets.comboBox.font())
+        self.map_quantity_comboBox.setStyleSheet(widgets.comboBox.styleSheet())
+        for text, quantity in (("Integrated intensity", 'integral'), ("Peak position", 'peak'), ("FWHM", 'fwhm')):
+            self.map_quantity_comboBox.addItem(text, quantity)
+        self.map_window_label = QLabel("Drag on the spectrum to pick a wavelength window", self.map_page)
+        self.map_window_label.setStyleSheet("color: white;")
+        map_controls.addWidget(self.map_quantity_comboBox)
+        map_controls.addWidget(self.map_window_label, 1)
+        # Decomposition of the whole cube into a few component spectra and their score images
+        self.components_label = QLabel("Components:", self.map_page)
+        self.components_label.setStyleSheet("color: white;")
+        self.components_spinBox = QtWidgets.QSpinBox(self.map_page)
+        self.components_spinBox.setObjectName("components_spinBox")
+        self.components_spinBox.setRange(1, 20)
+        self.components_spinBox.setValue(4)
+        self.pca_pushButton = QtWidgets.QPushButton("PCA", self.map_page)
+        self.pca_pushButton.setObjectName("pca_pushButton")
+        self.nmf_pushButton = QtWidgets.QPushButton("NMF", self.map_page)
+        self.nmf_pushButton.setObjectName("nmf_pushButton")
+        # The spectra of a running map, line by line, on the waterfall page
+        self.show_waterfall_pushButton = QtWidgets.QPushButton("Waterfall", self.map_page)
+        self.show_waterfall_pushButton.setObjectName("show_waterfall_pushButton")
+        for widget in (self.components_label, self.components_spinBox, self.pca_pushButton, self.nmf_pushButton,
+                       self.show_waterfall_pushButton):
+            map_controls.addWidget(widget)
+        map_layout.addLayout(map_controls)
+        map_canvases = QtWidgets.QHBoxLayout()
+        self.map_canvas = MplCanvas(self, width=5, height=4, dpi=100)
+        self.map_spectrum_canvas = MplCanvas(self, width=5, height=4, dpi=100)
+        map_canvases.addWidget(self.map_canvas)
+        map_canvases.addWidget(self.map_spectrum_canvas)
+        map_layout.addLayout(map_canvases, 1)
+        widgets.stackedWidget.addWidget(self.map_page)
+        # PCA and NMF pages: component spectra and score images of the last map
+        self.pca_page = DecompositionPage("pca", widgets.comboBox)
+        self.nmf_page = DecompositionPage("nmf", widgets.comboBox)
+        widgets.stackedWidget.addWidget(self.pca_page)
+        widgets.stackedWidget.addWidget(self.nmf_page)
+        # Waterfall page: the latest spectra of a kinetics run or a map as they stream in, and the
+        # intensity of a band dragged on them against time
+        self.waterfall_page = QtWidgets.QWidget()
+        self.waterfall_page.setObjectName("waterfall_page")
+        waterfall_layout = QtWidgets.QVBoxLayout(self.waterfall_page)
+        waterfall_controls = QtWidgets.QHBoxLayout()
+        self.band_label = QLabel("Drag on the waterfall to pick a band", self.waterfall_page)
+        self.band_label.setStyleSheet("color: white;")
+        self.waterfall_info_label = QLabel("", self.waterfall_page)
+        self.waterfall_info_label.setStyleSheet("color: white;")
+        self.show_map_pushButton = QtWidgets.QPushButton("Map", self.waterfall_page)
+        self.show_map_pushButton.setObjectName("show_map_pushButton")
+        waterfall_controls.addWidget(self.band_label, 1)
+        waterfall_controls.addWidget(self.waterfall_info_label)
+        waterfall_controls.addWidget(self.show_map_pushButton)
+        waterfall_layout.addLayout(waterfall_controls)
+        waterfall_canvases = QtWidgets.QHBoxLayout()
+        self.waterfall_canvas = MplCanvas(self, width=5, height=4, dpi=100)
+        self.band_canvas = MplCanvas(self, width=5, height=4, dpi=100)
+        waterfall_canvases.addWidget(self.waterfall_canvas)
+        waterfall_canvases.addWidget(self.band_canvas)
+        waterfall_layout.addLayout(waterfall_canvases, 1)
+        widgets.stackedWidget.addWidget(self.waterfall_page)
+
+        # Persistent line artists of each canvas: updates only change the data and limits
+        self.spectrum_plot = SpectrumPlot(self.canvas)
+        self.bkg_plot = SpectrumPlot(self.bkg_canvas)
+        self.abs_plot = SpectrumPlot(self.abs_canvas)
+        self.map_image = MapImage(self.map_canvas)
+        self.map_spectrum_plot = SpectrumPlot(self.map_spectrum_canvas)
+        self.waterfall = WaterfallView(self.waterfall_canvas)
+        self.band_plot = SpectrumPlot(self.band_canvas)
+        self.band_plot.xlabel = 'Time (s)'
+
+        # Single readout label for the mouse coordinates, shared by every canvas
+        self.coord_label = QLabel("Hover over the plot", widgets.frame_13)
+        self.coord_label.setObjectName("coord_label")
+        self.coord_label.setStyleSheet("color: white; background-color: black; padding: 2px;")
+        self.coord_label.setMinimumWidth(320)
+        widgets.horizontalLayout_8.addWidget(self.coord_label)
+        # Crosshair cursors, with the coordinates also shown in the readout label
+        self.canvas.enable_crosshair(lambda x, y: self.show_coordinates("Intensity", x, y))
+        self.abs_canvas.enable_crosshair(lambda x, y: self.show_coordinates("Absorption", x, y))
                   
-        self.background_spectrum = None
+        # Darks of every integration time, averaging and detector temperature used so far, kept across
+        # sessions: changing the settings picks the matching dark instead of subtracting a stale one.
+        # Darks older than a working day are ignored, and spectra record when their dark was taken
+        self.darks = DarkLibrary(directory=os.path.join(os.path.expanduser("~"), ".qepro", "darks"),
+                                 max_age_s=12 * 3600)
+        self.acq_dark_key = None  # Dark library key of the settings of the last acquisition
+        self.live_dark = None
         self.reference_spectrum = None
         self.q = queue.Queue(maxsize=20)
+        self.calibrations = CalibrationCache()
+        # Last finished acquisition of each kind ("emission", "absorption"), saved as is
+        self.records = {}
+        self.record_version = 0
+        self.acq_metadata = {}
+
+        # Acquisitions run on this pool so the GUI stays responsive
+        self.threadpool = QtCore.QThreadPool()
+        self.acq_worker = None
+
+        # All disk output goes through the writer thread; results come back as signals
+        self.writer_signals = WriterSignals()
+        self.writer_signals.saved.connect(self.on_file_saved)
+        self.writer_signals.failed.connect(self.on_file_save_failed)
+        self.writer = AsyncFileWriter(on_done=self.writer_signals.saved.emit, on_error=self.writer_signals.failed.emit)
+        # Light switched by a running map (for its darks), mirrored on the LASER/UV check box
+        self.light_signals = LightSignals()
+        self.light_signals.switched.connect(self.on_light_switched)
+        self.last_timing = None  # Timing report of the last multi-scan average
+
+        # Live view: the streaming worker fills a ring buffer and posts frame numbers on self.q,
+        # the refresh timer plots the newest frame at display rate
+        self.live_worker = None
+        self.live_ring = None
+        self.live_line = None
+        self.live_timer = QtCore.QTimer(self)
+        self.live_timer.setInterval(50)  # ~20 fps display refresh
+        self.live_timer.timeout.connect(self.refresh_live_view)
+
+        # LIVE VIEW BUTTON
+        self.live_pushButton = QtWidgets.QPushButton("Live View", widgets.frame_4)
+        self.live_pushButton.setObjectName("live_pushButton")
+        self.live_pushButton.setFont(widgets.pushButton_EmSpectrum.font())
+        self.live_pushButton.setStyleSheet(widgets.pushButton_EmSpectrum.styleSheet())
+        self.live_pushButton.setCheckable(True)
+        widgets.gridLayout_3.addWidget(self.live_pushButton, 5, 0, 1, 2)
+
+        # BURST MODE: take the averaged scans back to back through the onboard buffer
+        self.burst_checkBox = QtWidgets.QCheckBox("Burst (HW buffer)", widgets.frame_4)
+        self.burst_checkBox.setObjectName("burst_checkBox")
+        self.burst_checkBox.setFont(widgets.checkBox.font())
+        self.burst_checkBox.setToolTip("Ignore the interval and read the scans back to back,\n"
+                                       "using the spectrometer's onboard buffer when it has one.")
+        widgets.gridLayout_3.addWidget(self.burst_checkBox, 5, 2, 1, 1)
+
+        # MAP STEP SIZE: inserted below the X/Y/Z ranges, the map button moves down a row
+        self.step_label = QtWidgets.QLabel("Step (um):", widgets.frame_6)
+        self.step_label.setObjectName("step_label")
+        self.step_label.setFont(widgets.label_8.font())
+        widgets.gridLayout.addWidget(self.step_label, 4, 0, 1, 2)
+        self.step_doubleSpinBox = QtWidgets.QDoubleSpinBox(widgets.frame_6)
+        self.step_doubleSpinBox.setObjectName("step_doubleSpinBox")
+        self.step_doubleSpinBox.setFont(widgets.doubleSpinBox_4.font())
+        self.step_doubleSpinBox.setStyleSheet(widgets.doubleSpinBox_4.styleSheet())
+        self.step_doubleSpinBox.setRange(0.01, 99.99)
+        self.step_doubleSpinBox.setValue(1.0)
+        widgets.gridLayout.addWidget(self.step_doubleSpinBox, 4, 2, 1, 1)
+        # MAP TRAJECTORY: stop at every point (raster, serpentine) or sweep the rows (fly scan)
+        self.trajectory_comboBox = QtWidgets.QComboBox(widgets.frame_6)
+        self.trajectory_comboBox.setObjectName("trajectory_comboBox")
+        self.trajectory_comboBox.setFont(widgets.doubleSpinBox_4.font())
+        for text, trajectory in (("Raster", 'raster'), ("Serpentine", 'serpentine'), ("Fly scan", 'fly')):
+            self.trajectory_comboBox.addItem(text, trajectory)
+        self.trajectory_comboBox.setToolTip("Fly scan sweeps each row without stopping and places the spectra\n"
+                                            "from the stage encoder timestamps.")
+        widgets.gridLayout.addWidget(self.trajectory_comboBox, 4, 3, 1, 2)
+        # MAP DARKS: interleave darks into long maps, the light being switched off for each
+        self.dark_comboBox = QtWidgets.QComboBox(widgets.frame_6)
+        self.dark_comboBox.setObjectName("dark_comboBox")
+        self.dark_comboBox.setFont(widgets.doubleSpinBox_4.font())
+        for text, trigger in (("No darks", None), ("Dark every N points", 'frames'), ("Dark every T min", 'time'),
+                              ("Dark on drift (counts)", 'drift')):
+            self.dark_comboBox.addItem(text, trigger)
+        self.dark_comboBox.setToolTip("Take darks during the map, with the light switched off through the\n"
+                                      "spectrometer's shutter/lamp output; drift is read on the masked pixels.")
+        widgets.gridLayout.addWidget(self.dark_comboBox, 5, 0, 1, 3)
+        self.dark_doubleSpinBox = QtWidgets.QDoubleSpinBox(widgets.frame_6)
+        self.dark_doubleSpinBox.setObjectName("dark_doubleSpinBox")
+        self.dark_doubleSpinBox.setFont(widgets.doubleSpinBox_4.font())
+        self.dark_doubleSpinBox.setStyleSheet(widgets.doubleSpinBox_4.styleSheet())
+        self.dark_doubleSpinBox.setRange(0.1, 99999.0)
+        self.dark_doubleSpinBox.setValue(100.0)
+        widgets.gridLayout.addWidget(self.dark_doubleSpinBox, 5, 3, 1, 2)
+        widgets.gridLayout.removeWidget(widgets.pushButton_8)
+        widgets.gridLayout.addWidget(widgets.pushButton_8, 6, 0, 1, 5)
+
+        # Maps move the sample with this stage: a driver implementing mapping.Stage. None is wired
+        # in yet, so only demo mode can map, on a simulated stage carrying a simulated sample
+        self.stage = None
+        self.demo_stage = SimulatedStage(velocity_um_s=1000, settle_s=0.02)
+        self.map_result = None
+        self.window_maps = None  # Window images of the last map, computed once it is done
+        self.window_selector = None
+        self.map_window = None  # (low, high) wavelength window shown on the map, in nm
+        self.analysis_worker = None  # PCA or NMF of the last map, while it runs
+        # New map points only update the image data; this timer redraws at a fixed rate
+        self.map_timer = QtCore.QTimer(self)
+        self.map_timer.setInterval(200)  # 5 fps, whatever the dwell time
+        self.map_timer.timeout.connect(self.map_image.refresh)
+
+        # Kinetics: frames stream to a chunked store on disk
+        self.kinetics_worker = None
+        self.kinetics_writer = None
+        self.kinetics_path = None  # Store of the last run, read back when the band changes
+        # Kinetics runs and maps also push their spectra into a ring buffer, from which the refresh
+        # timer feeds the waterfall one row per spectrum, and the band trace
+        self.waterfall_ring = None
+        self.waterfall_seq = 0  # Sequence number of the next ring frame to display
+        self.waterfall_t0 = None  # Timestamp of the first frame: the trace starts at 0 s
+        self.band = None  # (low, high) band of the trace, in nm
+        self.band_trace = TraceBuffer()
+        self.band_drawn_at = 0.0  # time.monotonic() of the last band trace draw
+        self.band_selector = None
+        self.waterfall_timer = QtCore.QTimer(self)
+        self.waterfall_timer.setInterval(20)  # Up to 50 spectra/s get a refresh each
+        self.waterfall_timer.timeout.connect(self.refresh_waterfall)
+
+        # KINETICS BUTTON: one frame every interval, each the average of the scans, until stopped
+        self.kinetics_pushButton = QtWidgets.QPushButton("Kinetics", widgets.frame_4)
+        self.kinetics_pushButton.setObjectName("kinetics_pushButton")
+        self.kinetics_pushButton.setFont(widgets.pushButton_EmSpectrum.font())
+        self.kinetics_pushButton.setStyleSheet(widgets.pushButton_EmSpectrum.styleSheet())
+        self.kinetics_pushButton.setCheckable(True)
+        self.kinetics_pushButton.setToolTip("Take a frame of the averaged scans every interval and stream the\n"
+                                            "timestamped frames to disk until stopped.")
+        widgets.gridLayout_3.addWidget(self.kinetics_pushButton, 6, 0, 1, 3)
 
         ########################################################################
         # PUSHBUTTONS CLICK
@@ -86,6 +456,21 @@ class QePro_LIVE_PLOT_APP(QtWidgets.QMainWindow):
         widgets.pushButton_saveData.clicked.connect(self.on_saveSpectrum_pushButton_clicked)
         # RESET PLOTS
         widgets.pushButton_reset.clicked.connect(self.on_acqSpectrum_pushButton_clicked)
+        # LIVE VIEW
+        self.live_pushButton.toggled.connect(self.on_live_pushButton_toggled)
+        # KINETICS
+        self.kinetics_pushButton.toggled.connect(self.on_kinetics_pushButton_toggled)
+        # ACQUIRE LUMINESCENCE 2D MAP
+        widgets.pushButton_8.clicked.connect(self.on_map_pushButton_clicked)
+        # LASER / UV LAMP
+        widgets.checkBox.toggled.connect(self.on_light_checkBox_toggled)
+        self.map_quantity_comboBox.currentIndexChanged.connect(self.render_window_map)
+        # DECOMPOSE THE MAP
+        self.pca_pushButton.clicked.connect(self.on_decompose_pushButton_clicked)
+        self.nmf_pushButton.clicked.connect(self.on_decompose_pushButton_clicked)
+        # SWITCH BETWEEN THE MAP AND ITS WATERFALL
+        self.show_waterfall_pushButton.clicked.connect(lambda: widgets.stackedWidget.setCurrentWidget(self.waterfall_page))
+        self.show_map_pushButton.clicked.connect(lambda: widgets.stackedWidget.setCurrentWidget(self.map_page))
 
         # ADD ITEMS TO COMBOBOX
         widgets.comboBox.addItems(["Emission-bkg", "Emission", "Absorption"])
@@ -103,6 +488,9 @@ class QePro_LIVE_PLOT_APP(QtWidgets.QMainWindow):
         if devices:
             try:
                 spec = Spectrometer.from_first_available()
+                # A (re)connected device may have been recalibrated: read its wavelengths afresh
+                self.calibrations.invalidate(spec.serial_number)
+                self.calibrations.get(spec)
                 return spec
             except Exception as e:
                 QtWidgets.QMessageBox.critical(self, "Error", f"Failed to open spectrometer: {e}")
@@ -111,36 +499,107 @@ class QePro_LIVE_PLOT_APP(QtWidgets.QMainWindow):
             QtWidgets.QMessageBox.information(self, "Demo Mode", "No spectrometer found: Entering demo mode.")
             return None  # No spectrometer available, demo mode will be used
 
+    def wavelength_axis(self, n_pixels):
+        """Cached, read-only wavelength axis of the current device (or of demo mode)."""
+        if self.spectrometer:
+            return self.calibrations.get(self.spectrometer).wavelengths
+        return self.calibrations.demo(n_pixels).wavelengths
+
+    def dark_key(self, integration_time_us, n_average):
+        """Dark library key of the current device (or demo mode) at these settings."""
+        serial_number = self.spectrometer.serial_number if self.spectrometer else "DEMO"
+        return self.darks.key(serial_number, integration_time_us, n_average, detector_temperature(self.spectrometer))
+
+    def find_dark(self, key, any_average=False):
+        """Dark for the settings of `key` (see DarkLibrary.find), or None."""
+        serial_number, integration_time_us, n_average, temperature_c = key
+        return self.darks.find(serial_number, integration_time_us, None if any_average else n_average, temperature_c)
+
     ########################################################################
     # CAPTURE SPECTRA
     ########################################################################
 
-    def capture_averaged_spectrum(self, integration_time_us, interval_s, max_samples=None):
+    def start_acquisition(self, on_result):
+        """Start an averaged acquisition on the thread pool; False if nothing started."""
+        if self.acq_worker is not None:
+            return False  # An acquisition is already running
+
         integration_time_us = int(widgets.integrationTime_doubleSpinBox.value() * 1e3)
         interval_s = float(widgets.interval__doubleSpinBox.value())
-        max_samples = int(widgets.averageScans_doubleSpinBox.value())        
-        if self.spectrometer:
-            self.spectrometer.integration_time_micros(integration_time_us)
-            if max_samples >= 2:
-                if interval_s <= integration_time_us / 1_000_000:
-                    QtWidgets.QMessageBox.critical(self, "Error", "Interval should be higher than Integration Time.")
-                    return None
-          
-                intensities_list = []
-                t0 = time.monotonic()
-                for _ in islice(count(), max_samples):
-                    intensities_list.append(self.spectrometer.intensities())
-                    #dt = interval_s - ((time.monotonic() - t0) % interval_s)
-                    dt = max(0, interval_s - ((time.monotonic() - t0) % interval_s))
-                    time.sleep(dt)
-                avg_intensities = np.mean(intensities_list, axis=0)
-            else:
-                avg_intensities = self.spectrometer.intensities()
-        else:
-            # Demo mode: Generate a synthetic spectrum
-            wavelengths = np.linspace(400, 800, 3648)  # Simulate a typical spectrometer wavelength range
-            avg_intensities = np.sin(0.01 * wavelengths) + np.random.normal(0, 0.1, wavelengths.shape)      
-        return avg_intensities  
+        max_samples = int(widgets.averageScans_doubleSpinBox.value())
+        burst = self.burst_checkBox.isChecked()
+        if self.spectrometer and max_samples >= 2 and not burst and interval_s <= integration_time_us / 1_000_000:
+            QtWidgets.QMessageBox.critical(self, "Error", "Interval should be higher than Integration Time.")
+            return False
+
+        # Settings are captured now, they may be changed while the acquisition runs
+        self.acq_metadata = {
+            'Device': f"{self.spectrometer.model} {self.spectrometer.serial_number}" if self.spectrometer else "Demo",
+            'Integration time (ms)': integration_time_us / 1e3,
+            'Interval (s)': interval_s,
+            'Scans averaged': max_samples,
+            'Burst': burst,
+        }
+        self.acq_dark_key = self.dark_key(integration_time_us, max_samples)
+        if self.acq_dark_key[3] is not None:
+            self.acq_metadata['Detector temperature (C)'] = self.acq_dark_key[3]
+        worker = Worker(acquire_averaged_spectrum, self.spectrometer, integration_time_us, interval_s, max_samples, burst)
+        worker.signals.progress.connect(self.update_progress)
+        worker.signals.result.connect(self.show_acquisition_timing)
+        worker.signals.result.connect(on_result)
+        worker.signals.error.connect(self.on_acquisition_error)
+        worker.signals.finished.connect(self.on_acquisition_finished)
+        self.acq_worker = worker
+        self.set_acquisition_buttons_enabled(False)
+        self.live_pushButton.setEnabled(False)
+        self.threadpool.start(worker)
+        return True
+
+    def cancel_acquisition(self):
+        """Ask the running acquisition, if any, to stop after the current scan."""
+        if self.acq_worker is not None:
+            self.acq_worker.cancel()
+
+    def show_acquisition_timing(self, average):
+        """Keep the scheduler report of the last average and show it on the progress bar."""
+        if average is None:
+            return
+        self.last_timing = average.timing
+        widgets.progressBar.setToolTip(format_timing_report(self.last_timing))
+
+    def make_record(self, kind, average, wavelengths, derived=None, dark=None):
+        """Snapshot a finished acquisition, with the DarkFrame it was corrected with, as the new record of its kind."""
+        self.record_version += 1
+        metadata = dict(self.acq_metadata)
+        metadata['Acquired'] = time.strftime("%Y-%m-%d %H:%M:%S")
+        if dark is not None:
+            metadata['Dark'] = dark.description()
+        if average.timing:
+            metadata['Timing'] = format_timing_report(average.timing)
+        record = AcquisitionRecord(self.record_version, kind, wavelengths, average.mean, average.stderr,
+                                   dark.mean if dark is not None else None, self.reference_spectrum, derived, metadata,
+                                   average.timestamps)
+        self.records[kind] = record
+        return record
+
+    def on_acquisition_error(self, message):
+        QtWidgets.QMessageBox.critical(self, "Error", f"Acquisition failed: {message}")
+
+    def on_acquisition_finished(self):
+        self.acq_worker = None
+        self.set_acquisition_buttons_enabled(True)
+        self.live_pushButton.setEnabled(True)
+        # Reset progress bar after a short delay to show completion
+        QtCore.QTimer.singleShot(500, lambda: widgets.progressBar.setValue(0))
+
+    def set_acquisition_buttons_enabled(self, enabled):
+        """Enable or disable every button that starts an acquisition, and the light checkbox."""
+        for button in (widgets.pushButton_EmSpectrum, widgets.pushButton_emBKG, widgets.pushButton_absBKG,
+                       widgets.pushButton_Reference, widgets.pushButton_AbsSpectrum, widgets.pushButton_8,
+                       self.kinetics_pushButton):
+            button.setEnabled(enabled)
+        # seabreeze is not thread-safe: while a worker reads the device, the GUI must not switch its light
+        widgets.checkBox.setEnabled(enabled)
 
     def on_acqSpectrum_pushButton_clicked(self):
         # Disable the push button focus after clicking to avoid moving focus to the next widget
@@ -149,224 +608,741 @@ class QePro_LIVE_PLOT_APP(QtWidgets.QMainWindow):
         # Reset progress bar to 0% at the beginning
         widgets.progressBar.setValue(0)
 
-        ascii_prefix = "spectra"
-        integration_time_us = int(widgets.integrationTime_doubleSpinBox.value() * 1e3)
-        interval_s = float(widgets.interval__doubleSpinBox.value())
-        max_samples = int(widgets.averageScans_doubleSpinBox.value())
         btn = self.sender()
         btnName = btn.objectName()
 
         #if btnName in ("pushButton_emBKG", "pushButton_absBKG"):
         if btnName == "pushButton_emBKG" or btnName == "pushButton_absBKG":
-            self.update_progress(25)  # Update progress to 25%
             # Capture and store the background spectrum
-            self.background_spectrum = self.capture_averaged_spectrum(integration_time_us, interval_s, max_samples)
-            self.update_progress(100)  # Set to 100% when done
-            
-            # Plot the background spectrum
-            if self.background_spectrum is not None:
-                if self.spectrometer:
-                    wavelengths = self.spectrometer.wavelengths()
-                else:
-                    wavelengths = np.linspace(400, 800, len(self.background_spectrum))                    
-                self.update_bkg_plot(wavelengths, self.background_spectrum)            
-            # Set the current widget to show the background spectrum page
-            widgets.stackedWidget.setCurrentWidget(widgets.bkg_spectrum_page)
-            QtWidgets.QMessageBox.information(self, "Dark Background Captured", "Dark background spectrum has been captured successfully.")
-        
+            self.start_acquisition(self.on_background_acquired)
+
         if btnName == "pushButton_EmSpectrum":
-            self.update_progress(25)  # Update progress to 25%
-            # Set the current widget to show the spectrum page            
-            self.store_averaged_spectra(ascii_prefix, integration_time_us, interval_s, max_samples)
-            self.update_progress(100)  # Set to 100% when done
-            widgets.stackedWidget.setCurrentWidget(widgets.spectrum_page)
+            self.start_acquisition(self.store_averaged_spectra)
 
         if btnName == "pushButton_Reference":
-            self.update_progress(25)  # Update progress to 25%
             # Capture and store the reference spectrum
-            self.reference_spectrum = self.capture_averaged_spectrum(integration_time_us, interval_s, max_samples)
-            self.update_progress(100)  # Set to 100% when done
-
-            # Plot the reference spectrum
-            if self.reference_spectrum is not None:
-                if self.spectrometer:
-                    wavelengths = self.spectrometer.wavelengths()
-                else:
-                    wavelengths = np.linspace(400, 800, len(self.reference_spectrum))  # Simulated wavelengths
-
-                self.update_reference_plot(wavelengths, self.reference_spectrum)
-            widgets.stackedWidget.setCurrentWidget(widgets.abs_spectrum_page)
-            # Notify the user that the reference spectrum is captured
-            QtWidgets.QMessageBox.information(self, "Reference Captured", "Reference spectrum has been captured successfully.")
+            self.start_acquisition(self.on_reference_acquired)
 
         if btnName == "pushButton_AbsSpectrum":
-                self.update_progress(25)  # Update progress to 25%
-                if self.background_spectrum is None or self.reference_spectrum is None:
-                    QtWidgets.QMessageBox.warning(self, "Warning", "No dark background or Reference spectrum captured.")
+                integration_time_us = int(widgets.integrationTime_doubleSpinBox.value() * 1e3)
+                n_average = int(widgets.averageScans_doubleSpinBox.value())
+                if self.find_dark(self.dark_key(integration_time_us, n_average)) is None or self.reference_spectrum is None:
+                    QtWidgets.QMessageBox.warning(self, "Warning", "No dark background for these settings or Reference spectrum captured.")
                     return
-
-                # Disable the pushbutton while capturing
-                widgets.pushButton_AbsSpectrum.setEnabled(False)
                 # Capture the sample spectrum
-                sample_spectrum = self.capture_averaged_spectrum(integration_time_us, interval_s, max_samples)
-                self.update_progress(100)  # Set to 100% when done
-
-                # Ensure the wavelengths are available (either from the spectrometer or simulated)
-                if self.spectrometer:
-                    wavelengths = self.spectrometer.wavelengths()
-                else:
-                    wavelengths = np.linspace(400, 800, len(sample_spectrum))  # Simulated wavelengths for demo
-
-                # Prevent log issues by replacing zeros or negatives in the sample spectrum
-                epsilon = 1e-12  # Small constant to avoid division by zero and log(0)
-                sample_spectrum = np.clip(sample_spectrum, epsilon, None)
-                background_spectrum = np.clip(self.background_spectrum, epsilon, None)
-                reference_spectrum = np.clip(self.reference_spectrum, epsilon, None)
-                # Calculate the absorption spectrum
-                absorption_spectrum = -np.log10(sample_spectrum / background_spectrum)
-                #absorption_spectrum = -np.log10((np.array(sample_spectrum) - np.array(background_spectrum)) /
-                #       (np.array(reference_spectrum) - np.array(background_spectrum)))
-                # 
-                #absorption_spectrum = -np.log10((sample_spectrum - background_spectrum) /
-                #                                (reference_spectrum - background_spectrum))                              
-               
-
-                # Plot the absorption spectrum
-                self.update_absorption_plot(wavelengths, absorption_spectrum)
-                widgets.stackedWidget.setCurrentWidget(widgets.abs_spectrum_page)
-
-                # Enable the pushbutton after capturing
-                widgets.pushButton_AbsSpectrum.setEnabled(True)
-        
+                self.start_acquisition(self.on_sample_acquired)
+
         if btnName == "pushButton_reset":
             """Resets and clears all plots and spectra, removes ticks and labels, and refreshes the entire GUI."""
+            # Stop any acquisition in progress; its result is discarded
+            self.cancel_acquisition()
+            self.live_pushButton.setChecked(False)
+            self.kinetics_pushButton.setChecked(False)
             self.update_progress(25)  # Update progress to 25%
 
-            # Clear the plots
-            self.canvas.axes.clear()
-            self.bkg_canvas.axes.clear()
-            self.abs_canvas.axes.clear()             
-            # Reset variables
-            self.background_spectrum = None
+            # Reset variables; the dark library is kept, its darks stay valid for their settings
             self.reference_spectrum = None
             self.emission_spectrum = None
             self.absorption_spectrum = None
-            # Remove tick marks and axis labels from all canvases
-            for ax in [self.canvas.axes, self.bkg_canvas.axes, self.abs_canvas.axes]:
-                ax.set_xticks([])  # Remove x-axis ticks
-                ax.set_yticks([])  # Remove y-axis ticks
-                ax.set_xlabel('')  # Remove x-axis label
-                ax.set_ylabel('')  # Remove y-axis label
-            # Redraw the canvases to reflect the cleared plots and removed ticks/labels
-            self.canvas.draw()
-            self.bkg_canvas.draw()
-            self.abs_canvas.draw()
+            self.records = {}
+            self.close_map()
+            self.close_waterfall()
+            # Clear the plots, removing tick marks and axis labels from all canvases
+            for plot in (self.spectrum_plot, self.bkg_plot, self.abs_plot, self.map_image, self.map_spectrum_plot,
+                         self.pca_page, self.nmf_page, self.waterfall, self.band_plot):
+                plot.reset()
 
             # Refresh the entire GUI
             self.update_gui()
             self.update_progress(100)  # Set to 100% when done
+            # Reset progress bar after a short delay to show completion
+            QtCore.QTimer.singleShot(500, lambda: widgets.progressBar.setValue(0))
 
-         # Reset progress bar after a short delay to show completion
-        QtCore.QTimer.singleShot(500, lambda: widgets.progressBar.setValue(0))
         # Set focus back to the window or to a specific widget
         self.setFocus()
 
+    ########################################################################
+    # LUMINESCENCE 2D MAP
+    ########################################################################
+
+    def on_map_pushButton_clicked(self):
+        widgets.progressBar.setValue(0)
+        self.start_map()
+        self.setFocus()
+
+    def map_grid(self):
+        """Grid of the map from the X/Y start and end spin boxes, at the Z start height."""
+        return MapGrid(widgets.doubleSpinBox_4.value(), widgets.doubleSpinBox_7.value(),
+                       widgets.doubleSpinBox_5.value(), widgets.doubleSpinBox_8.value(),
+                       self.step_doubleSpinBox.value(), widgets.doubleSpinBox_6.value())
+
+    def start_map(self):
+        """Start a raster-scan map on the thread pool. Returns False if nothing was started."""
+        if self.acq_worker is not None or self.live_worker is not None or self.kinetics_worker is not None:
+            return False  # The spectrometer is busy
+        try:
+            grid = self.map_grid()
+        except ValueError as e:
+            QtWidgets.QMessageBox.critical(self, "Error", str(e))
+            return False
+
+        integration_time_us = int(widgets.integrationTime_doubleSpinBox.value() * 1e3)
+        n_average = int(widgets.averageScans_doubleSpinBox.value())
+        if self.spectrometer is None:
+            # Demo mode: a simulated luminescent sample that follows the stage, with a slowly drifting dark
+            stage = self.demo_stage
+            spectrometer = SimulatedEmitter(stage, pixels=1044, dark_counts=1000, dark_drift_counts_per_s=0.5,
+                                            electric_dark_pixels=8)
+        elif self.stage is None:
+            QtWidgets.QMessageBox.critical(self, "Error", "No motion stage is configured: "
+                                           "a map needs a stage driver to move the sample.")
+            return False
+        else:
+            spectrometer, stage = self.spectrometer, self.stage
+        try:
+            darks = self.map_dark_scheduler(spectrometer)
+        except ValueError as e:
+            QtWidgets.QMessageBox.critical(self, "Error", str(e))
+            return False
+        self.acq_metadata = {
+            'Device': f"{spectrometer.model} {spectrometer.serial_number}",
+            'Integration time (ms)': integration_time_us / 1e3,
+            'Scans averaged': n_average,
+            'Grid': f"{grid.shape[1]} x {grid.shape[0]} points, step {grid.step} um, Z {grid.z} um",
+            'Trajectory': self.trajectory_comboBox.currentText(),
+            'Darks': self.dark_comboBox.currentText() + (f" ({self.dark_doubleSpinBox.value():g})" if darks else ""),
+            'Acquired': time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+        # Spectra go straight to disk as they are taken: maps may not fit in memory
+        options = QFileDialog.Options()
+        save_path, _ = QFileDialog.getSaveFileName(self, "Save Map Cube", "", f"Map Cube (*{CUBE_EXTENSION})",
+                                                   options=options)
+        if not save_path:
+            return False
+        if not save_path.lower().endswith(CUBE_EXTENSION):
+            save_path += CUBE_EXTENSION
+        self.close_map()
+        self.close_waterfall()
+        wavelengths = self.calibrations.get(spectrometer).wavelengths
+        try:
+            store = CubeStore.create(save_path, grid.x, grid.y, wavelengths, metadata=self.acq_metadata)
+        except (OSError, ValueError) as e:
+            QtWidgets.QMessageBox.critical(self, "Error", f"Failed to create map file: {e}")
+            return False
+
+        # The spectra of the scan also stream into the waterfall page, line by line
+        ring = self.start_waterfall(store.wavelengths, capacity=max(4 * grid.x.size, 256))
+        worker = Worker(acquire_map, spectrometer, stage, grid, integration_time_us, n_average, store,
+                        self.trajectory_comboBox.currentData(), darks, self.light_signals.switched.emit, ring,
+                        wavelengths)
+        worker.signals.progress.connect(self.update_progress)
+        worker.signals.data.connect(self.on_map_point)
+        worker.signals.result.connect(self.on_map_acquired)
+        worker.signals.error.connect(self.on_acquisition_error)
+        worker.signals.finished.connect(self.on_map_finished)
+        worker.signals.finished.connect(self.on_acquisition_finished)
+        self.acq_worker = worker
+        self.set_acquisition_buttons_enabled(False)
+        self.live_pushButton.setEnabled(False)
+        self.map_image.start(grid.x, grid.y)
+        widgets.stackedWidget.setCurrentWidget(self.map_page)
+        self.threadpool.start(worker)
+        self.map_timer.start()
+        return True
+
+    def map_dark_scheduler(self, spectrometer):
+        """DarkScheduler for the dark settings of the map panel, None without darks."""
+        trigger = self.dark_comboBox.currentData()
+        value = self.dark_doubleSpinBox.value()
+        if trigger is None:
+            return None
+        if trigger == 'frames':
+            return DarkScheduler(every_frames=max(int(value), 1))
+        if trigger == 'time':
+            return DarkScheduler(every_s=60 * value)
+        return DarkScheduler(drift_counts=value, dark_pixels=electric_dark_pixels(spectrometer))
+
+    def on_light_switched(self, on):
+        """Show the light state set by a running map without switching the light again."""
+        widgets.checkBox.blockSignals(True)
+        widgets.checkBox.setChecked(on)
+        widgets.checkBox.blockSignals(False)
+
+    def on_light_checkBox_toggled(self, checked):
+        if self.spectrometer and not set_light_source(self.spectrometer, checked):
+            QtWidgets.QMessageBox.warning(self, "Warning", "The spectrometer has no shutter or lamp output to switch.")
+
+    def on_map_point(self, point):
+        row, column, value = point
+        self.map_image.set_point(row, column, value)
+
+    def on_map_finished(self):
+        self.map_timer.stop()
+        self.map_image.refresh()  # Show the last points
+        self.stop_waterfall()
+
+    def on_map_acquired(self, result):
+        if self.acq_worker is not None and self.acq_worker.cancel_event.is_set():
+            result.close()
+            return  # Cancelled by a reset: the partial map is discarded
+        result.close()  # Writes the metadata and timing; the cube stays readable
+        self.map_result = result
+        timing = result.timing
+        message = (f"{timing['points']} of {result.done.size} points acquired in {timing['elapsed_s']:.1f} s "
+                   f"({timing['point_rate_hz']:.1f} points/s), saved to {result.path}")
+        if 'saved_s' in timing and timing['trajectory'] != 'raster':
+            message += (f"\n\nA raster scan would have taken about {timing['estimated_raster_s']:.1f} s: "
+                        f"{timing['saved_s']:.1f} s saved.")
+        if 'darks' in timing:
+            how = "interpolated to its time" if timing.get('dark_interpolated', True) else "nearest in time"
+            message += (f"\n\n{timing['darks']} darks interleaved ({timing['dark_s']:.1f} s); every spectrum was "
+                        f"corrected with the dark {how}.")
+        # Prepare the window images off the GUI thread, next to the cube
+        worker = Worker(WindowMaps, result, result.path)
+        worker.signals.result.connect(lambda window_maps: self.on_window_maps_ready(result, window_maps))
+        worker.signals.error.connect(self.on_acquisition_error)
+        self.threadpool.start(worker)
+        QtWidgets.QMessageBox.information(self, "Map Acquired", message)
+
+    def on_window_maps_ready(self, result, window_maps):
+        if result is not self.map_result:
+            return  # The map was reset or replaced meanwhile
+        self.window_maps = window_maps
+        self.map_spectrum_plot.show('map', window_maps.wavelengths, window_maps.mean_spectrum, 'Map Mean Spectrum',
+                                    'cyan', 'Intensity (count)')
+        if self.window_selector is None:
+            # Created after the first show(): styling the axes clears them
+            self.window_selector = SpanSelector(self.map_spectrum_canvas.axes, self.on_map_window_selected,
+                                                'horizontal', useblit=True, interactive=True,
+                                                onmove_callback=self.on_map_window_moved,
+                                                props=dict(facecolor='yellow', alpha=0.3))
+        self.render_window_map()
+
+    def on_map_window_selected(self, low_nm, high_nm):
+        if high_nm > low_nm:
+            self.map_window = (low_nm, high_nm)
+            self.render_window_map()
+
+    def on_map_window_moved(self, low_nm, high_nm):
+        # Only the integral is cheap enough to follow the drag; peak and FWHM are computed on release
+        if high_nm <= low_nm:
+            return
+        self.map_window = (low_nm, high_nm)
+        if self.map_quantity_comboBox.currentData() == 'integral':
+            self.render_window_map()
+        else:
+            self.map_window_label.setText(f"Window {low_nm:.1f} - {high_nm:.1f} nm (release to update)")
+
+    def render_window_map(self):
+        """Show the selected quantity of the current wavelength window on the map image."""
+        if self.window_maps is None or self.map_window is None:
+            return
+        low_nm, high_nm = self.map_window
+        quantity = self.map_quantity_comboBox.currentData()
+        labels = {'integral': 'Integrated intensity (count nm)', 'peak': 'Peak position (nm)', 'fwhm': 'FWHM (nm)'}
+        self.map_image.show(self.window_maps.image(quantity, low_nm, high_nm), labels[quantity])
+        self.map_window_label.setText(f"Window {low_nm:.1f} - {high_nm:.1f} nm")
+
+    def on_decompose_pushButton_clicked(self):
+        method = 'pca' if self.sender() is self.pca_pushButton else 'nmf'
+        self.start_decomposition(method)
+        self.setFocus()
+
+    def start_decomposition(self, method):
+        """Decompose the last map with `method` ('pca' or 'nmf') on the thread pool."""
+        if self.analysis_worker is not None:
+            return False  # One decomposition at a time
+        result = self.map_result
+        if result is None:
+            QtWidgets.QMessageBox.warning(self, "Warning", "No finished map to analyse.")
+            return False
+        worker = Worker(pca if method == 'pca' else nmf, result, self.components_spinBox.value())
+        worker.signals.progress.connect(self.update_progress)
+        worker.signals.result.connect(lambda decomposition: self.on_decomposition_ready(result, decomposition))
+        worker.signals.error.connect(self.on_acquisition_error)
+        worker.signals.finished.connect(self.on_decomposition_finished)
+        self.analysis_worker = worker
+        self.pca_pushButton.setEnabled(False)
+        self.nmf_pushButton.setEnabled(False)
+        self.threadpool.start(worker)
+        return True
+
+    def on_decomposition_ready(self, result, decomposition):
+        if decomposition is None or result is not self.map_result:
+            return  # Cancelled, or the map was reset or replaced meanwhile
+        page = self.pca_page if decomposition.method == 'pca' else self.nmf_page
+        page.show_result(decomposition, result.x, result.y)
+        widgets.stackedWidget.setCurrentWidget(page)
+
+    def on_decomposition_finished(self):
+        self.analysis_worker = None
+        self.pca_pushButton.setEnabled(True)
+        self.nmf_pushButton.setEnabled(True)
+        QtCore.QTimer.singleShot(500, lambda: widgets.progressBar.setValue(0))
+
+    def close_map(self):
+        """Let go of the last map, closing its cube file if it is still open."""
+        if self.analysis_worker is not None:
+            self.analysis_worker.cancel()
+        if self.map_result is not None:
+            self.map_result.close()
+            self.map_result = None
+        self.window_maps = None
+        if self.window_selector is not None:
+            self.window_selector.disconnect_events()
+            for artist in self.window_selector.artists:
+                artist.remove()
+            self.window_selector = None
+
+    ########################################################################
+    # LIVE VIEW
+    ########################################################################
+
+    def on_live_pushButton_toggled(self, checked):
+        if checked:
+            self.start_live_view()
+        else:
+            self.stop_live_view()
+
+    def start_live_view(self):
+        """Stream spectra continuously and plot the newest one at display rate."""
+        if self.acq_worker is not None or self.live_worker is not None or self.kinetics_worker is not None:
+            return
+        integration_time_us = int(widgets.integrationTime_doubleSpinBox.value() * 1e3)
+        self.live_dark = self.find_dark(self.dark_key(integration_time_us, 1), any_average=True)
+        self.live_wavelengths = self.wavelength_axis(3648)
+        self.live_ring = SpectrumRingBuffer(64, len(self.live_wavelengths))
+        # Drop anything a previous session left behind
+        while not self.q.empty():
+            self.q.get_nowait()
+
+        worker = Worker(stream_spectra, self.spectrometer, integration_time_us, self.live_ring, self.q)
+        worker.signals.error.connect(self.on_acquisition_error)
+        worker.signals.finished.connect(self.on_live_finished)
+        self.live_worker = worker
+        self.live_line = None
+        self.set_acquisition_buttons_enabled(False)
+        self.threadpool.start(worker)
+        self.live_timer.start()
+        widgets.stackedWidget.setCurrentWidget(widgets.spectrum_page)
+
+    def stop_live_view(self):
+        if self.live_worker is not None:
+            self.live_worker.cancel()
+        self.live_timer.stop()
+
+    def on_live_finished(self):
+        self.live_worker = None
+        self.live_timer.stop()
+        self.set_acquisition_buttons_enabled(True)
+        # Keep the button state in sync if streaming stopped on its own (e.g. on error)
+        self.live_pushButton.blockSignals(True)
+        self.live_pushButton.setChecked(False)
+        self.live_pushButton.blockSignals(False)
+
+    def refresh_live_view(self):
+        """Plot the newest streamed frame; older queued frames are skipped."""
+        seq = None
+        while True:
+            try:
+                seq = self.q.get_nowait()
+            except queue.Empty:
+                break
+        if seq is None:
+            return  # Nothing new since the last refresh
+        spectrum = self.live_ring.frame(seq)
+        if spectrum is None:
+            return
+        if self.live_dark is not None and len(self.live_dark.mean) == len(spectrum):
+            spectrum = spectrum - self.live_dark.mean
+        self.update_live_plot(self.live_wavelengths, spectrum)
+
+    def update_live_plot(self, wavelengths, intensities):
+        """Replace the data of the live trace, setting up the plot on the first frame only."""
+        if self.live_line is None or self.live_line not in self.canvas.axes.lines:
+            self.update_plot(wavelengths, intensities)
+            self.live_line = self.spectrum_plot.lines['emission']
+            return
+        # Single frames are not averaged: keep cosmic-ray spikes from squashing the y-range
+        self.spectrum_plot.show('emission', wavelengths, intensities, 'Emission Spectrum', 'cyan', 'Intensity (count)',
+                                clip_percentile=99.9)
+
+    ########################################################################
+    # KINETICS
+    ########################################################################
+
+    def on_kinetics_pushButton_toggled(self, checked):
+        if checked:
+            if not self.start_kinetics():
+                self.kinetics_pushButton.blockSignals(True)
+                self.kinetics_pushButton.setChecked(False)
+                self.kinetics_pushButton.blockSignals(False)
+        else:
+            self.stop_kinetics()
+        self.setFocus()
+
+    def start_kinetics(self):
+        """Stream timestamped frames to a kinetics store until stopped. Returns False if nothing was started."""
+        if self.acq_worker is not None or self.live_worker is not None or self.kinetics_worker is not None:
+            return False  # The spectrometer is busy
+        integration_time_us = int(widgets.integrationTime_doubleSpinBox.value() * 1e3)
+        interval_s = float(widgets.interval__doubleSpinBox.value())
+        n_average = int(widgets.averageScans_doubleSpinBox.value())
+        # Demo mode: a luminescent sample fading under the beam
+        spectrometer = self.spectrometer or SimulatedSpectrometer(pixels=1044, dark_counts=1000, fade_s=60)
+        if spectrometer is self.spectrometer and interval_s < n_average * integration_time_us / 1e6:
+            QtWidgets.QMessageBox.warning(self, "Warning", "The interval is shorter than a frame: "
+                                          "frames will be taken back to back.")
+
+        options = QFileDialog.Options()
+        save_path, _ = QFileDialog.getSaveFileName(self, "Save Kinetics", "", f"Kinetics (*{KINETICS_EXTENSION})",
+                                                   options=options)
+        if not save_path:
+            return False
+        if not save_path.lower().endswith(KINETICS_EXTENSION):
+            save_path += KINETICS_EXTENSION
+        wavelengths = self.calibrations.get(spectrometer).wavelengths
+        metadata = {
+            'Device': f"{spectrometer.model} {spectrometer.serial_number}",
+            'Integration time (ms)': integration_time_us / 1e3,
+            'Interval (s)': interval_s,
+            'Scans averaged': n_average,
+            'Started': time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        temperature_c = detector_temperature(self.spectrometer)
+        if temperature_c is not None:
+            metadata['Detector temperature (C)'] = temperature_c
+        self.close_waterfall()
+        try:
+            self.kinetics_writer = KineticsWriter(save_path, wavelengths, metadata=metadata)
+        except OSError as e:
+            QtWidgets.QMessageBox.critical(self, "Error", f"Failed to create kinetics store: {e}")
+            return False
+        self.kinetics_path = save_path
+
+        worker = Worker(acquire_kinetics, spectrometer, integration_time_us, interval_s, n_average,
+                        self.kinetics_writer, self.start_waterfall(wavelengths), wavelengths)
+        worker.signals.result.connect(self.on_kinetics_acquired)
+        worker.signals.error.connect(self.on_acquisition_error)
+        worker.signals.finished.connect(self.on_kinetics_finished)
+        self.kinetics_worker = worker
+        self.set_acquisition_buttons_enabled(False)
+        self.kinetics_pushButton.setEnabled(True)  # Stops the run
+        self.live_pushButton.setEnabled(False)
+        widgets.stackedWidget.setCurrentWidget(self.waterfall_page)
+        self.threadpool.start(worker)
+        return True
+
+    def stop_kinetics(self):
+        if self.kinetics_worker is not None:
+            self.kinetics_worker.cancel()
+
+    def on_kinetics_acquired(self, timing):
+        self.refresh_waterfall()  # Show the last frames
+        writer = self.kinetics_writer
+        if writer is None:
+            return
+        writer.close()  # Saves the timing with the metadata
+        self.kinetics_writer = None
+        QtWidgets.QMessageBox.information(
+            self, "Kinetics Acquired",
+            f"{writer.n_frames} frames in {writer.n_chunks} chunks saved to {writer.path}\n\n"
+            f"{format_timing_report(timing)}")
+
+    def on_kinetics_finished(self):
+        self.kinetics_worker = None
+        self.stop_waterfall()
+        if self.kinetics_writer is not None:
+            self.kinetics_writer.close()  # The run failed: keep what was written
+            self.kinetics_writer = None
+        self.set_acquisition_buttons_enabled(True)
+        self.live_pushButton.setEnabled(True)
+        self.kinetics_pushButton.blockSignals(True)
+        self.kinetics_pushButton.setChecked(False)
+        self.kinetics_pushButton.blockSignals(False)
+
+    ########################################################################
+    # WATERFALL
+    ########################################################################
+
+    def start_waterfall(self, wavelengths, capacity=256):
+        """Set up the waterfall page for a new stream of spectra and return the ring buffer to push them into."""
+        self.waterfall_wavelengths = wavelengths
+        # Only what the display can lag behind is buffered: everything else is on disk
+        self.waterfall_ring = SpectrumRingBuffer(capacity, len(wavelengths))
+        self.waterfall_seq = 0
+        self.waterfall_t0 = None
+        self.band_trace.clear()
+        if self.band is None:
+            # Default band: the middle tenth of the spectrum, until one is dragged on the waterfall
+            span = wavelengths[-1] - wavelengths[0]
+            self.band = (wavelengths[0] + 0.45 * span, wavelengths[0] + 0.55 * span)
+        self.waterfall.start(wavelengths)
+        if self.band_selector is None:
+            # Created after start(): setting up the image clears the axes
+            self.band_selector = SpanSelector(self.waterfall_canvas.axes, self.on_band_selected,
+                                              'horizontal', useblit=True, interactive=True,
+                                              props=dict(facecolor='cyan', alpha=0.3))
+        self.show_band()
+        self.waterfall_info_label.setText("")
+        self.waterfall_timer.start()
+        return self.waterfall_ring
+
+    def stop_waterfall(self):
+        """Show the last spectra of the stream and stop refreshing."""
+        self.refresh_waterfall()
+        self.waterfall_timer.stop()
+        self.show_band_trace()
+
+    def refresh_waterfall(self):
+        """Add the spectra taken since the last refresh to the waterfall, one row each, and to the band trace."""
+        if self.waterfall_ring is None:
+            return
+        first, times, frames = self.waterfall_ring.since(self.waterfall_seq)
+        if not len(frames):
+            return
+        # Spectra the display fell behind on are skipped here; they are all on disk
+        self.waterfall_seq = first + len(frames)
+        if self.waterfall_t0 is None:
+            self.waterfall_t0 = times[0]
+        times = times - self.waterfall_t0
+        self.waterfall.add(frames)
+        self.waterfall.refresh()
+        self.band_trace.append(times, self.band_intensity(frames))
+        # The trace is a full redraw of its canvas, so it follows the rows at a few Hz only
+        if time.monotonic() - self.band_drawn_at >= self.band_refresh_s:
+            self.show_band_trace()
+        self.waterfall_info_label.setText(f"{self.waterfall_seq} spectra, {times[-1]:.1f} s")
+
+    def band_intensity(self, frames):
+        """Integrated intensity (count nm) of the current band in each of `frames`."""
+        low_nm, high_nm = self.band
+        inside = (self.waterfall_wavelengths >= low_nm) & (self.waterfall_wavelengths <= high_nm)
+        return trapezoid(frames[:, inside], self.waterfall_wavelengths[inside], axis=1)
+
+    def show_band_trace(self):
+        self.band_drawn_at = time.monotonic()
+        if len(self.band_trace):
+            self.band_plot.show('band', self.band_trace.times, self.band_trace.values, 'Band Intensity',
+                                'cyan', 'Intensity (count nm)')
+
+    def show_band(self):
+        low_nm, high_nm = self.band
+        self.band_label.setText(f"Band {low_nm:.1f} - {high_nm:.1f} nm")
+
+    def on_band_selected(self, low_nm, high_nm):
+        if high_nm <= low_nm:
+            return
+        self.band = (low_nm, high_nm)
+        self.show_band()
+        if self.kinetics_path is None or self.waterfall_timer.isActive():
+            # While the stream goes on, or for a map, the trace restarts from the spectra still in the ring buffer
+            if self.waterfall_ring is None:
+                return
+            first, times, frames = self.waterfall_ring.since(0)
+            shown = max(self.waterfall_seq - first, 0)  # The newer frames come with the next refresh
+            self.band_trace.clear()
+            if shown and self.waterfall_t0 is not None:
+                self.band_trace.append(times[:shown] - self.waterfall_t0, self.band_intensity(frames[:shown]))
+            self.show_band_trace()
+        else:
+            # After a kinetics run the whole recording is read back, off the GUI thread
+            path, band = self.kinetics_path, self.band
+            worker = Worker(self.read_band_history, path, low_nm, high_nm)
+            worker.signals.result.connect(lambda history: self.on_band_history_ready(path, band, history))
+            worker.signals.error.connect(self.on_acquisition_error)
+            self.threadpool.start(worker)
+
+    def read_band_history(self, path, low_nm, high_nm):
+        recording = KineticsRecording(path)
+        return recording.times, recording.band(low_nm, high_nm)
+
+    def on_band_history_ready(self, path, band, history):
+        if path != self.kinetics_path or band != self.band or self.waterfall_timer.isActive():
+            return  # Another band was picked, or another run started, meanwhile
+        times, values = history
+        if self.waterfall_t0 is None and len(times):
+            self.waterfall_t0 = times[0]
+        self.band_trace.set(times - self.waterfall_t0, values)
+        self.show_band_trace()
+
+    def close_waterfall(self):
+        """Let go of the last stream, kinetics run and band selector."""
+        self.waterfall_ring = None
+        self.kinetics_path = None
+        self.band_trace.clear()
+        if self.band_selector is not None:
+            self.band_selector.disconnect_events()
+            for artist in self.band_selector.artists:
+                artist.remove()
+            self.band_selector = None
+
+    def on_background_acquired(self, average):
+        if average is None:
+            return  # Acquisition was cancelled
+        wavelengths = self.wavelength_axis(len(average.mean))
+        dark = self.darks.put(self.acq_dark_key, average.mean, average.stderr)
+        try:
+            self.writer.submit(self.dark_saved_message, self.darks.save, dark, wavelengths, timeout=0)
+        except queue.Full:
+            QtWidgets.QMessageBox.warning(self, "Warning", "Dark background kept for this session only: "
+                                          "too many files are still being written.")
+        # Plot the background spectrum
+        self.update_bkg_plot(wavelengths, average.mean, average.stderr)
+        # Set the current widget to show the background spectrum page
+        widgets.stackedWidget.setCurrentWidget(widgets.bkg_spectrum_page)
+        _, integration_time_us, n_average, _ = self.acq_dark_key
+        QtWidgets.QMessageBox.information(self, "Dark Background Captured",
+                                          f"Dark background spectrum for {integration_time_us / 1e3:g} ms x {n_average} "
+                                          "scans has been captured successfully.")
+
+    def on_reference_acquired(self, average):
+        if average is None:
+            return  # Acquisition was cancelled
+        self.reference_spectrum = average.mean
+        # Plot the reference spectrum
+        wavelengths = self.wavelength_axis(len(self.reference_spectrum))
+        self.update_reference_plot(wavelengths, self.reference_spectrum)
+        widgets.stackedWidget.setCurrentWidget(widgets.abs_spectrum_page)
+        # Notify the user that the reference spectrum is captured
+        QtWidgets.QMessageBox.information(self, "Reference Captured", "Reference spectrum has been captured successfully.")
+
+    def on_sample_acquired(self, average):
+        dark = self.find_dark(self.acq_dark_key)
+        if average is None or dark is None or self.reference_spectrum is None:
+            return  # Acquisition was cancelled or the plots were reset meanwhile
+        sample_spectrum = average.mean
+
+        wavelengths = self.wavelength_axis(len(sample_spectrum))
+
+        # Prevent log issues by replacing zeros or negatives in the sample spectrum
+        epsilon = 1e-12  # Small constant to avoid division by zero and log(0)
+        sample_spectrum = np.clip(sample_spectrum, epsilon, None)
+        background_spectrum = np.clip(dark.mean, epsilon, None)
+        reference_spectrum = np.clip(self.reference_spectrum, epsilon, None)
+        # Calculate the absorption spectrum
+        absorption_spectrum = -np.log10(sample_spectrum / background_spectrum)
+        #absorption_spectrum = -np.log10((np.array(sample_spectrum) - np.array(background_spectrum)) /
+        #       (np.array(reference_spectrum) - np.array(background_spectrum)))
+        # 
+        #absorption_spectrum = -np.log10((sample_spectrum - background_spectrum) /
+        #                                (reference_spectrum - background_spectrum))                              
+
+        self.make_record("absorption", average, wavelengths, {'absorbance': absorption_spectrum}, dark)
+
+        # Plot the absorption spectrum
+        self.update_absorption_plot(wavelengths, absorption_spectrum)
+        widgets.stackedWidget.setCurrentWidget(widgets.abs_spectrum_page)
+
     def update_progress(self, value):
         """Updates the progress bar with the given value."""
         widgets.progressBar.setValue(value)
-        QtWidgets.QApplication.processEvents()  # Ensure UI updates immediately
 
     def on_saveSpectrum_pushButton_clicked(self):
         options = QFileDialog.Options()
         options |= QFileDialog.DontUseNativeDialog
-        save_file, _ = QFileDialog.getSaveFileName(self, "Save Spectra", "", "Text Files (*.txt);;All Files (*)", options=options)
+        save_file, selected_filter = QFileDialog.getSaveFileName(
+            self, "Save Spectra", "", f"Text Files (*.txt);;Binary Spectra (*{CONTAINER_EXTENSION});;All Files (*)",
+            options=options)
+        if save_file and selected_filter.startswith("Binary") and not save_file.lower().endswith(CONTAINER_EXTENSION):
+            save_file += CONTAINER_EXTENSION
         
         if save_file:
             self.save_spectrum_to_file(save_file)
 
-    def store_averaged_spectra(self, ascii_prefix, integration_time_us, interval_s, max_samples=None):
-        widgets.pushButton_EmSpectrum.setEnabled(False)
-
-        self.avg_intensities = self.capture_averaged_spectrum(integration_time_us, interval_s, max_samples)
-
-        if self.background_spectrum is not None:
-            self.avg_intensities = self.avg_intensities - self.background_spectrum
-
-        if self.spectrometer:
-            self.wavelengths = self.spectrometer.wavelengths()
-        else:
-            self.wavelengths = np.linspace(400, 800, len(self.avg_intensities))  # Use simulated wavelengths in demo mode
-
-        self.update_plot(self.wavelengths, self.avg_intensities)
-        widgets.pushButton_EmSpectrum.setEnabled(True)
+    def store_averaged_spectra(self, average):
+        if average is None:
+            return  # Acquisition was cancelled
+        self.avg_intensities = average.mean
+        self.avg_stderr = average.stderr
+
+        # Only a dark taken (or interpolated) at the settings of this acquisition is subtracted
+        dark = self.find_dark(self.acq_dark_key)
+        if dark is not None and len(dark.mean) != len(self.avg_intensities):
+            dark = None
+        if dark is not None:
+            self.avg_intensities = self.avg_intensities - dark.mean
+            if dark.stderr is not None:
+                # Noise of the dark adds in quadrature to the noise of the sample
+                self.avg_stderr = np.hypot(self.avg_stderr, dark.stderr)
+        elif any(key[0] == self.acq_dark_key[0] for key in self.darks.keys()):
+            _, integration_time_us, n_average, _ = self.acq_dark_key
+            QtWidgets.QMessageBox.warning(self, "Warning", f"No dark background for {integration_time_us / 1e3:g} ms x "
+                                          f"{n_average} scans: the spectrum is shown without dark subtraction.")
+
+        self.wavelengths = self.wavelength_axis(len(self.avg_intensities))
+        derived = {'emission-bkg': self.avg_intensities} if dark is not None else None
+        self.make_record("emission", average, self.wavelengths, derived, dark)
+
+        self.update_plot(self.wavelengths, self.avg_intensities, self.avg_stderr)
+        widgets.stackedWidget.setCurrentWidget(widgets.spectrum_page)
 
     ########################################################################
     # SAVE DATA
     ########################################################################
 
     def save_spectrum_to_file(self, save_file):
-        if not hasattr(self, 'avg_intensities'):
+        """Write the selected acquisition: .qspc as a container, else text plus a .qspc sidecar."""
+        currentData = widgets.comboBox.currentText()
+        record = self.records.get("absorption" if currentData == "Absorption" else "emission")
+        if record is None:
             QtWidgets.QMessageBox.warning(self, "Warning", "No spectrum data to save.")
             return
 
-        currentData = widgets.comboBox.currentText()    
+        # Save raw spectrum (no background subtraction)
+        if currentData == "Emission":
+            title, column, values = "# Raw Spectrum (without dark background subtraction)", "Intensity", record.raw
+            message = f"Raw spectrum saved to {save_file}"
+
+        # Save background-subtracted spectrum if background exists
+        elif currentData == "Emission-bkg":
+            if 'emission-bkg' not in record.derived:
+                QtWidgets.QMessageBox.warning(self, "Warning", "No dark background spectrum to subtract.")
+                return
+            title, column, values = "# Spectrum with background subtraction", "Intensity", record.derived['emission-bkg']
+            message = f"Spectrum with background subtraction saved to {save_file}"
+
+        elif currentData == "Absorption":
+            title, column, values = "# Absorption Spectrum", "Absorbance", record.derived['absorbance']
+            message = f"Absorption spectrum saved to {save_file}"
+
+        # Container frames: the selected spectrum first, then every other array of the record
+        extra = [(name, array) for name, array in record.arrays() if array is not values]
+        frames = np.vstack([values] + [array for _, array in extra])
+        metadata = dict(record.metadata, Title=title.lstrip("# "), Column=column,
+                        Columns=[column] + [name for name, _ in extra], Version=record.version)
+        if record.timestamps is not None:
+            metadata['Scan times (s)'] = record.timestamps.tolist()
+
+        # The record's arrays are read-only snapshots, safe to hand to the writer thread
         try:
-            with open(save_file, mode='w') as f:
-                # Capture the raw spectrum regardless of whether background subtraction is needed
-                raw_intensities = self.capture_averaged_spectrum(
-                    int(widgets.integrationTime_doubleSpinBox.value() * 1e3),  # Integration time in µs
-                    float(widgets.interval__doubleSpinBox.value()),  # Interval in seconds
-                    int(widgets.averageScans_doubleSpinBox.value())  # Number of scans
-                )
-
-                if self.spectrometer:
-                    wavelengths = self.spectrometer.wavelengths()
-                else:
-                    wavelengths = np.linspace(400, 800, len(raw_intensities))  # Use simulated wavelengths
-
-                # Save raw spectrum (no background subtraction)
-                if currentData == "Emission":
-                    f.write("# Raw Spectrum (without dark background subtraction)\n")
-                    f.write("# Wavelength\tIntensity\n")
-                    for wavelength, intensity in zip(wavelengths, raw_intensities):
-                        f.write(f"{wavelength:0.2f}\t{intensity}\n")
-                    QtWidgets.QMessageBox.information(self, "Saved Spectral Data", f"Raw spectrum saved to {save_file}")
-
-                # Save background-subtracted spectrum if background exists
-                elif currentData == "Emission-bkg":
-                    if self.background_spectrum is None:
-                        QtWidgets.QMessageBox.warning(self, "Warning", "No dark background spectrum to subtract.")
-                        return
-
-                    # Subtract the background
-                    subtracted_intensities = raw_intensities - self.background_spectrum
-
-                    f.write("# Spectrum with background subtraction\n")
-                    f.write("# Wavelength\tIntensity\n")
-                    for wavelength, intensity in zip(wavelengths, subtracted_intensities):
-                        f.write(f"{wavelength:0.2f}\t{intensity}\n")
-                    QtWidgets.QMessageBox.information(self, "Saved Spectral Data", f"Spectrum with background subtraction saved to {save_file}")
-
-                elif currentData == "Absorption":
-                    if self.background_spectrum is None or self.reference_spectrum is None:
-                        QtWidgets.QMessageBox.warning(self, "Warning", "No dark background or Reference spectrum captured.")
-                        return
-
-                    sample_spectrum = raw_intensities
-                    #Replace xero or negative value with small 1e-12 positive value to avoid the logarithm error
-                    absorption_spectrum = -np.log10(np.maximum(sample_spectrum / self.background_spectrum, 1e-12))
-
-                    #absorption_spectrum = -np.log10((sample_spectrum - self.background_spectrum) /
-                    #                                (self.reference_spectrum - self.background_spectrum))
-                    #
-                    f.write("# Absorption Spectrum\n")
-                    f.write("# Wavelength\tAbsorbance\n")
-                    for wavelength, absorbance in zip(wavelengths, absorption_spectrum):
-                        f.write(f"{wavelength:0.2f}\t{absorbance}\n")
-                    QtWidgets.QMessageBox.information(self, "Saved Spectral Data", f"Absorption spectrum saved to {save_file}")
-
-        except Exception as e:
-            QtWidgets.QMessageBox.critical(self, "Error", f"Failed to save spectrum: {e}")
+            if save_file.lower().endswith(CONTAINER_EXTENSION):
+                self.writer.submit(message, write_container, save_file, record.wavelengths, frames, np.float64,
+                                   metadata, timeout=0)
+            else:
+                # The text file keeps exactly the two columns downstream scripts read
+                sidecar = save_file + CONTAINER_EXTENSION
+
+                def write_text_and_sidecar():
+                    write_spectrum_text(save_file, [title], ["Wavelength", column], [record.wavelengths, values])
+                    write_container(sidecar, record.wavelengths, frames, np.float64, metadata)
+
+                self.writer.submit(f"{message}\nAll arrays and metadata: {sidecar}", write_text_and_sidecar,
+                                   timeout=0)
+        except queue.Full:
+            QtWidgets.QMessageBox.warning(self, "Warning", "Too many files are still being written, try again shortly.")
+
+    def on_file_saved(self, message):
+        if message == self.dark_saved_message:
+            return  # Capturing the dark was already confirmed
+        QtWidgets.QMessageBox.information(self, "Saved Spectral Data", message)
+
+    def on_file_save_failed(self, description, error):
+        if description == self.dark_saved_message:
+            QtWidgets.QMessageBox.warning(self, "Warning", f"Dark background kept for this session only: {error}")
+            return
+        QtWidgets.QMessageBox.critical(self, "Error", f"Failed to save spectrum: {error}")
 
     def update_gui(self):
         """Refreshes the entire GUI to default state."""
@@ -385,217 +1361,97 @@ class QePro_LIVE_PLOT_APP(QtWidgets.QMainWindow):
     # PLOT CAPTURED SPECTRA
     ########################################################################
 
-    def update_plot(self, wavelengths, avg_intensities):
+    def update_plot(self, wavelengths, avg_intensities, errors=None):
         """Update the plot for the emission spectrum and add crosshair cursor with annotations.
         """
-        # Clear the canvas and set background color
-        self.canvas.axes.clear()
-        self.canvas.axes.set_facecolor('black')
-        # Plot the emission spectrum
-        self.canvas.axes.plot(wavelengths, avg_intensities, label='Emission Spectrum', color='cyan')
-        # Enable gridlines
-        self.canvas.axes.yaxis.grid(True, linestyle='--', color='gray')
-        self.canvas.axes.xaxis.grid(True, linestyle='--', color='gray')
-        # Define label and tick font sizes
-        label_fontsize = 14
-        tick_fontsize = 14
-        # Set y-limits with a buffer or default limits for single-point data
-        if len(avg_intensities) > 1:
-            intensity_range = max(avg_intensities) - min(avg_intensities)
-            buffer = intensity_range * 0.05  # 5% buffer
-            self.canvas.axes.set_ylim(ymin=min(avg_intensities) - buffer, ymax=max(avg_intensities) + buffer)
-        else:
-            self.canvas.axes.set_ylim(ymin=0, ymax=1)  # Adjusted to handle single point data better
-        # Set axis labels and customize appearance
-        self.canvas.axes.set_xlabel('Wavelength (nm)', fontsize=label_fontsize, color="white", labelpad=5.0)
-        self.canvas.axes.set_ylabel('Intensity (count)', fontsize=label_fontsize, color="white", labelpad=1.5)
-        self.canvas.axes.tick_params(axis='both', labelsize=tick_fontsize, colors='white')
-        # Add a legend
-        self.canvas.axes.legend(fontsize=label_fontsize, loc='upper right', framealpha=0.5)
-
-        # Clear existing cursor and annotations if they exist
-        if hasattr(self, 'crosshair'):
-            self.crosshair.remove()
-        if hasattr(self, 'coord_text'):
-            self.coord_text.remove()
-        # Define a new cursor for crosshair functionality
-        self.crosshair = self.canvas.axes.annotate("+", xy=(0, 0), xytext=(0, 0),
-                                                   textcoords="offset points", color='yellow', fontsize=20,
-                                                   ha='center', va='center', visible=False)
-        self.coord_text = self.canvas.axes.annotate("", xy=(0, 0), xytext=(0, 15), textcoords="offset points",
-                                                    color='yellow', fontsize=14, ha='left', va='bottom',
-                                                    bbox=dict(boxstyle="round,pad=0.3", edgecolor='yellow', 
-                                                              facecolor='black', alpha=0.6), visible=False)
-        # Create a QLabel to display mouse coordinates
-        self.coord_label = QLabel(self)
-        self.coord_label.setStyleSheet("color: white; background-color: black; padding: 2px;")
-        self.coord_label.move(10, 10)  # Position the label in the top-left corner of the window
-        self.coord_label.resize(150, 20)
-        # Define an event handler to update the crosshair and coordinate display on mouse hover
-        def on_hover(event):
-            if event.inaxes == self.canvas.axes:  # Ensure hover is within plot bounds
-                x, y = event.xdata, event.ydata  # Using directly from event
-                # Update crosshair position and make it visible
-                self.crosshair.xy = (x, y)
-                self.crosshair.set_visible(True)
-                # Update coordinate text with x and y values and make it visible
-                self.coord_text.xy = (x, y)
-                self.coord_text.set_text(f"{x:.2f}, {y:.2f}")
-                self.coord_text.set_visible(True)
-                # Update QLabel with x and y coordinates
-                self.coord_label.setText(f"Wavelength: {x:.2f} nm, Intensity: {y:.2f}")
-                # Redraw the canvas with updated crosshair and coordinates only once
-                self.canvas.draw_idle()  # Use draw_idle for better performance
-            else:
-                # Hide the crosshair and coordinate text if the cursor is outside the plot area
-                self.crosshair.set_visible(False)
-                self.coord_text.set_visible(False)
-                self.coord_label.setText("Hover over the plot")  # Default message
-        # Disconnect the previous hover event handler if it exists
-        if hasattr(self, 'hover_connection'):
-            self.canvas.mpl_disconnect(self.hover_connection)    
-        # Connect the hover event to the handler and store the connection id
-        self.hover_connection = self.canvas.mpl_connect('motion_notify_event', on_hover)
-
-        # Draw the updated plot
-        self.canvas.draw()
-
-
-    def update_bkg_plot(self, wavelengths, bkg_intensities):
-        """Update the plot for the dark background spectrum."""
-        self.bkg_canvas.axes.clear()
-        self.bkg_canvas.axes.set_facecolor('black')       
-        self.bkg_canvas.axes.plot(wavelengths, bkg_intensities, label='Background Spectrum', color='yellow')
-        self.bkg_canvas.axes.yaxis.grid(True, linestyle='--', color='gray')
-        self.bkg_canvas.axes.xaxis.grid(True, linestyle='--', color='gray')    
-        label_fontsize = 14
-        tick_fontsize = 14
-        # Check for empty or single-point data
-        if len(bkg_intensities) > 1:
-            intensity_range = max(bkg_intensities) - min(bkg_intensities)
-            buffer = intensity_range * 0.05  # Add 5% buffer
-            self.bkg_canvas.axes.set_ylim(ymin=min(bkg_intensities) - buffer, ymax=max(bkg_intensities) + buffer)
+        self.spectrum_plot.show('emission', wavelengths, avg_intensities, 'Emission Spectrum', 'cyan',
+                                'Intensity (count)', errors)
+
+    def show_coordinates(self, quantity, x, y):
+        """Show the data coordinates under the mouse in the readout label."""
+        if x is None:
+            self.coord_label.setText("Hover over the plot")  # Default message
         else:
-            self.bkg_canvas.axes.set_ylim(ymin=0, ymax=1)  # Default limits for single-point data
-        # Set axis labels and tick parameters
-        self.bkg_canvas.axes.set_xlabel('Wavelength (nm)', fontsize=label_fontsize, color="white", labelpad=5.0)
-        self.bkg_canvas.axes.set_ylabel('Intensity (count)', fontsize=label_fontsize, color="white", labelpad=1.5)
-        self.bkg_canvas.axes.tick_params(axis='both', labelsize=tick_fontsize, colors='white')
-        # Add a legend
-        self.bkg_canvas.axes.legend(fontsize=label_fontsize, loc='upper right', framealpha=0.5)
-        # Draw the updated plot
-        self.bkg_canvas.draw()
+            self.coord_label.setText(f"Wavelength: {x:.2f} nm, {quantity}: {y:.2f}")
+
+    def update_bkg_plot(self, wavelengths, bkg_intensities, errors=None):
+        """Update the plot for the dark background spectrum, with an optional error band."""
+        self.bkg_plot.show('background', wavelengths, bkg_intensities, 'Background Spectrum', 'yellow',
+                           'Intensity (count)', errors)
 
     def update_reference_plot(self, wavelengths, reference_spectrum):
         """Update the plot for the reference spectrum."""
-        self.abs_canvas.axes.clear()
-        self.abs_canvas.axes.set_facecolor('black')    
-        # Plot the reference spectrum
-        self.abs_canvas.axes.plot(wavelengths, reference_spectrum, label='Reference Spectrum', color='blue')
-        self.abs_canvas.axes.yaxis.grid(True, linestyle='--', color='gray')
-        self.abs_canvas.axes.xaxis.grid(True, linestyle='--', color='gray')
-        label_fontsize = 14
-        tick_fontsize = 14
-        # Check for empty or single-point data
-        if len(reference_spectrum) > 1:
-            intensity_range = max(reference_spectrum) - min(reference_spectrum)
-            buffer = intensity_range * 0.05  # Add 5% buffer
-            self.abs_canvas.axes.set_ylim(ymin=min(reference_spectrum) - buffer, ymax=max(reference_spectrum) + buffer)
-        else:
-            self.abs_canvas.axes.set_ylim(ymin=0, ymax=1)  # Default limits for single-point data
-        # Set axis labels and tick parameters
-        self.abs_canvas.axes.set_xlabel('Wavelength (nm)', fontsize=label_fontsize, color='white', labelpad=5.0)
-        self.abs_canvas.axes.set_ylabel('Intensity (count)', fontsize=label_fontsize, color='white', labelpad=1.5)
-        self.abs_canvas.axes.tick_params(axis='both', labelsize=tick_fontsize, colors='white')
-        # Add a legend
-        self.abs_canvas.axes.legend(fontsize=label_fontsize, loc='upper right', framealpha=0.5)
-        # Draw the updated plot
-        self.abs_canvas.draw()
- 
+        self.abs_plot.show('reference', wavelengths, reference_spectrum, 'Reference Spectrum', 'blue',
+                           'Intensity (count)')
+
     def update_absorption_plot(self, wavelengths, absorption_spectrum):
         """Update the plot for the absorption spectrum and add crosshair cursor with annotations.    
         """
-        # Clear the absorption canvas axes
-        self.abs_canvas.axes.clear()
-        self.abs_canvas.axes.set_facecolor('black')
-        # Plot the absorption spectrum
-        self.abs_canvas.axes.plot(wavelengths, absorption_spectrum, label='Absorption Spectrum', color='green')
-        self.abs_canvas.axes.yaxis.grid(True, linestyle='--', color='gray')
-        self.abs_canvas.axes.xaxis.grid(True, linestyle='--', color='gray')
-        # Set font sizes for labels and ticks
-        label_fontsize = 14
-        tick_fontsize = 14
-        # Check for empty or single-point data and set y-limits
-        if len(absorption_spectrum) > 1:
-            intensity_range = max(absorption_spectrum) - min(absorption_spectrum)
-            buffer = intensity_range * 0.05  # Add 5% buffer
-            self.abs_canvas.axes.set_ylim(ymin=min(absorption_spectrum) - buffer, ymax=max(absorption_spectrum) + buffer)
-        else:
-            self.abs_canvas.axes.set_ylim(ymin=0, ymax=1)  # Default limits for single-point data
-        # Set axis labels and tick parameters
-        self.abs_canvas.axes.set_xlabel('Wavelength (nm)', fontsize=label_fontsize, color='white', labelpad=5.0)
-        self.abs_canvas.axes.set_ylabel('Absorbance', fontsize=label_fontsize, color='white', labelpad=1.5)
-        self.abs_canvas.axes.tick_params(axis='both', labelsize=tick_fontsize, colors='white')
-        # Add a legend
-        self.abs_canvas.axes.legend(fontsize=label_fontsize, loc='upper right', framealpha=0.5)
-
-        # Clear existing cursor and annotations if they exist
-        if hasattr(self, 'abs_crosshair'):
-            self.abs_crosshair.remove()
-        if hasattr(self, 'abs_coord_text'):
-            self.abs_coord_text.remove()
-        # Define a new crosshair for absorption plot functionality
-        self.abs_crosshair = self.abs_canvas.axes.annotate("+", xy=(0, 0), xytext=(0, 0),
-                                                           textcoords="offset points", color='yellow', fontsize=20,
-                                                           ha='center', va='center', visible=False)
-
-        self.abs_coord_text = self.abs_canvas.axes.annotate("", xy=(0, 0), xytext=(0, 15), textcoords="offset points",
-                                                            color='yellow', fontsize=14, ha='left', va='bottom',
-                                                            bbox=dict(boxstyle="round,pad=0.3", edgecolor='yellow',
-                                                                      facecolor='black', alpha=0.6), visible=False)
-        # Create a QLabel to display mouse coordinates
-        self.coord_label = QLabel(self)
-        self.coord_label.setStyleSheet("color: white; background-color: black; padding: 2px;")
-        self.coord_label.move(10, 10)  # Position the label in the top-left corner of the window
-        self.coord_label.resize(150, 20)
-        # Define an event handler to update the crosshair and coordinate display on mouse hover
-        def on_hover(event):
-            if event.inaxes == self.abs_canvas.axes:  # Ensure hover is within plot bounds
-                x, y = event.xdata, event.ydata  # Using directly from event
-                # Update crosshair position and make it visible
-                self.abs_crosshair.xy = (x, y)
-                self.abs_crosshair.set_visible(True)
-                # Update coordinate text with x and y values and make it visible
-                self.abs_coord_text.xy = (x, y)
-                self.abs_coord_text.set_text(f"{x:.2f}, {y:.2f}")
-                self.abs_coord_text.set_visible(True)
-                # Update QLabel with x and y coordinates
-                self.coord_label.setText(f"Wavelength: {x:.2f} nm, Absorption: {y:.2f}")
-                # Redraw the canvas with updated crosshair and coordinates only once
-                self.abs_canvas.draw_idle()  # Use draw_idle for better performance
-            else:
-                # Hide the crosshair and coordinate text if the cursor is outside the plot area
-                self.abs_crosshair.set_visible(False)
-                self.abs_coord_text.set_visible(False)
-                self.coord_label.setText("Hover over the plot")  # Default message
-        # Disconnect the previous hover event handler if it exists
-        if hasattr(self, 'abs_hover_connection'):
-            self.abs_canvas.mpl_disconnect(self.abs_hover_connection)
-        # Connect the hover event to the handler and store the connection id
-        self.abs_hover_connection = self.abs_canvas.mpl_connect('motion_notify_event', on_hover)
-        # Draw the updated plot
-        self.abs_canvas.draw()
+        self.abs_plot.show('absorption', wavelengths, absorption_spectrum, 'Absorption Spectrum', 'green',
+                           'Absorbance')
     
+    def closeEvent(self, event):
+        # Let a running acquisition stop cleanly before the window goes away
+        self.cancel_acquisition()
+        self.stop_live_view()
+        self.stop_kinetics()
+        self.waterfall_timer.stop()
+        if self.analysis_worker is not None:
+            self.analysis_worker.cancel()
+        self.threadpool.waitForDone()
+        self.close_map()
+        if self.kinetics_writer is not None:
+            self.kinetics_writer.close()
+        super().closeEvent(event)
+
+class WriterSignals(QtCore.QObject):
+    """Completion signals of the AsyncFileWriter, delivered on the GUI thread."""
+    saved = QtCore.pyqtSignal(str)
+    failed = QtCore.pyqtSignal(str, str)
+
+class LightSignals(QtCore.QObject):
+    """State of the light source switched from a worker thread, delivered on the GUI thread."""
+    switched = QtCore.pyqtSignal(bool)
+
+class WorkerSignals(QtCore.QObject):
+    """Signals emitted by a Worker, delivered on the GUI thread."""
+    finished = QtCore.pyqtSignal()
+    error = QtCore.pyqtSignal(str)
+    result = QtCore.pyqtSignal(object)
+    progress = QtCore.pyqtSignal(int)
+    data = QtCore.pyqtSignal(object)  # Partial results streamed while the function runs
+
 class Worker(QtCore.QRunnable):
     def __init__(self, function, *args, **kwargs):
         super(Worker, self).__init__()
         self.function = function
         self.args = args
         self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.cancel_event = threading.Event()
+        # Hand the function the progress and cancel hooks it asks for
+        params = inspect.signature(function).parameters
+        if 'progress_callback' in params:
+            self.kwargs['progress_callback'] = self.signals.progress.emit
+        if 'data_callback' in params:
+            self.kwargs['data_callback'] = self.signals.data.emit
+        if 'cancel_event' in params:
+            self.kwargs['cancel_event'] = self.cancel_event
+
+    def cancel(self):
+        """Request the running function to stop as soon as it can."""
+        self.cancel_event.set()
 
     @pyqtSlot()
     def run(self):
-        self.function(*self.args, **self.kwargs)
+        try:
+            result = self.function(*self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.error.emit(str(e))
+        else:
+            self.signals.result.emit(result)
+        finally:
+            self.signals.finished.emit()
 
 
 #if __name__ == "__main__":
@@ -608,4 +1464,7 @@ def run_app():
     app = QtWidgets.QApplication(sys.argv)
     mainWindow = QePro_LIVE_PLOT_APP()
     mainWindow.show()
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    # Make sure every queued file reaches the disk before the process exits
+    mainWindow.writer.close()
+    sys.exit(exit_code)
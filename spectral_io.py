@@ -0,0 +1,440 @@
+import json
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+# np.trapz became np.trapezoid in NumPy 2.0, and 1.x is still supported
+trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
+########################################################################
+# TEXT EXPORT
+########################################################################
+
+def format_columns(columns, formats=None):
+    """Format equal-length columns as tab-separated text rows in one pass."""
+    columns = [np.asarray(column, dtype=np.float64).ravel() for column in columns]
+    if formats is None:
+        formats = ["%0.2f"] + ["%s"] * (len(columns) - 1)
+    n_rows = len(columns[0])
+    if n_rows == 0:
+        return ""
+    row = "\t".join(formats) + "\n"
+    # One %-format over the whole interleaved block instead of one write per row
+    values = np.column_stack(columns).ravel().tolist()
+    return (row * n_rows) % tuple(values)
+
+
+def write_spectrum_text(save_file, title_lines, column_names, columns, formats=None):
+    """Write a commented header and the data columns with a single buffered write."""
+    header = "".join(line + "\n" for line in title_lines)
+    header += "# " + "\t".join(column_names) + "\n"
+    text = header + format_columns(columns, formats)
+    with open(save_file, mode='w') as f:
+        f.write(text)
+
+########################################################################
+# BINARY CONTAINER
+########################################################################
+
+# Layout of a .qspc file (little endian):
+#   fixed 64-byte header, metadata as UTF-8 JSON, the wavelength axis as
+#   float64[n_pixels], zero padding up to `data_offset` (a multiple of 64),
+#   then n_frames contiguous frames of float32 or float64[n_pixels].
+CONTAINER_MAGIC = b"QEPROSPC"
+CONTAINER_VERSION = 1
+CONTAINER_EXTENSION = ".qspc"
+_HEADER = struct.Struct("<8sHHIQQQ")  # magic, version, itemsize, n_pixels, n_frames, meta_len, data_offset
+_HEADER_SIZE = 64
+_DTYPES = {4: np.dtype("<f4"), 8: np.dtype("<f8")}
+
+
+class ContainerWriter:
+    """Stream frames into a .qspc container, readable with read_container() after every flush()."""
+    def __init__(self, path, wavelengths, dtype=np.float64, metadata=None):
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        if self.dtype.itemsize not in _DTYPES or self.dtype.kind != "f":
+            raise ValueError(f"Unsupported frame dtype {dtype}: use float32 or float64")
+        self.wavelengths = np.asarray(wavelengths, dtype="<f8")
+        self.n_pixels = self.wavelengths.size
+        self.n_frames = 0
+        meta = json.dumps(metadata or {}).encode("utf-8")
+        axis_end = _HEADER_SIZE + len(meta) + self.wavelengths.nbytes
+        self.data_offset = -(-axis_end // 64) * 64
+        self._meta_len = len(meta)
+        self._file = open(path, "wb")
+        self._write_header()
+        self._file.write(meta)
+        self._file.write(self.wavelengths.tobytes())
+        self._file.write(b"\0" * (self.data_offset - axis_end))
+
+    def _write_header(self):
+        header = _HEADER.pack(CONTAINER_MAGIC, CONTAINER_VERSION, self.dtype.itemsize, self.n_pixels,
+                              self.n_frames, self._meta_len, self.data_offset)
+        self._file.write(header.ljust(_HEADER_SIZE, b"\0"))
+
+    def append(self, frames):
+        """Append one spectrum or a 2-D block of spectra."""
+        frames = np.asarray(frames, dtype=self.dtype).reshape(-1, self.n_pixels)
+        self._file.write(np.ascontiguousarray(frames).tobytes())
+        self.n_frames += frames.shape[0]
+
+    def flush(self):
+        """Push buffered frames to disk and update the frame count in the header."""
+        position = self._file.tell()
+        self._file.seek(0)
+        self._write_header()
+        self._file.seek(position)
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_container(path, wavelengths, frames, dtype=np.float64, metadata=None):
+    """Write a whole set of frames to a new .qspc container."""
+    with ContainerWriter(path, wavelengths, dtype, metadata) as writer:
+        writer.append(frames)
+
+
+class SpectralContainer:
+    """An opened .qspc container; `frames` is a read-only memory map."""
+    def __init__(self, wavelengths, frames, metadata):
+        self.wavelengths = wavelengths
+        self.frames = frames
+        self.metadata = metadata
+
+    @property
+    def n_frames(self):
+        return self.frames.shape[0]
+
+
+def read_container(path):
+    """Open a .qspc container, memory-mapping its frames for zero-copy access."""
+    with open(path, "rb") as f:
+        raw = f.read(_HEADER_SIZE)
+        if len(raw) < _HEADER_SIZE:
+            raise ValueError(f"{path} is not a spectral container (file too short)")
+        magic, version, itemsize, n_pixels, n_frames, meta_len, data_offset = _HEADER.unpack_from(raw)
+        if magic != CONTAINER_MAGIC:
+            raise ValueError(f"{path} is not a spectral container")
+        if version > CONTAINER_VERSION or itemsize not in _DTYPES:
+            raise ValueError(f"Unsupported spectral container (version {version}, itemsize {itemsize})")
+        metadata = json.loads(f.read(meta_len).decode("utf-8") or "{}")
+        wavelengths = np.fromfile(f, dtype="<f8", count=n_pixels)
+    if n_frames == 0:
+        frames = np.empty((0, n_pixels), dtype=_DTYPES[itemsize])
+    else:
+        frames = np.memmap(path, dtype=_DTYPES[itemsize], mode="r", offset=data_offset, shape=(n_frames, n_pixels))
+    return SpectralContainer(wavelengths, frames, metadata)
+
+########################################################################
+# MAP CUBE STORE
+########################################################################
+
+# A .qmap store is a directory holding the map as plain .npy files:
+#   cube.npy         float32 or float64[rows, columns, n_pixels], memory-mapped
+#   done.npy         bool[rows, columns], True where the spectrum was written
+#   x.npy, y.npy     stage positions of the columns and rows (um)
+#   wavelengths.npy  float64[n_pixels]
+#   meta.json        acquisition settings and timing
+CUBE_EXTENSION = ".qmap"
+
+
+class CubeStore:
+    """Hyperspectral map cube kept on disk, written point by point and read through a memory map."""
+    def __init__(self, path, cube, done, x, y, wavelengths, metadata, writable=False):
+        self.path = path
+        self.cube = cube
+        self.done = done
+        self.x = x
+        self.y = y
+        self.wavelengths = wavelengths
+        self.metadata = metadata
+        self.timing = metadata.get('Timing')
+        self._file = open(os.path.join(path, "cube.npy"), "r+b") if writable else None
+        self._spectrum_bytes = cube.shape[2] * cube.dtype.itemsize
+
+    @classmethod
+    def create(cls, path, x, y, wavelengths, dtype=np.float32, metadata=None):
+        """Create an empty store for a len(y) x len(x) map, overwriting any previous one at `path`."""
+        dtype = np.dtype(dtype)
+        if dtype not in _DTYPES.values():
+            raise ValueError(f"Unsupported cube dtype {dtype}: use float32 or float64")
+        os.makedirs(path, exist_ok=True)
+        axes = [np.asarray(axis, dtype=np.float64) for axis in (x, y, wavelengths)]
+        for name, axis in zip(("x", "y", "wavelengths"), axes):
+            np.save(os.path.join(path, f"{name}.npy"), axis)
+        x, y, wavelengths = axes
+        # open_memmap only writes the header and sizes the file, the cube itself is never touched
+        for name, item_dtype, shape in (("cube", dtype, (y.size, x.size, wavelengths.size)),
+                                        ("done", bool, (y.size, x.size))):
+            array = np.lib.format.open_memmap(os.path.join(path, f"{name}.npy"), mode="w+", dtype=item_dtype,
+                                              shape=shape)
+            del array
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(dict(metadata or {}), f, indent=1, default=str)
+        return cls.open(path, writable=True)
+
+    @classmethod
+    def open(cls, path, writable=False):
+        """Open an existing store; nothing but the axes and metadata is read up front."""
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            metadata = json.load(f)
+        axes = [np.load(os.path.join(path, f"{name}.npy")) for name in ("x", "y", "wavelengths")]
+        cube = np.load(os.path.join(path, "cube.npy"), mmap_mode="r")
+        done = np.load(os.path.join(path, "done.npy"), mmap_mode="r+" if writable else "r")
+        return cls(path, cube, done, *axes, metadata, writable)
+
+    @property
+    def shape(self):
+        return self.done.shape
+
+    @property
+    def n_done(self):
+        return int(np.count_nonzero(self.done))
+
+    def write(self, row, column, spectrum, done=True):
+        """Store the spectrum of point (row, column); with `done` also mark the point as done."""
+        self._file.seek(self._offset(row, column))
+        self._file.write(np.asarray(spectrum, dtype=self.cube.dtype).tobytes())
+        if done:
+            self.done[row, column] = True
+
+    def subtract(self, row, column, dark):
+        """Subtract `dark` from the stored spectrum of point (row, column) and mark the point as done."""
+        offset = self._offset(row, column)
+        self._file.seek(offset)
+        spectrum = np.frombuffer(self._file.read(self._spectrum_bytes), dtype=self.cube.dtype) - dark
+        self._file.seek(offset)
+        self._file.write(np.asarray(spectrum, dtype=self.cube.dtype).tobytes())
+        self.done[row, column] = True
+
+    def _offset(self, row, column):
+        return self.cube.offset + (row * self.shape[1] + column) * self._spectrum_bytes
+
+    def read_region(self, rows, columns):
+        """Copy the spectra of a rectangle, e.g. read_region(slice(10, 20), slice(0, 5))."""
+        return np.array(self.cube[rows, columns])
+
+    def integrated(self):
+        """Integrated intensity of every point, NaN where nothing was acquired, summed row by row."""
+        image = np.empty(self.shape)
+        for row in range(self.shape[0]):
+            image[row] = self.cube[row].sum(axis=1, dtype=np.float64)
+        image[~np.asarray(self.done)] = np.nan
+        return image
+
+    def flush(self):
+        """Push written spectra to disk, then the index that marks them as done."""
+        if self._file is not None:
+            self._file.flush()
+            self.done.flush()
+
+    def close(self):
+        """Flush the data and save the metadata, with the timing of the run if it was set."""
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+        if self.timing is not None:
+            self.metadata['Timing'] = self.timing
+        with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(self.metadata, f, indent=1, default=str)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+########################################################################
+# KINETICS STORE
+########################################################################
+
+# A .qkin store is a directory of append-only chunks:
+#   chunk_000000.qspc    up to `chunk_frames` frames in a spectral container
+#   chunk_000000.times   float64 timestamp (time.time(), mid-exposure) of each frame
+#   meta.json            acquisition settings and, once closed, the timing
+KINETICS_EXTENSION = ".qkin"
+
+
+class KineticsWriter:
+    """Stream timestamped frames of a kinetics run into fixed-size chunks, for as long as it lasts."""
+    def __init__(self, path, wavelengths, chunk_frames=1000, dtype=np.float32, metadata=None):
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            # Chunks of an older, longer run would be read back as part of this one
+            if name.startswith("chunk_") or name == "meta.json":
+                os.remove(os.path.join(path, name))
+        self.path = path
+        self.wavelengths = np.asarray(wavelengths, dtype=np.float64)
+        self.chunk_frames = max(int(chunk_frames), 1)
+        self.dtype = dtype
+        self.metadata = dict(metadata or {})
+        self.timing = None
+        self.n_frames = 0
+        self.n_chunks = 0
+        self._chunk = None
+        self._times = None
+        self._write_metadata()
+
+    def _write_metadata(self):
+        metadata = dict(self.metadata)
+        if self.timing is not None:
+            metadata['Timing'] = self.timing
+        with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=1, default=str)
+
+    def _close_chunk(self):
+        if self._chunk is not None:
+            self._chunk.close()
+            self._times.close()
+            self._chunk = self._times = None
+
+    def append(self, t, spectrum):
+        """Append one frame taken at time `t`, starting a new chunk when the current one is full."""
+        if self._chunk is not None and self._chunk.n_frames >= self.chunk_frames:
+            self._close_chunk()
+        if self._chunk is None:
+            name = os.path.join(self.path, f"chunk_{self.n_chunks:06d}")
+            self._chunk = ContainerWriter(name + CONTAINER_EXTENSION, self.wavelengths, self.dtype)
+            self._times = open(name + ".times", "wb")
+            self.n_chunks += 1
+        self._chunk.append(spectrum)
+        self._times.write(np.float64(t).tobytes())
+        self.n_frames += 1
+
+    def flush(self):
+        """Push the appended frames to disk, timestamps last so none points to a missing frame."""
+        if self._chunk is not None:
+            self._chunk.flush()
+            self._times.flush()
+
+    def close(self):
+        """Close the last chunk and save the metadata, with the timing of the run if it was set."""
+        self._close_chunk()
+        self._write_metadata()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class KineticsRecording:
+    """A kinetics store opened for reading: frame timestamps up front, frames from their chunks on demand."""
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.metadata = json.load(f)
+        self.chunks = []
+        times = []
+        index = 0
+        while os.path.exists(os.path.join(path, f"chunk_{index:06d}{CONTAINER_EXTENSION}")):
+            name = os.path.join(path, f"chunk_{index:06d}")
+            chunk = read_container(name + CONTAINER_EXTENSION)
+            chunk_times = np.fromfile(name + ".times", dtype="<f8")
+            n = min(chunk.n_frames, chunk_times.size)  # A chunk being written may be ahead of one or the other
+            self.chunks.append(chunk.frames[:n])
+            times.append(chunk_times[:n])
+            index += 1
+        self.wavelengths = chunk.wavelengths if self.chunks else np.empty(0)
+        self.times = np.concatenate(times) if times else np.empty(0)
+
+    @property
+    def n_frames(self):
+        return self.times.size
+
+    def frames(self, start=0, stop=None):
+        """Copy of frames [start, stop) as float64, read from the chunks that hold them."""
+        stop = self.n_frames if stop is None else min(stop, self.n_frames)
+        parts = []
+        offset = 0
+        for chunk in self.chunks:
+            first, last = max(start - offset, 0), min(stop - offset, len(chunk))
+            if first < last:
+                parts.append(np.asarray(chunk[first:last], dtype=np.float64))
+            offset += len(chunk)
+        return np.concatenate(parts) if parts else np.empty((0, self.wavelengths.size))
+
+    def band(self, low_nm, high_nm):
+        """Integrated intensity (count nm) between two wavelengths in every frame, read chunk by chunk."""
+        low_nm, high_nm = sorted((low_nm, high_nm))
+        inside = (self.wavelengths >= low_nm) & (self.wavelengths <= high_nm)
+        wavelengths = self.wavelengths[inside]
+        values = [trapezoid(np.asarray(chunk[:, inside], dtype=np.float64), wavelengths, axis=1)
+                  for chunk in self.chunks]
+        return np.concatenate(values) if values else np.empty(0)
+
+########################################################################
+# ASYNCHRONOUS WRITER
+########################################################################
+
+class AsyncFileWriter:
+    """Dedicated thread that runs disk writes from a bounded job queue, in submission order."""
+    def __init__(self, max_jobs=32, on_done=None, on_error=None):
+        self.on_done = on_done
+        self.on_error = on_error
+        self._jobs = queue.Queue(maxsize=max_jobs)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="AsyncFileWriter", daemon=True)
+        self._thread.start()
+
+    def submit(self, description, function, *args, timeout=None, **kwargs):
+        """Queue `function(*args, **kwargs)`, waiting up to `timeout` s for room (then queue.Full)."""
+        if self._closed:
+            raise RuntimeError("The file writer has been closed")
+        self._jobs.put((description, function, args, kwargs), timeout=timeout)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job is None:
+                    return
+                description, function, args, kwargs = job
+                try:
+                    function(*args, **kwargs)
+                except Exception as e:
+                    if self.on_error is not None:
+                        self.on_error(description, str(e))
+                else:
+                    if self.on_done is not None:
+                        self.on_done(description)
+            finally:
+                self._jobs.task_done()
+
+    @property
+    def pending(self):
+        """Number of jobs queued or running."""
+        return self._jobs.unfinished_tasks
+
+    def flush(self, timeout=None):
+        """Wait until every submitted job has run. Returns False on timeout."""
+        with self._jobs.all_tasks_done:
+            if timeout is None:
+                while self._jobs.unfinished_tasks:
+                    self._jobs.all_tasks_done.wait()
+                return True
+            return self._jobs.all_tasks_done.wait_for(lambda: not self._jobs.unfinished_tasks, timeout)
+
+    def close(self):
+        """Run the remaining jobs, then stop the thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._jobs.put(None)
+        self._thread.join()
@@ -0,0 +1,85 @@
+"""Burst acquisition on both paths and the block update of RunningAverage."""
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+from acquisition import acquire_burst, RunningAverage, SimulatedSpectrometer
+
+
+@pytest.fixture(params=["hardware", "software"])
+def device(request):
+    buffer_capacity = 64 if request.param == "hardware" else None
+    spectrometer = SimulatedSpectrometer(pixels=256, buffer_capacity=buffer_capacity, dark_counts=1000)
+    return request.param, spectrometer
+
+
+def test_burst_averages_every_scan(device):
+    path, spectrometer = device
+    progress = []
+    average = acquire_burst(spectrometer, 1000, 200, progress_callback=progress.append)
+    assert average.timing['burst'] == path
+    assert average.count == average.timing['frames'] == 200
+    expected = spectrometer.dark_counts + spectrometer._signal()
+    # Scans carry Gaussian noise of 5 counts: the mean of 200 is within 5 / sqrt(200) per pixel
+    assert np.abs(average.mean - expected).max() < 6 * 5 / np.sqrt(200)
+    assert np.median(average.std) == pytest.approx(5, rel=0.2)
+    assert progress[-1] == 100
+    assert progress == sorted(progress)
+
+
+def test_burst_timestamps(device):
+    _, spectrometer = device
+    average = acquire_burst(spectrometer, 1000, 50)
+    assert average.timestamps.shape == (50,)
+    assert np.all(np.diff(average.timestamps) >= 0)
+    assert 0 <= average.timestamps[-1] <= average.timing['elapsed_s']
+
+
+def test_burst_leaves_the_buffer_disarmed():
+    spectrometer = SimulatedSpectrometer(pixels=64, buffer_capacity=16)
+    acquire_burst(spectrometer, 1000, 40)  # More scans than the buffer holds
+    assert not spectrometer.features['fast_buffer'][0].get_buffering_enable()
+    assert spectrometer.features['data_buffer'][0].get_number_of_elements() == 0
+
+
+def test_burst_cancelled(device):
+    _, spectrometer = device
+    cancel = threading.Event()
+    cancel.set()
+    assert acquire_burst(spectrometer, 1000, 50, cancel_event=cancel) is None
+    assert not spectrometer._buffering
+
+
+@pytest.mark.parametrize("blocks", [[1000], [1, 1, 998], [3, 500, 1, 496], [250] * 4])
+def test_add_block_matches_plain_mean(blocks):
+    rng = np.random.default_rng(1)
+    scans = rng.normal(1000.0, 20.0, (sum(blocks), 32)) + np.linspace(0, 500, 32)
+    average = RunningAverage()
+    start = 0
+    for size in blocks:
+        average.add_block(scans[start:start + size])
+        start += size
+    assert average.count == len(scans)
+    np.testing.assert_allclose(average.mean, scans.mean(axis=0), rtol=1e-12)
+    np.testing.assert_allclose(average.variance, scans.var(axis=0, ddof=1), rtol=1e-9)
+    np.testing.assert_allclose(average.stderr, scans.std(axis=0, ddof=1) / np.sqrt(len(scans)), rtol=1e-9)
+
+
+def test_add_block_mixes_with_add():
+    rng = np.random.default_rng(2)
+    scans = rng.normal(0.0, 1.0, (101, 16))
+    average = RunningAverage(16)
+    average.add(scans[0])
+    average.add_block(scans[1:60])
+    for scan in scans[60:80]:
+        average.add(scan)
+    average.add_block(scans[80:])
+    average.add_block(np.empty((0, 16)))  # An empty batch changes nothing
+    assert average.count == 101
+    np.testing.assert_allclose(average.mean, scans.mean(axis=0), atol=1e-12)
+    np.testing.assert_allclose(average.variance, scans.var(axis=0, ddof=1), rtol=1e-9)
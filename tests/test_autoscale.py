@@ -0,0 +1,53 @@
+"""autoscale_limits on the degenerate inputs a live trace can produce."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+from plotting import autoscale_limits
+
+
+def test_empty():
+    assert autoscale_limits([]) == (0.0, 1.0)
+
+
+def test_single_point():
+    assert autoscale_limits([42.0]) == (0.0, 1.0)
+
+
+def test_all_nan():
+    assert autoscale_limits(np.full(100, np.nan)) == (0.0, 1.0)
+
+
+def test_infinities_are_ignored():
+    y = np.array([np.inf, 1.0, -np.inf, 3.0, np.nan, 2.0])
+    assert autoscale_limits(y, margin=0.0) == (1.0, 3.0)
+    assert autoscale_limits([np.inf, -np.inf, 5.0]) == (0.0, 1.0)
+
+
+def test_margin():
+    assert autoscale_limits([0.0, 10.0], margin=0.1) == pytest.approx((-1.0, 11.0))
+
+
+def test_constant_data_is_padded():
+    low, high = autoscale_limits(np.full(50, 7.0))
+    assert low < 7.0 < high
+    low, high = autoscale_limits(np.zeros(50))
+    assert low < 0.0 < high
+
+
+def test_spike_is_clipped_by_percentile():
+    rng = np.random.default_rng(0)
+    y = rng.normal(100.0, 1.0, 10_000)
+    y[5000] = 1e6  # Cosmic-ray spike
+    assert autoscale_limits(y)[1] > 1e6
+    low, high = autoscale_limits(y, clip_percentile=99.9)
+    assert 90.0 < low < 100.0 < high < 110.0
+
+
+def test_returns_python_floats():
+    low, high = autoscale_limits(np.arange(10, dtype=np.float32))
+    assert type(low) is float and type(high) is float
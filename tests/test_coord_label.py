@@ -0,0 +1,62 @@
+"""Plot updates must reuse the window's single coordinate readout, not add widgets."""
+import os
+import sys
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+from PyQt5 import QtCore, QtWidgets
+
+import qepro_app01
+from acquisition import demo_spectrum
+
+
+def rss_bytes():
+    """Resident set size of this process, read from /proc (Linux only)."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+@pytest.fixture(scope="module")
+def window(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("HOME", str(tmp_path_factory.mktemp("home")))  # Keep the dark library out of the real home
+        for name in ("information", "warning", "critical"):
+            # The demo-mode notice would otherwise block in a modal dialog
+            patch.setattr(QtWidgets.QMessageBox, name, staticmethod(lambda *args, **kwargs: None))
+        app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+        window = qepro_app01.QePro_LIVE_PLOT_APP()
+        window.show()
+        app.processEvents()
+        yield window, app
+        window.close()
+
+
+def run_updates(window, app, n):
+    wavelengths = np.linspace(400, 800, 3648)
+    for _ in range(n):
+        window.update_plot(wavelengths, demo_spectrum())
+        window.update_absorption_plot(wavelengths, np.random.rand(wavelengths.size))
+        app.processEvents()
+
+
+def test_plot_updates_reuse_coordinate_label(window):
+    window, app = window
+    run_updates(window, app, 20)  # Warm-up: lazily created artists and caches
+    labels = window.findChildren(QtWidgets.QLabel)
+    children = len(window.findChildren(QtCore.QObject))
+    for _ in range(5):
+        run_updates(window, app, 10)
+        assert len(window.findChildren(QtCore.QObject)) == children
+    assert window.findChildren(QtWidgets.QLabel) == labels
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="needs /proc to read the RSS")
+def test_plot_updates_keep_memory_flat(window):
+    window, app = window
+    run_updates(window, app, 50)
+    before = rss_bytes()
+    run_updates(window, app, 200)
+    assert rss_bytes() - before < 16 * 2 ** 20
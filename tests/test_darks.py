@@ -0,0 +1,159 @@
+"""The dark library's lookups and persistence, and the interpolated darks of a run."""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+from acquisition import DarkLibrary, DarkTimeline
+
+
+def dark(level, n_pixels=16):
+    return np.full(n_pixels, float(level))
+
+
+def test_lru_eviction():
+    library = DarkLibrary(capacity=2)
+    a = library.key("QEP1", 10_000, 10)
+    b = library.key("QEP1", 20_000, 10)
+    c = library.key("QEP1", 30_000, 10)
+    library.put(a, dark(1))
+    library.put(b, dark(2))
+    assert library.get(a) is not None  # a is now the most recently used
+    library.put(c, dark(3))
+    assert library.get(b) is None
+    assert library.get(a).mean[0] == 1
+    assert library.get(c).mean[0] == 3
+    assert len(library) == 2
+
+
+def test_evicted_darks_are_read_back_from_disk(tmp_path):
+    library = DarkLibrary(capacity=1, directory=str(tmp_path / "darks"))
+    a = library.key("QEP1", 10_000, 10)
+    b = library.key("QEP1", 20_000, 10)
+    library.save(library.put(a, dark(1)))
+    library.save(library.put(b, dark(2)))
+    assert library.get(a).mean[0] == 1
+    assert library.get(b).mean[0] == 2
+
+
+def test_max_age(monkeypatch):
+    library = DarkLibrary(max_age_s=3600)
+    now = time.time()
+    fresh = library.key("QEP1", 10_000, 10)
+    old = library.key("QEP1", 30_000, 10)
+    library.put(fresh, dark(1), acquired=now - 60)
+    library.put(old, dark(3), acquired=now - 7200)
+    assert library.get(fresh) is not None
+    assert library.get(old) is None
+    assert library.find("QEP1", 30_000, 10) is None
+    assert library.find("QEP1", 20_000, 10) is None  # Nothing fresh to interpolate with
+    monkeypatch.setattr(time, "time", lambda: now + 3600)
+    assert library.get(fresh) is None
+    unlimited = DarkLibrary()
+    unlimited.put(old, dark(3), acquired=now - 7200)
+    assert unlimited.get(old) is not None  # Without a limit nothing expires
+
+
+def test_find_matches_serial_number_and_temperature():
+    library = DarkLibrary(temperature_step_c=1.0)
+    library.put(library.key("QEP1", 10_000, 10, -10.2), dark(1))
+    library.put(library.key("QEP2", 10_000, 10, -10.0), dark(2))
+    library.put(library.key("QEP1", 10_000, 10), dark(3))  # No cooler reading
+    assert library.find("QEP1", 10_000, 10, -9.8).mean[0] == 1  # Rounded to the same degree
+    assert library.find("QEP1", 10_000, 10, -12.0) is None
+    assert library.find("QEP2", 10_000, 10, -10.0).mean[0] == 2
+    assert library.find("QEP1", 10_000, 10).mean[0] == 3
+    assert library.find("QEP3", 10_000, 10) is None
+
+
+def test_find_interpolates_integration_time():
+    library = DarkLibrary()
+    library.put(library.key("QEP1", 10_000, 10), dark(100), stderr=dark(3))
+    library.put(library.key("QEP1", 50_000, 10), dark(300), stderr=dark(4))
+    exact = library.find("QEP1", 10_000, 10)
+    assert exact.source == "acquired"
+    found = library.find("QEP1", 20_000, 10)
+    assert found.integration_time_us == 20_000
+    assert found.source == "interpolated between 10 ms and 50 ms"
+    np.testing.assert_allclose(found.mean, 150)
+    np.testing.assert_allclose(found.stderr, np.hypot(0.75 * 3, 0.25 * 4))
+    assert library.find("QEP1", 5_000, 10) is None  # No extrapolation
+    assert library.find("QEP1", 60_000, 10) is None
+
+
+def test_find_prefers_the_most_averaged_dark():
+    library = DarkLibrary()
+    library.put(library.key("QEP1", 10_000, 10), dark(1))
+    library.put(library.key("QEP1", 10_000, 100), dark(2))
+    assert library.find("QEP1", 10_000, 10).mean[0] == 1
+    assert library.find("QEP1", 10_000).mean[0] == 2
+    assert library.find("QEP1", 10_000, 50) is None
+
+
+def test_save_and_reload(tmp_path):
+    directory = str(tmp_path / "darks")
+    library = DarkLibrary(directory=directory)
+    key = library.key("QEP1", 10_000, 10, -10.0)
+    acquired = time.time() - 100
+    frame = library.put(key, np.arange(16.0), stderr=np.ones(16), acquired=acquired)
+    library.save(frame, wavelengths=np.linspace(400, 800, 16))
+    library.save(library.put(library.key("QEP1", 20_000, 10), dark(5)))
+
+    reloaded = DarkLibrary(directory=directory, max_age_s=3600)
+    assert reloaded.keys() == library.keys()
+    frame = reloaded.get(key)
+    np.testing.assert_array_equal(frame.mean, np.arange(16.0))
+    np.testing.assert_array_equal(frame.stderr, np.ones(16))
+    assert frame.acquired == pytest.approx(acquired)
+    assert not frame.mean.flags.writeable
+    assert reloaded.find("QEP1", 20_000, 10).stderr is None
+    assert DarkLibrary(directory=directory, max_age_s=60).get(key) is None
+
+
+def test_save_needs_a_directory():
+    library = DarkLibrary()
+    with pytest.raises(ValueError):
+        library.save(library.put(library.key("QEP1", 10_000, 10), dark(1)))
+
+
+def test_timeline_interpolates_to_the_frame_time():
+    timeline = DarkTimeline()
+    with pytest.raises(RuntimeError):
+        timeline.add_frame(0.5, "before any dark")
+    assert list(timeline.add_dark(0.0, dark(100))) == []
+    for t in (1.0, 2.5, 4.0):
+        timeline.add_frame(t, t)
+    assert timeline.n_pending == 3
+    corrections = dict(timeline.add_dark(4.0, dark(180)))
+    assert timeline.n_pending == 0
+    np.testing.assert_allclose(corrections[1.0], 120)
+    np.testing.assert_allclose(corrections[2.5], 150)
+    np.testing.assert_allclose(corrections[4.0], 180)
+    np.testing.assert_array_equal(timeline.latest, dark(180))
+    assert timeline.times == [0.0, 4.0]
+
+
+def test_timeline_nearest_dark():
+    timeline = DarkTimeline(interpolate=False)
+    list(timeline.add_dark(0.0, dark(100)))
+    timeline.add_frame(1.0, "early")
+    timeline.add_frame(3.0, "late")
+    corrections = dict(timeline.add_dark(4.0, dark(180)))
+    np.testing.assert_allclose(corrections["early"], 100)
+    np.testing.assert_allclose(corrections["late"], 180)
+
+
+def test_timeline_finish_uses_the_last_dark():
+    timeline = DarkTimeline()
+    list(timeline.add_dark(0.0, dark(100)))
+    timeline.add_frame(1.0, "a")
+    timeline.add_frame(2.0, "b")
+    finished = timeline.finish()
+    assert [tag for tag, _ in finished] == ["a", "b"]
+    for _, correction in finished:
+        np.testing.assert_allclose(correction, 100)
+    assert timeline.n_pending == 0
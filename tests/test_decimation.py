@@ -0,0 +1,63 @@
+"""Min/max decimation of long traces, and the error band drawn with the decimated line."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from plotting import decimate_minmax, decimation_indices, SpectrumPlot
+
+X = np.linspace(400, 800, 3648)
+
+
+def test_peaks_survive():
+    y = np.zeros(X.size)
+    y[1234] = 100.0
+    y[2345] = -50.0
+    x_shown, y_shown = decimate_minmax(X, y, 200)
+    assert len(y_shown) <= 400
+    assert y_shown.max() == 100.0 and y_shown.min() == -50.0
+    assert np.all(np.diff(x_shown) >= 0)
+
+
+def test_short_traces_are_kept_whole():
+    keep = decimation_indices(X[:300], np.ones(300), 200)
+    np.testing.assert_array_equal(keep, np.arange(300))
+
+
+def test_indices_match_the_decimated_trace():
+    y = np.random.default_rng(0).normal(size=X.size)
+    for x_range in (None, (500.0, 520.0), (600.0, 700.0)):
+        keep = decimation_indices(X, y, 150, x_range)
+        x_shown, y_shown = decimate_minmax(X, y, 150, x_range)
+        np.testing.assert_array_equal(X[keep], x_shown)
+        np.testing.assert_array_equal(y[keep], y_shown)
+
+
+def band_x(band):
+    vertices = band.get_paths()[0].vertices
+    return np.unique(vertices[:, 0])
+
+
+def test_error_band_follows_the_decimated_line():
+    figure = Figure(figsize=(4, 3), dpi=50)  # 200 px wide: far fewer columns than pixels of the trace
+    canvas = FigureCanvasAgg(figure)
+    plot = SpectrumPlot(canvas, figure.add_subplot())
+    y = 1000 + np.random.default_rng(0).normal(0, 10, X.size)
+    line = plot.show('em', X, y, 'Emission', 'red', 'Counts', errors=np.full(X.size, 5.0))
+    x_line = line.get_xdata()
+    assert len(x_line) < X.size / 4
+    np.testing.assert_array_equal(band_x(plot.bands['em']), np.unique(x_line))
+
+    plot.axes.set_xlim(600, 610)  # Zooming in re-decimates the band with the line
+    x_line = line.get_xdata()
+    np.testing.assert_array_equal(band_x(plot.bands['em']), np.unique(x_line))
+    assert x_line[1] - x_line[0] < 0.2  # Every sample of the zoomed range
+
+    plot.show('em', X, y, 'Emission', 'red', 'Counts')  # Without errors the band goes away
+    assert 'em' not in plot.bands
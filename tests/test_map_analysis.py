@@ -0,0 +1,58 @@
+"""Window images of a map against direct computations on the cube."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+from map_analysis import WindowMaps
+from spectral_io import CubeStore, trapezoid
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    """12x10 map of a band at 600 nm whose height and position vary over the map, on 2000 counts."""
+    path = str(tmp_path_factory.mktemp("maps") / "map.qmap")
+    wavelengths = np.linspace(400, 800, 1044)
+    rng = np.random.default_rng(0)
+    store = CubeStore.create(path, np.arange(10), np.arange(12), wavelengths)
+    for row in range(12):
+        for column in range(10):
+            if (row, column) == (11, 9):
+                continue  # Not acquired
+            centre = 590 + 2 * column
+            spectrum = 2000 + (1000 + 1000 * row) * np.exp(-0.5 * ((wavelengths - centre) / 10) ** 2)
+            store.write(row, column, spectrum + rng.normal(0, 5, wavelengths.size))
+    store.close()
+    return CubeStore.open(path)
+
+
+@pytest.mark.parametrize("directory", [False, True])
+def test_integral_matches_trapezoid(store, directory):
+    window_maps = WindowMaps(store, store.path if directory else None)
+    assert window_maps.cumulative.dtype == np.float32  # Half the size of float64, like the cube
+    cube = np.asarray(store.cube, dtype=np.float64)
+    for low, high in ((599.0, 600.0), (580.0, 620.0), (400.0, 800.0)):
+        first, last = window_maps.window_indices(low, high)
+        expected = trapezoid(cube[:, :, first:last + 1], window_maps.wavelengths[first:last + 1], axis=2)
+        image = window_maps.integral((low, high))
+        assert np.isnan(image[11, 9])
+        done = store.done[:]
+        np.testing.assert_allclose(image[done], expected[done], rtol=1e-4)
+        # Rounding the cumulative integral costs at most a few float32 steps of the whole spectrum's integral
+        total = trapezoid(cube, window_maps.wavelengths, axis=2)
+        assert np.max(np.abs(image[done] - expected[done]) / total[done]) < 3e-7
+
+
+def test_peak_and_fwhm(store):
+    window_maps = WindowMaps(store)
+    peak = window_maps.peak(560, 640)
+    fwhm = window_maps.fwhm(560, 640)
+    centres = 590 + 2 * np.arange(10)
+    # Noise moves the maximum of a broad band by a fraction of a nanometre
+    np.testing.assert_allclose(peak[:11], np.broadcast_to(centres, (11, 10)), atol=1.5)
+    # Half maximum is taken from the baseline of the window, so the width is the band's own FWHM
+    assert np.nanmedian(fwhm) == pytest.approx(2 * np.sqrt(2 * np.log(2)) * 10, rel=0.05)
+    assert np.isnan(peak[11, 9]) and np.isnan(fwhm[11, 9])
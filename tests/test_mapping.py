@@ -0,0 +1,150 @@
+"""Map grids and their trajectories, and headless map acquisition on the simulated stage."""
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+from acquisition import DarkScheduler
+from mapping import acquire_map, HyperspectralMap, MapGrid, SimulatedEmitter, SimulatedStage, TRAJECTORIES
+from spectral_io import CubeStore
+
+
+def test_grid_axes():
+    grid = MapGrid(0, 10, 5, 0, 2.5)
+    np.testing.assert_allclose(grid.x, [0, 2.5, 5, 7.5, 10])
+    np.testing.assert_allclose(grid.y, [5, 2.5, 0])  # Runs backwards when the end is below the start
+    assert grid.shape == (3, 5)
+    assert grid.n_points == 15
+    assert MapGrid(0, 9, 0, 0, 2).x.tolist() == [0, 2, 4, 6, 8]  # Stops at the last whole step
+    with pytest.raises(ValueError):
+        MapGrid(0, 10, 0, 10, 0)
+
+
+def test_raster_and_serpentine_order():
+    grid = MapGrid(0, 2, 0, 2, 1)
+    raster = [(row, column) for row, column, _, _ in grid.points()]
+    serpentine = [(row, column) for row, column, _, _ in grid.points(serpentine=True)]
+    assert raster == [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2), (2, 0), (2, 1), (2, 2)]
+    assert serpentine == [(0, 0), (0, 1), (0, 2), (1, 2), (1, 1), (1, 0), (2, 0), (2, 1), (2, 2)]
+    for row, column, x, y in grid.points(serpentine=True):
+        assert (x, y) == (grid.x[column], grid.y[row])
+
+
+def test_serpentine_saves_the_fly_back():
+    grid = MapGrid(0, 100, 0, 40, 10)
+    stage = SimulatedStage(velocity_um_s=1000)
+    raster = grid.motion_time(stage)
+    serpentine = grid.motion_time(stage, serpentine=True)
+    # 4 row changes of 10 um, plus 10 steps of 10 um in each of the 5 rows
+    assert serpentine == pytest.approx((4 * 10 + 5 * 10 * 10) / 1000)
+    # Raster replaces each row change by a diagonal fly-back across the whole row
+    assert raster == pytest.approx((4 * np.hypot(100, 10) + 5 * 10 * 10) / 1000)
+    assert grid.motion_time(SimulatedStage(velocity_um_s=1000, settle_s=0.01)) > raster
+
+
+def scan(trajectory):
+    stage = SimulatedStage()
+    spectrometer = SimulatedEmitter(stage, pixels=256)
+    grid = MapGrid(0, 96, 0, 96, 8)
+    result = acquire_map(spectrometer, stage, grid, 1000, trajectory=trajectory)
+    return grid, result
+
+
+@pytest.fixture(scope="module")
+def raster_image():
+    return scan('raster')[1].integrated()
+
+
+@pytest.mark.parametrize("trajectory", TRAJECTORIES)
+def test_acquire_map(trajectory, raster_image):
+    grid, result = scan(trajectory)
+    assert isinstance(result, HyperspectralMap)
+    assert result.done.all()
+    assert result.timing['trajectory'] == trajectory
+    assert result.timing['points'] == grid.n_points
+    image = result.integrated()
+    # Every trajectory sees the same sample: the images agree up to the fly scan's placement offsets
+    assert np.corrcoef(image.ravel(), raster_image.ravel())[0, 1] > 0.95
+    if trajectory == 'fly':
+        assert result.timing['max_offset_um'] >= 0  # How far it is depends on the scheduling of the test run
+
+
+def test_fly_map_into_cube_store_with_darks(tmp_path):
+    stage = SimulatedStage()
+    spectrometer = SimulatedEmitter(stage, pixels=256, dark_counts=1000, dark_drift_counts_per_s=50,
+                                    electric_dark_pixels=8)
+    grid = MapGrid(0, 96, 0, 96, 8)
+    path = str(tmp_path / "map.qmap")
+    store = CubeStore.create(path, grid.x, grid.y, spectrometer.wavelengths())
+    lights = []
+    result = acquire_map(spectrometer, stage, grid, 1000, store=store, trajectory='fly',
+                         darks=DarkScheduler(every_frames=40), light_callback=lights.append)
+    result.close()
+    assert spectrometer.light_on
+    assert lights[0] is True and lights[-1] is True
+    store = CubeStore.open(path)
+    assert store.n_done == grid.n_points
+    assert store.timing['darks'] >= 3  # Start, between rows and end
+    # The masked pixels only see the dark, so after correction they are down to the read noise
+    assert abs(float(np.mean(store.cube[..., :8]))) < 5
+
+
+def test_cancelled_map_keeps_the_points_done():
+    cancel = threading.Event()
+    n_points = []
+
+    def on_point(point):
+        n_points.append(point)
+        if len(n_points) == 20:
+            cancel.set()
+
+    stage = SimulatedStage()
+    grid = MapGrid(0, 96, 0, 96, 8)
+    result = acquire_map(SimulatedEmitter(stage, pixels=64), stage, grid, 1000, data_callback=on_point,
+                         cancel_event=cancel)
+    assert result.n_done == 20
+    assert result.done.ravel()[:20].all()
+    assert np.isnan(result.integrated().ravel()[20:]).all()
+
+
+class FailingEmitter(SimulatedEmitter):
+    """Emitter whose reads fail once `fail_after` spectra have been read with the light off."""
+    def __init__(self, stage, fail_after, **kwargs):
+        super().__init__(stage, **kwargs)
+        self.fail_after = fail_after
+        self.dark_reads = 0
+
+    def intensities(self):
+        if not self.light_on:
+            self.dark_reads += 1
+            if self.dark_reads > self.fail_after:
+                raise OSError("USB read failed")
+        return super().intensities()
+
+
+def test_failed_dark_turns_the_light_back_on_and_closes_the_store(tmp_path):
+    stage = SimulatedStage()
+    spectrometer = FailingEmitter(stage, fail_after=2, pixels=64)
+    grid = MapGrid(0, 96, 0, 96, 8)
+    path = str(tmp_path / "map.qmap")
+    store = CubeStore.create(path, grid.x, grid.y, spectrometer.wavelengths())
+    with pytest.raises(OSError, match="USB read failed"):
+        acquire_map(spectrometer, stage, grid, 1000, store=store, darks=DarkScheduler(every_frames=30))
+    assert spectrometer.light_on
+    assert store._file is None  # Closed
+    # The third dark fails: the first 30 points were corrected and are kept, the next 30 never were
+    assert CubeStore.open(path).n_done == 30
+
+
+def test_store_must_fit_the_grid(tmp_path):
+    stage = SimulatedStage()
+    spectrometer = SimulatedEmitter(stage, pixels=64)
+    store = CubeStore.create(str(tmp_path / "small.qmap"), [0.0, 1.0], [0.0], spectrometer.wavelengths())
+    with pytest.raises(ValueError):
+        acquire_map(spectrometer, stage, MapGrid(0, 8, 0, 8, 4), 1000, store=store)
+    with pytest.raises(ValueError):
+        acquire_map(spectrometer, stage, MapGrid(0, 8, 0, 8, 4), 1000, trajectory='spiral')
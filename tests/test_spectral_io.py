@@ -0,0 +1,96 @@
+"""Round trips through the .qspc container and the .qmap cube store."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+from spectral_io import ContainerWriter, CubeStore, read_container, write_container
+
+WAVELENGTHS = np.linspace(400, 800, 128)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_container_round_trip(tmp_path, dtype):
+    path = tmp_path / "a.qspc"
+    frames = np.random.default_rng(0).normal(1000, 50, (5, WAVELENGTHS.size))
+    metadata = {'Device': "QE-PRO DEMO", 'Scans averaged': 20}
+    write_container(path, WAVELENGTHS, frames, dtype=dtype, metadata=metadata)
+    container = read_container(path)
+    assert container.metadata == metadata
+    assert container.n_frames == 5
+    assert container.frames.dtype == np.dtype(dtype)
+    np.testing.assert_array_equal(container.wavelengths, WAVELENGTHS)
+    np.testing.assert_array_equal(container.frames, frames.astype(dtype))
+
+
+def test_container_is_readable_while_written(tmp_path):
+    path = tmp_path / "stream.qspc"
+    with ContainerWriter(path, WAVELENGTHS, dtype=np.float32) as writer:
+        writer.append(np.ones(WAVELENGTHS.size))
+        writer.append(np.full((3, WAVELENGTHS.size), 2.0))
+        writer.flush()
+        assert read_container(path).n_frames == 4
+        writer.append(np.zeros(WAVELENGTHS.size))
+    frames = read_container(path).frames
+    assert frames.shape == (5, WAVELENGTHS.size)
+    np.testing.assert_array_equal(frames[:, 0], [1, 2, 2, 2, 0])
+
+
+def test_empty_container(tmp_path):
+    path = tmp_path / "empty.qspc"
+    ContainerWriter(path, WAVELENGTHS).close()
+    container = read_container(path)
+    assert container.frames.shape == (0, WAVELENGTHS.size)
+    assert container.metadata == {}
+
+
+def test_container_rejects_other_files(tmp_path):
+    path = tmp_path / "spectrum.txt"
+    path.write_text("Wavelength (nm)\tIntensity\n" * 10)
+    with pytest.raises(ValueError):
+        read_container(path)
+    with pytest.raises(ValueError):
+        ContainerWriter(tmp_path / "int.qspc", WAVELENGTHS, dtype=np.int32)
+
+
+def test_cube_store_round_trip(tmp_path):
+    path = str(tmp_path / "map.qmap")
+    x, y = np.arange(4) * 5.0, np.arange(3) * 5.0
+    store = CubeStore.create(path, x, y, WAVELENGTHS, metadata={'Trajectory': 'raster'})
+    assert store.cube.shape == (3, 4, WAVELENGTHS.size)
+    spectra = np.random.default_rng(0).normal(1000, 50, (3, 4, WAVELENGTHS.size)).astype(np.float32)
+    for row in range(3):
+        for column in range(4):
+            if (row, column) != (2, 3):  # Left out, as by a cancelled scan
+                store.write(row, column, spectra[row, column])
+    store.timing = {'points': 11}
+    store.close()
+
+    store = CubeStore.open(path)
+    assert store.n_done == 11
+    assert not store.done[2, 3]
+    assert store.metadata['Trajectory'] == 'raster'
+    assert store.timing == {'points': 11}
+    np.testing.assert_array_equal(store.x, x)
+    np.testing.assert_array_equal(store.y, y)
+    np.testing.assert_array_equal(store.read_region(slice(0, 2), slice(1, 3)), spectra[0:2, 1:3])
+    image = store.integrated()
+    assert np.isnan(image[2, 3])
+    np.testing.assert_allclose(image[:2], spectra[:2].sum(axis=2), rtol=1e-6)
+
+
+def test_cube_store_corrects_pending_points(tmp_path):
+    path = str(tmp_path / "map.qmap")
+    store = CubeStore.create(path, [0.0, 1.0], [0.0], WAVELENGTHS, dtype=np.float64)
+    store.write(0, 0, np.full(WAVELENGTHS.size, 1500.0), done=False)
+    store.write(0, 1, np.full(WAVELENGTHS.size, 1600.0), done=False)
+    assert store.n_done == 0
+    store.subtract(0, 0, np.full(WAVELENGTHS.size, 1000.0))  # Read back before any flush
+    store.close()
+    store = CubeStore.open(path)
+    assert store.done.tolist() == [[True, False]]
+    np.testing.assert_array_equal(store.cube[0, 0], 500.0)
+    np.testing.assert_array_equal(store.cube[0, 1], 1600.0)